@@ -0,0 +1,163 @@
+"""
+Hot/cold archival of closed sales and redemption requests.
+
+Sales in cobrado/cancelado and redemption requests in entregado/rechazado/cancelado_por_cliente whose
+last update is older than the retention window are moved, in primary-key batches, to the
+`salearchive` / `saleitemarchive` / `redemptionrequestarchive` tables of the same database. Each
+batch copies and deletes its rows in one short transaction (so a row is always in exactly one of the
+two tables) and sleeps between batches so request traffic keeps getting the write lock. Re-running
+resumes where it stopped: moved rows are simply no longer candidates. Ids stay unique across both
+tables: the live tables are AUTOINCREMENT (migration 0009_archive_safe_ids), so SQLite never hands
+out an archived id again.
+
+Nothing derived changes: rollup rows are kept as they are (and `rollups.rebuild_rollups` /
+`verify_rollups` read archived sales through `sales_with_archive`), and point balances live on
+ClientProfile. History endpoints union in the archive when called with `include_archived=true`.
+
+Usage (from the project root):
+    python -m backend.archive run [--retention-days 365] [--batch-size 500] [--pause 0.05] [--dry-run]
+    python -m backend.archive status [--retention-days 365]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Sequence
+
+from sqlalchemy import DateTime, delete, func, insert, literal, select, union_all
+from sqlalchemy.engine import Connection, Engine
+
+from .database import (
+    engine, Sale, SaleItem, RedemptionRequest, SaleArchive, SaleItemArchive, RedemptionRequestArchive,
+    SaleStatusEnum, RedemptionRequestStatusEnum, ArchiveRunResult,
+)
+
+DEFAULT_RETENTION_DAYS = 365
+CLOSED_SALE_STATUSES = (SaleStatusEnum.COBRADO, SaleStatusEnum.CANCELADO)
+CLOSED_REDEMPTION_STATUSES = (RedemptionRequestStatusEnum.ENTREGADO, RedemptionRequestStatusEnum.RECHAZADO, RedemptionRequestStatusEnum.CANCELADO_POR_CLIENTE)
+
+sales, sale_items, redemption_requests = Sale.__table__, SaleItem.__table__, RedemptionRequest.__table__
+sale_archive, sale_item_archive, redemption_archive = SaleArchive.__table__, SaleItemArchive.__table__, RedemptionRequestArchive.__table__
+
+SALE_COLUMNS = ("id", "user_id", "sale_date", "updated_at", "status", "total_amount", "discount_amount", "points_earned")
+SALE_ITEM_COLUMNS = ("id", "sale_id", "product_id", "quantity", "price_at_sale", "subtotal")
+REDEMPTION_COLUMNS = ("id", "user_id", "gift_item_id", "points_at_request", "product_details_at_request", "status", "requested_at", "updated_at", "admin_notes")
+
+
+# --- Reading hot + archive ---
+def sales_with_archive(start: datetime, end: datetime):
+    """Sale rows of [start, end) from both tables, as one subquery (same column names as `sale`)."""
+    return union_all(
+        select(*[sales.c[name] for name in SALE_COLUMNS]).where(sales.c.sale_date >= start, sales.c.sale_date < end),
+        select(*[sale_archive.c[name] for name in SALE_COLUMNS]).where(sale_archive.c.sale_date >= start, sale_archive.c.sale_date < end),
+    ).subquery("all_sales")
+
+
+def sale_items_with_archive(start: datetime, end: datetime):
+    """Item rows of sales dated in [start, end) from both tables, with their sale's `sale_date` and `status`."""
+    def branch(item_table, sale_table):
+        return (
+            select(*[item_table.c[name] for name in SALE_ITEM_COLUMNS], sale_table.c.sale_date, sale_table.c.status)
+            .join(sale_table, item_table.c.sale_id == sale_table.c.id)
+            .where(sale_table.c.sale_date >= start, sale_table.c.sale_date < end)
+        )
+    return union_all(branch(sale_items, sales), branch(sale_item_archive, sale_archive)).subquery("all_sale_items")
+
+
+# --- Archival ---
+def _copy_columns(table, columns: Sequence[str], archived_at: datetime):
+    copied = [func.coalesce(table.c[name], 0).label(name) if name == "points_earned" else table.c[name] for name in columns] # salearchive.points_earned is NOT NULL
+    return copied + [literal(archived_at, DateTime).label("archived_at")]
+
+
+def _archive_sales_batch(connection: Connection, ids: Sequence[int], cutoff: datetime, archived_at: datetime) -> tuple:
+    candidates = (sales.c.id.in_(ids), sales.c.status.in_(CLOSED_SALE_STATUSES), sales.c.updated_at < cutoff) # Re-checked under the write lock
+    moved = connection.execute(insert(sale_archive).from_select(list(SALE_COLUMNS) + ["archived_at"], select(*_copy_columns(sales, SALE_COLUMNS, archived_at)).where(*candidates))).rowcount
+    if not moved: return 0, 0
+    moved_ids = select(sale_archive.c.id).where(sale_archive.c.id.in_(ids))
+    items = connection.execute(insert(sale_item_archive).from_select(
+        list(SALE_ITEM_COLUMNS),
+        select(*[sale_items.c[name] for name in SALE_ITEM_COLUMNS]).where(sale_items.c.sale_id.in_(moved_ids)),
+    )).rowcount
+    connection.execute(delete(sale_items).where(sale_items.c.sale_id.in_(moved_ids)))
+    connection.execute(delete(sales).where(sales.c.id.in_(moved_ids)))
+    return moved, items
+
+
+def _archive_redemptions_batch(connection: Connection, ids: Sequence[int], cutoff: datetime, archived_at: datetime) -> int:
+    candidates = (redemption_requests.c.id.in_(ids), redemption_requests.c.status.in_(CLOSED_REDEMPTION_STATUSES), redemption_requests.c.updated_at < cutoff)
+    moved = connection.execute(insert(redemption_archive).from_select(
+        list(REDEMPTION_COLUMNS) + ["archived_at"], select(*_copy_columns(redemption_requests, REDEMPTION_COLUMNS, archived_at)).where(*candidates),
+    )).rowcount
+    if moved: connection.execute(delete(redemption_requests).where(redemption_requests.c.id.in_(select(redemption_archive.c.id).where(redemption_archive.c.id.in_(ids)))))
+    return moved
+
+
+def _candidate_ids(connection: Connection, table, statuses, cutoff: datetime, last_id: int, batch_size: int):
+    return connection.execute(
+        select(table.c.id).where(table.c.id > last_id, table.c.status.in_(statuses), table.c.updated_at < cutoff).order_by(table.c.id).limit(batch_size)
+    ).scalars().all()
+
+
+def archive_closed_records(retention_days: int = DEFAULT_RETENTION_DAYS, batch_size: int = 500, pause_seconds: float = 0.05, max_batches: Optional[int] = None, dry_run: bool = False, target_engine: Engine = engine) -> ArchiveRunResult:
+    """Moves closed sales (with their items) and redemption requests last updated before now - `retention_days`."""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    result = ArchiveRunResult(dry_run=dry_run, cutoff=cutoff)
+    if dry_run:
+        with target_engine.connect() as connection:
+            result.sales = connection.execute(select(func.count()).select_from(sales).where(sales.c.status.in_(CLOSED_SALE_STATUSES), sales.c.updated_at < cutoff)).scalar_one()
+            result.sale_items = connection.execute(
+                select(func.count()).select_from(sale_items).join(sales, sale_items.c.sale_id == sales.c.id).where(sales.c.status.in_(CLOSED_SALE_STATUSES), sales.c.updated_at < cutoff)
+            ).scalar_one()
+            result.redemption_requests = connection.execute(
+                select(func.count()).select_from(redemption_requests).where(redemption_requests.c.status.in_(CLOSED_REDEMPTION_STATUSES), redemption_requests.c.updated_at < cutoff)
+            ).scalar_one()
+        return result
+
+    batches = 0
+    for table, statuses in ((sales, CLOSED_SALE_STATUSES), (redemption_requests, CLOSED_REDEMPTION_STATUSES)):
+        last_id = 0
+        while max_batches is None or batches < max_batches:
+            with target_engine.begin() as connection:
+                ids = _candidate_ids(connection, table, statuses, cutoff, last_id, batch_size)
+                if not ids: break
+                archived_at = datetime.utcnow()
+                if table is sales:
+                    moved, items = _archive_sales_batch(connection, ids, cutoff, archived_at)
+                    result.sales += moved; result.sale_items += items
+                else:
+                    result.redemption_requests += _archive_redemptions_batch(connection, ids, cutoff, archived_at)
+            last_id = ids[-1]
+            batches += 1
+            if pause_seconds: time.sleep(pause_seconds) # Leave the write lock to request traffic
+    return result
+
+
+def _print_status(retention_days: int) -> None:
+    preview = archive_closed_records(retention_days, dry_run=True)
+    with engine.connect() as connection:
+        for label, table in (("sales", sale_archive), ("sale items", sale_item_archive), ("redemption requests", redemption_archive)):
+            print(f"  archived {label:20} {connection.execute(select(func.count()).select_from(table)).scalar_one()}")
+    print(f"  eligible now (closed, updated before {preview.cutoff:%Y-%m-%d}): {preview.sales} sale(s), {preview.sale_items} item(s), {preview.redemption_requests} redemption request(s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move closed sales and redemption requests to the archive tables.")
+    parser.add_argument("command", choices=["run", "status"])
+    parser.add_argument("--retention-days", type=int, default=DEFAULT_RETENTION_DAYS, help="Keep closed records updated within this many days in the hot tables.")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.05, help="Seconds to sleep between batches.")
+    parser.add_argument("--max-batches", type=int, default=None)
+    parser.add_argument("--dry-run", action="store_true", help="Only count what would be archived.")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        _print_status(args.retention_days)
+        return
+    result = archive_closed_records(args.retention_days, batch_size=args.batch_size, pause_seconds=args.pause, max_batches=args.max_batches, dry_run=args.dry_run)
+    action = "would archive" if result.dry_run else "archived"
+    print(f"{action} {result.sales} sale(s) with {result.sale_items} item(s) and {result.redemption_requests} redemption request(s) closed before {result.cutoff:%Y-%m-%d}.")
+    if not result.dry_run and (result.sales or result.redemption_requests): print("Run VACUUM off-hours to return the freed pages to the filesystem.")
+
+
+if __name__ == "__main__":
+    main()
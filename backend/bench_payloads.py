@@ -0,0 +1,107 @@
+"""
+Serialization / bytes-on-wire benchmark for the large list endpoints.
+
+Builds synthetic payloads shaped like the responses of `read_products_filtered` (limit=2000, as the
+admin catalog screen requests), `list_redemption_requests_admin` and the public catalog, then compares
+the default JSONResponse path (before) with ORJSONResponse plus gzip/br compression (after).
+
+Usage (from the project root):
+    python -m backend.bench_payloads [--products 2000] [--redemptions 100] [--catalog 500] [--repeat 5]
+"""
+import argparse
+import time
+from datetime import datetime
+from typing import Callable, List
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import TypeAdapter
+
+from .compression import brotli, compress_body
+from .database import (
+    CatalogEntryApiResponse, CategoryRead, GiftItemRead, ProductRead, RedemptionRequestRead,
+    RedemptionRequestStatusEnum, TagRead, UserRead,
+)
+
+
+def _product(i: int) -> ProductRead:
+    return ProductRead(
+        id=i, name=f"Producto Natura {i}", description="Crema hidratante corporal con aceites naturales " * 3,
+        image_url=f"/static/product_images/{i:08d}_producto.png", price_revista=100.0 + i % 50,
+        price_showroom=(100.0 + i % 50) * 0.80, price_feria=(100.0 + i % 50) * 0.65,
+        stock_actual=i % 40, stock_critico=5,
+        tags=[TagRead(id=t, name=f"tag-{t}") for t in range(i % 5)],
+        category=CategoryRead(id=i % 12, name=f"Categoría {i % 12}", description="Cuidado diario"),
+    )
+
+
+def build_products(n: int) -> List[ProductRead]:
+    return [_product(i) for i in range(1, n + 1)]
+
+
+def build_redemptions(n: int) -> List[RedemptionRequestRead]:
+    now = datetime.utcnow()
+    return [
+        RedemptionRequestRead(
+            id=i, user_id=i % 30, gift_item_id=i % 20, points_at_request=150,
+            product_details_at_request='{"name": "Producto", "description": "...", "price_revista": 120.0}',
+            status=RedemptionRequestStatusEnum.PENDIENTE_APROBACION, requested_at=now, updated_at=now, admin_notes=None,
+            gift_item=GiftItemRead(id=i % 20, product_id=i, points_required=150, stock_available_for_redeem=3,
+                                   is_active_as_gift=True, created_at=now, updated_at=now, product=_product(i)),
+            user=UserRead(id=i % 30, email=f"cliente{i % 30}@example.com", full_name=f"Cliente {i % 30}"),
+        )
+        for i in range(1, n + 1)
+    ]
+
+
+def build_catalog(n: int) -> List[CatalogEntryApiResponse]:
+    now = datetime.utcnow()
+    return [
+        CatalogEntryApiResponse(
+            id=i, product_id=i, is_visible_in_catalog=True, is_sold_out_in_catalog=False, promo_text="¡Oferta!",
+            display_order=i, created_at=now, updated_at=now, catalog_price=None, catalog_image_url=None,
+            product=_product(i), effective_price=(100.0 + i % 50) * 0.80, effective_image_url=None,
+        )
+        for i in range(1, n + 1)
+    ]
+
+
+def _best_of(repeat: int, fn: Callable[[], bytes]) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter(); fn(); best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def bench(label: str, items: list, repeat: int) -> None:
+    # FastAPI first serializes the response_model to JSON-compatible python, then renders it.
+    adapter = TypeAdapter(List[type(items[0])])
+    content = adapter.dump_python(items, mode="json")
+    before_ms = _best_of(repeat, lambda: JSONResponse(content).body)
+    after_ms = _best_of(repeat, lambda: ORJSONResponse(content).body)
+    raw = ORJSONResponse(content).body
+    gzip_ms = _best_of(repeat, lambda: compress_body(raw, "gzip"))
+    gzipped = compress_body(raw, "gzip")
+    print(f"\n{label} ({len(items)} items)")
+    print(f"  before  json.dumps : {before_ms:8.2f} ms  {len(JSONResponse(content).body):>10,} bytes on wire")
+    print(f"  after   orjson     : {after_ms:8.2f} ms  {len(raw):>10,} bytes raw")
+    print(f"          + gzip     : {after_ms + gzip_ms:8.2f} ms  {len(gzipped):>10,} bytes on wire")
+    if brotli is not None:
+        br_ms = _best_of(repeat, lambda: compress_body(raw, "br"))
+        print(f"          + br       : {after_ms + br_ms:8.2f} ms  {len(compress_body(raw, 'br')):>10,} bytes on wire")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--redemptions", type=int, default=100)
+    parser.add_argument("--catalog", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    bench("GET /api/products/ (read_products_filtered)", build_products(args.products), args.repeat)
+    bench("GET /api/admin/redemption-requests/", build_redemptions(args.redemptions), args.repeat)
+    bench("GET /api/catalog/entries/", build_catalog(args.catalog), args.repeat)
+    if brotli is None: print("\n(brotli not installed: br numbers skipped)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+One-time seeding and startup timing.
+
+Seeding (the default site configuration and the first superuser, which costs a bcrypt hash) used to
+run in every worker on every boot. It is now an explicit command, run once per database; startup
+only checks the schema version (see migrations.ensure_schema) and warns when `init` has not been run.
+
+`timed_phase` records how long each startup step takes in `STARTUP_TIMINGS`; `profile_startup`
+(`python -m backend.serve --startup-profile`) imports the app phase by phase, runs the startup
+handlers once and prints the report.
+
+Usage (from the project root):
+    python -m backend.bootstrap init [--admin-email admin@example.com] [--admin-password adminpass]
+    python -m backend.bootstrap profile
+"""
+import argparse
+import importlib
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+DEFAULT_ADMIN_EMAIL = "admin@example.com"
+DEFAULT_ADMIN_PASSWORD = "adminpass"
+
+STARTUP_TIMINGS: Dict[str, float] = {}
+
+# Imported one after the other by profile_startup: each line shows what that module adds on top of the previous ones.
+PROFILE_IMPORTS = ("orjson", "pydantic", "sqlalchemy", "sqlmodel", "fastapi", "passlib.context", "jose", "backend.database", "backend.main")
+
+
+@contextmanager
+def timed_phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = time.perf_counter() - start
+
+
+def is_initialized() -> bool:
+    """One indexed SELECT: cheap enough for every boot."""
+    from sqlmodel import Session, select
+    from .database import engine, User
+    with Session(engine) as session:
+        return session.exec(select(User.id).where(User.is_superuser == True).limit(1)).first() is not None
+
+
+def initialize_site_configuration() -> bool:
+    from sqlmodel import Session
+    from .database import engine, SiteConfiguration
+    from .site_config import invalidate_site_configuration
+    with Session(engine) as session:
+        if session.get(SiteConfiguration, 1): return False
+        session.add(SiteConfiguration()); session.commit()
+    invalidate_site_configuration()
+    return True
+
+
+def create_default_admin(email: str = DEFAULT_ADMIN_EMAIL, password: str = DEFAULT_ADMIN_PASSWORD) -> bool:
+    """Creates the first superuser (with its client profile) unless one already exists."""
+    from sqlmodel import Session
+    from .database import engine, User, ClientProfile
+    from .security import get_password_hash
+    if is_initialized(): return False
+    with Session(engine) as session:
+        admin_user = User(
+            email=email, full_name="Administrador Principal", hashed_password=get_password_hash(password),
+            is_active=True, is_superuser=True, is_seller=False,
+        )
+        admin_user.client_profile = ClientProfile()
+        session.add(admin_user); session.commit()
+    return True
+
+
+def profile_startup() -> List[Tuple[str, float]]:
+    """Imports the app phase by phase, runs its startup and shutdown handlers once, returns the timings."""
+    timings = []
+    for module in PROFILE_IMPORTS:
+        start = time.perf_counter()
+        importlib.import_module(module)
+        timings.append((f"import {module}", time.perf_counter() - start))
+    main_module = importlib.import_module("backend.main")
+    startup_timings = importlib.import_module("backend.bootstrap").STARTUP_TIMINGS # Not ours when run as `python -m backend.bootstrap` (__main__)
+    startup_timings.clear()
+    main_module.on_app_startup()
+    timings.extend((f"startup: {name}", seconds) for name, seconds in startup_timings.items())
+    main_module.on_app_shutdown()
+    return timings
+
+
+def print_profile(timings: List[Tuple[str, float]]) -> None:
+    for name, seconds in timings: print(f"  {seconds * 1000:9.1f} ms  {name}")
+    print(f"  {sum(seconds for _, seconds in timings) * 1000:9.1f} ms  total (python -X importtime gives a per-module breakdown)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a new database, or time the application startup.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    init_parser = subparsers.add_parser("init", help="Create the schema, the default site configuration and the first superuser.")
+    init_parser.add_argument("--admin-email", default=DEFAULT_ADMIN_EMAIL)
+    init_parser.add_argument("--admin-password", default=DEFAULT_ADMIN_PASSWORD)
+    subparsers.add_parser("profile", help="Print per-phase import and startup timings.")
+    args = parser.parse_args()
+
+    if args.command == "profile":
+        print_profile(profile_startup())
+        return
+    from .migrations import ensure_schema
+    print(f"Schema {'created/migrated' if ensure_schema() else 'already current'}.")
+    print("Default site configuration created." if initialize_site_configuration() else "Site configuration already exists.")
+    if create_default_admin(args.admin_email, args.admin_password):
+        print(f"Superuser created: {args.admin_email} / {args.admin_password} (change this password in production!)")
+    else:
+        print("A superuser already exists; default admin creation skipped.")
+
+
+if __name__ == "__main__":
+    main()
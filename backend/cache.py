@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Hashable, Optional
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Small thread-safe in-process LRU cache with an optional TTL.
+
+    Sync endpoints run in the threadpool, so every access takes the lock. Values must be treated as
+    immutable by callers (store frozensets/tuples or serialized payloads, not live ORM objects).
+
+    A reader that fills the cache after a miss should read `generation` before its query and pass it
+    to `set()`: if a write invalidated anything meanwhile, the possibly stale value is not stored.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl_seconds: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._generation = 0 # Bumped by every invalidate()/clear()
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            if generation is not None and generation != self._generation: return # Invalidated since the value was read
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize: self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check (weak comparison, so a proxy's W/ prefix still matches)."""
+    if not if_none_match: return False
+    if if_none_match.strip() == "*": return True
+    return any(candidate.strip().removeprefix("W/") == etag.removeprefix("W/") for candidate in if_none_match.split(","))
+
+
+def http_date(moment: datetime) -> str:
+    """Last-Modified value for a naive UTC datetime."""
+    return format_datetime(moment.replace(microsecond=0, tzinfo=timezone.utc), usegmt=True)
+
+
+def not_modified_since(if_modified_since: Optional[str], last_modified: datetime) -> bool:
+    """If-Modified-Since check at the header's one-second resolution. Only consult it when the request has no If-None-Match."""
+    if not if_modified_since: return False
+    try: since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError): return False
+    if since.tzinfo is None: return False
+    return last_modified.replace(microsecond=0) <= since.astimezone(timezone.utc).replace(tzinfo=None)
@@ -0,0 +1,256 @@
+"""
+Offline catalog: a prebuilt, versioned bundle plus delta sync.
+
+Every write that can change a product's catalog card (the entry itself, or the product's name,
+prices, image, stock, tags, or a tag or category it uses) appends a `catalogchange` row. ORM writes
+are picked up by a `before_flush` listener; set-based writes (bulk repricing) call
+`record_catalog_changes`. The row id is the catalog version; the id of a product's newest row is
+that product's row version (`product_versions`, which keys the product detail cache).
+
+`build_catalog_bundle` writes every visible entry (same shape as GET /api/catalog/entries/) and a
+thumbnail manifest as one gzip JSON file, `catalog-<version>.json.gz`, plus `latest.json` pointing at
+it. GET /api/catalog/bundle serves the latest bundle (rebuilding it first when it is missing or more
+than MAX_DELTA_PRODUCTS changes behind). catalog.js keeps the bundle in localStorage and then only calls
+GET /api/catalog/changes?since=<version>, which returns the entries changed since then. Log rows older
+than the retention window are pruned; clients that are further behind get `full_reload`.
+
+Usage (from the project root):
+    python -m backend.catalog_sync build [--dir static/catalog]
+    python -m backend.catalog_sync prune [--days 30]
+    python -m backend.catalog_sync status
+"""
+import argparse
+import gzip
+import hashlib
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import orjson
+from sqlalchemy import delete, event, func, insert, literal, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session as OrmSession, selectinload
+from sqlmodel import Session
+
+from .database import (
+    engine, Product, ProductRead, ProductTag, Tag, Category, CatalogEntry, CatalogEntryApiResponse, CatalogChange, CatalogChangesResponse, compute_effective_price,
+)
+
+BUNDLE_DIR = os.path.join("static", "catalog")
+LATEST_MANIFEST = "latest.json"
+BUNDLES_KEPT = 3
+MAX_DELTA_PRODUCTS = 500 # Beyond this a delta is no smaller than the bundle
+CHANGE_RETENTION_DAYS = 30
+STATIC_URL_PREFIX = "/static/"
+
+catalog_changes = CatalogChange.__table__
+_build_lock = threading.Lock()
+
+
+# --- Catalog Entry Payloads ---
+def catalog_entry_response(entry: CatalogEntry) -> CatalogEntryApiResponse:
+    product = entry.product
+    effective_price = entry.cached_effective_price if entry.cached_effective_price is not None else compute_effective_price(entry.catalog_price, product.price_showroom, product.price_revista)
+    return CatalogEntryApiResponse(
+        **entry.model_dump(exclude={"cached_effective_price"}), product=ProductRead.model_validate(product),
+        effective_price=effective_price, effective_image_url=entry.catalog_image_url or product.image_url,
+    )
+
+
+def visible_catalog_entries_query():
+    return select(CatalogEntry).where(CatalogEntry.is_visible_in_catalog == True).options(selectinload(CatalogEntry.product).selectinload(Product.tags))
+
+
+# --- Change Log ---
+@event.listens_for(OrmSession, "before_flush")
+def _record_catalog_changes(session, flush_context, instances) -> None:
+    product_ids, tag_ids, category_ids = set(), set(), set()
+    for obj in session.new:
+        if isinstance(obj, CatalogEntry): product_ids.add(obj.product_id)
+    for obj in session.dirty:
+        if isinstance(obj, CatalogEntry) and session.is_modified(obj): product_ids.add(obj.product_id)
+        elif isinstance(obj, Product) and session.is_modified(obj, include_collections=True): product_ids.add(obj.id) # Includes tag changes
+        elif isinstance(obj, Tag) and session.is_modified(obj): tag_ids.add(obj.id)
+        elif isinstance(obj, Category) and session.is_modified(obj): category_ids.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, CatalogEntry): product_ids.add(obj.product_id)
+        elif isinstance(obj, Product): product_ids.add(obj.id)
+        elif isinstance(obj, Tag): tag_ids.add(obj.id)
+        elif isinstance(obj, Category): category_ids.add(obj.id)
+    # A renamed or deleted tag/category changes every product that shows it (autoflush is off inside a flush)
+    if tag_ids: product_ids.update(session.execute(select(ProductTag.product_id).where(ProductTag.tag_id.in_(tag_ids))).scalars())
+    if category_ids: product_ids.update(session.execute(select(Product.id).where(Product.category_id.in_(category_ids))).scalars())
+    product_ids.discard(None)
+    for product_id in sorted(product_ids): session.add(CatalogChange(product_id=product_id))
+
+
+def record_catalog_changes(connection: Connection, product_ids_select) -> None:
+    """For Core UPDATEs that bypass the ORM: logs one change per product id returned by `product_ids_select`."""
+    connection.execute(insert(catalog_changes).from_select(["product_id", "changed_at"], select(product_ids_select.subquery().c[0], literal(datetime.utcnow()))))
+
+
+def current_catalog_version(connection) -> int:
+    return connection.execute(select(func.coalesce(func.max(catalog_changes.c.id), 0))).scalar_one()
+
+
+def product_versions(connection, product_ids: Iterable[int]) -> Dict[int, Tuple[int, Optional[datetime]]]:
+    """
+    {product_id: (row version, last modified)}: the id and time of each product's newest change. Products
+    without a retained change (never edited, or not since the retention window) get the version just
+    below the oldest retained row, so a product's version never goes back to one a cache may still hold.
+    """
+    product_ids = list(product_ids)
+    newest = (
+        select(catalog_changes.c.product_id, func.max(catalog_changes.c.id).label("version"))
+        .where(catalog_changes.c.product_id.in_(product_ids)).group_by(catalog_changes.c.product_id).subquery()
+    )
+    rows = connection.execute(select(newest.c.product_id, newest.c.version, catalog_changes.c.changed_at).join(catalog_changes, catalog_changes.c.id == newest.c.version)).all()
+    versions = {product_id: (version, changed_at) for product_id, version, changed_at in rows}
+    if len(versions) < len(set(product_ids)):
+        oldest = connection.execute(select(catalog_changes.c.id, catalog_changes.c.changed_at).order_by(catalog_changes.c.id).limit(1)).first()
+        unchanged = (oldest.id - 1, oldest.changed_at) if oldest else (0, None)
+        for product_id in product_ids: versions.setdefault(product_id, unchanged)
+    return versions
+
+
+def changed_product_ids(connection, since: int, version: int) -> Tuple[Optional[List[int]], bool]:
+    """(distinct product ids changed in (since, version], complete). Not complete when `since` predates the retained log or is ahead of it."""
+    if since > version: return None, False # Database reset or restored from a backup
+    oldest = connection.execute(select(func.min(catalog_changes.c.id))).scalar_one()
+    if oldest is not None and since < oldest - 1: return None, False # Changes after `since` were pruned
+    rows = connection.execute(
+        select(catalog_changes.c.product_id).where(catalog_changes.c.id > since, catalog_changes.c.id <= version).distinct().limit(MAX_DELTA_PRODUCTS + 1)
+    ).scalars().all()
+    if len(rows) > MAX_DELTA_PRODUCTS: return None, False
+    return list(rows), True
+
+
+def catalog_changes_since(session: Session, since: int) -> CatalogChangesResponse:
+    """
+    The version is read first, so an entry written meanwhile may come back newer than `version`; the
+    next call sends it again, which is harmless (entries replace by product id).
+    """
+    connection = session.connection()
+    version = current_catalog_version(connection)
+    product_ids, complete = changed_product_ids(connection, since, version)
+    if not complete: return CatalogChangesResponse(version=version, full_reload=True)
+    if not product_ids: return CatalogChangesResponse(version=version)
+    entries = session.exec(visible_catalog_entries_query().where(CatalogEntry.product_id.in_(product_ids))).all()
+    visible = {entry.product_id for entry in entries}
+    return CatalogChangesResponse(
+        version=version, entries=[catalog_entry_response(entry) for entry in entries],
+        removed_product_ids=sorted(product_id for product_id in product_ids if product_id not in visible),
+    )
+
+
+def prune_catalog_changes(retention_days: int = CHANGE_RETENTION_DAYS) -> int:
+    """Deletes log rows older than the window; the newest row is always kept so versions keep their meaning."""
+    with engine.begin() as connection:
+        newest = current_catalog_version(connection)
+        cutoff = datetime.utcnow() - timedelta(days=retention_days)
+        return connection.execute(delete(catalog_changes).where(catalog_changes.c.changed_at < cutoff, catalog_changes.c.id < newest)).rowcount
+
+
+# --- Bundle ---
+def _thumbnail_manifest(entries: Iterable[CatalogEntryApiResponse]) -> List[dict]:
+    """One item per distinct image; local files carry size and a content hash so clients can skip unchanged ones."""
+    by_url = {}
+    for entry in entries:
+        url = entry.effective_image_url
+        if not url: continue
+        if url in by_url: # Image shared by several products
+            by_url[url]["product_ids"].append(entry.product_id)
+            continue
+        item = by_url[url] = {"url": url, "product_ids": [entry.product_id]}
+        path = os.path.join("static", url[len(STATIC_URL_PREFIX):]) if url.startswith(STATIC_URL_PREFIX) else None
+        if path and os.path.isfile(path):
+            with open(path, "rb") as image_file: item["sha256"] = hashlib.sha256(image_file.read()).hexdigest()[:16]
+            item["size"] = os.path.getsize(path)
+    return list(by_url.values())
+
+
+def _write_atomically(path: str, data: bytes) -> None:
+    temp_path = f"{path}.tmp-{os.getpid()}"
+    with open(temp_path, "wb") as output: output.write(data)
+    os.replace(temp_path, path)
+
+
+def build_catalog_bundle(directory: str = BUNDLE_DIR, only_if_stale: bool = False) -> dict:
+    """
+    Writes `catalog-<version>.json.gz` and `latest.json`; returns the manifest. Older bundles beyond BUNDLES_KEPT are removed.
+    With `only_if_stale`, returns the latest manifest instead when it is fresh again by the time the lock is held
+    (requests that queued behind a rebuild, or another worker that built it first).
+    """
+    with _build_lock:
+        if only_if_stale:
+            manifest = latest_bundle_manifest(directory)
+            if manifest is not None and not _is_stale(manifest["version"]): return manifest
+        os.makedirs(directory, exist_ok=True)
+        with Session(engine) as session:
+            version = current_catalog_version(session.connection()) # Read first: see catalog_changes_since
+            entries = [catalog_entry_response(entry) for entry in session.exec(visible_catalog_entries_query().order_by(CatalogEntry.display_order, CatalogEntry.id)).all()]
+        generated_at = datetime.utcnow().replace(microsecond=0)
+        payload = {"version": version, "generated_at": generated_at, "entries": [entry.model_dump() for entry in entries], "thumbnails": _thumbnail_manifest(entries)}
+        body = gzip.compress(orjson.dumps(payload), compresslevel=9, mtime=0)
+        filename = f"catalog-{version}.json.gz"
+        _write_atomically(os.path.join(directory, filename), body)
+        manifest = {
+            "version": version, "file": filename, "size": len(body), "sha256": hashlib.sha256(body).hexdigest(),
+            "generated_at": generated_at.isoformat() + "Z", "entries": len(entries),
+        }
+        _write_atomically(os.path.join(directory, LATEST_MANIFEST), orjson.dumps(manifest))
+        bundles = sorted((name for name in os.listdir(directory) if name.startswith("catalog-") and name.endswith(".json.gz")), key=lambda name: int(name[8:-8]))
+        for old_name in bundles[:-BUNDLES_KEPT]:
+            if old_name != filename: os.remove(os.path.join(directory, old_name))
+        return manifest
+
+
+def latest_bundle_manifest(directory: str = BUNDLE_DIR) -> Optional[dict]:
+    try:
+        with open(os.path.join(directory, LATEST_MANIFEST), "rb") as manifest_file: return orjson.loads(manifest_file.read())
+    except (FileNotFoundError, orjson.JSONDecodeError): return None
+
+
+_bundle_cache: Tuple[Optional[str], bytes] = (None, b"")
+
+
+def current_bundle(directory: str = BUNDLE_DIR) -> Tuple[dict, bytes]:
+    """(manifest, gzip bytes) of a bundle at most MAX_DELTA_PRODUCTS changed products behind, building one when needed."""
+    global _bundle_cache
+    manifest = latest_bundle_manifest(directory)
+    if manifest is None or _is_stale(manifest["version"]): manifest = build_catalog_bundle(directory, only_if_stale=True)
+    path = os.path.join(directory, manifest["file"])
+    if _bundle_cache[0] != path:
+        with open(path, "rb") as bundle_file: _bundle_cache = (path, bundle_file.read())
+    return manifest, _bundle_cache[1]
+
+
+def _is_stale(version: int) -> bool:
+    """True when a client holding this bundle would get `full_reload` from /changes (same distinct-product rule)."""
+    with engine.connect() as connection:
+        _, complete = changed_product_ids(connection, version, current_catalog_version(connection))
+    return not complete
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline catalog bundle or maintain the catalog change log.")
+    parser.add_argument("command", choices=["build", "prune", "status"])
+    parser.add_argument("--dir", default=BUNDLE_DIR, help="Bundle output directory.")
+    parser.add_argument("--days", type=int, default=CHANGE_RETENTION_DAYS, help="Change log retention for prune.")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        manifest = build_catalog_bundle(args.dir)
+        print(f"Bundle {manifest['file']}: {manifest['entries']} entries, {manifest['size']} bytes (version {manifest['version']}).")
+    elif args.command == "prune":
+        print(f"{prune_catalog_changes(args.days)} change log row(s) older than {args.days} days deleted.")
+    else:
+        manifest = latest_bundle_manifest(args.dir)
+        with engine.connect() as connection: version = current_catalog_version(connection)
+        if manifest is None: print(f"No bundle in {args.dir}; catalog version {version}.")
+        else: print(f"Bundle {manifest['file']} (version {manifest['version']}, {manifest['entries']} entries, built {manifest['generated_at']}); catalog version {version}.")
+
+
+if __name__ == "__main__":
+    main()
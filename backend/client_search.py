@@ -0,0 +1,265 @@
+"""
+Client search index for the admin clients screen.
+
+`client_search` is an SQLite FTS5 table with the trigram tokenizer over each user's name, email,
+nickname and WhatsApp number reduced to digits (rowid = user id). Triggers on `user` and
+`clientprofile` keep it in step with every write, whatever code path makes it. Migration
+0008_client_search creates the table and triggers; existing rows are indexed by
+`python -m backend.migrations backfill client_search`, and search falls back to the former ILIKE
+filters until that has completed (or when the SQLite build has no FTS5 trigram tokenizer).
+
+Names are indexed without accents (the trigram tokenizer of SQLite < 3.45 cannot fold them). A term
+is first looked up as substrings (every word must appear); when that finds nothing, it is looked up
+again as any of its 4-character pieces (3 for short words), so "rodriguz" or a number with one wrong
+digit still finds the closest clients. Matches are ordered by bm25, name and phone weighted highest;
+terms matching more than RANK_CANDIDATE_LIMIT clients (a common surname) are returned in id order,
+since ranking every match would cost more than the lookup. Terms shorter than a trigram use the
+ILIKE filters.
+
+Usage (from the project root):
+    python -m backend.client_search query TERM [--limit 20]
+    python -m backend.client_search bench [--clients 100000] [--queries 200]
+"""
+import argparse
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import time
+import unicodedata
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import Float, Integer, column, literal_column, select, table, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
+
+FTS_TABLE = "client_search"
+SEARCH_BACKFILL = "client_search"
+MIN_TERM_LENGTH = 3 # One trigram
+PHONE_SIGNIFICANT_DIGITS = 9 # Local mobile number; a typed country code is ignored
+BM25_WEIGHTS = "bm25(client_search, 3.0, 1.0, 2.0, 3.0)" # full_name, email, nickname, phone_digits
+READY_RECHECK_SECONDS = 60
+RANK_CANDIDATE_LIMIT = 2000
+FUZZY_PIECE_LENGTH = 4
+FOLDED_CHARACTERS = {"á": "a", "é": "e", "í": "i", "ó": "o", "ú": "u", "ü": "u", "ñ": "n"}
+
+client_search = table(FTS_TABLE, column("rowid", Integer), column("score", Float))
+
+
+# --- Schema ---
+def _digits_sql(expression: str) -> str:
+    """SQL stripping the usual separators from a phone number (same idea as `phone_digits`)."""
+    for separator in (" ", "-", "+", "(", ")", "."): expression = f"replace({expression}, '{separator}', '')"
+    return expression
+
+
+def _fold_sql(expression: str) -> str:
+    """SQL lowercasing and removing Spanish accents (same as `fold_text` for the characters in FOLDED_CHARACTERS)."""
+    expression = f"lower({expression})" # ASCII only in SQLite: accented capitals are replaced explicitly below
+    for accented, plain in FOLDED_CHARACTERS.items():
+        expression = f"replace(replace({expression}, '{accented}', '{plain}'), '{accented.upper()}', '{plain}')"
+    return expression
+
+
+INDEXED_COLUMNS_SQL = f"u.id, {_fold_sql('u.full_name')}, lower(u.email), {_fold_sql('p.nickname')}, {_digits_sql('p.whatsapp_number')}"
+
+
+def _reindex_user_sql(user_id: str) -> str:
+    return (
+        f"DELETE FROM {FTS_TABLE} WHERE rowid = {user_id}; "
+        f"INSERT INTO {FTS_TABLE} (rowid, full_name, email, nickname, phone_digits) "
+        f'SELECT {INDEXED_COLUMNS_SQL} FROM "user" AS u LEFT JOIN clientprofile AS p ON p.user_id = u.id WHERE u.id = {user_id};'
+    )
+
+
+TRIGGERS = {
+    "client_search_user_ai": f'AFTER INSERT ON "user" BEGIN {_reindex_user_sql("NEW.id")} END',
+    "client_search_user_au": f'AFTER UPDATE OF full_name, email ON "user" BEGIN {_reindex_user_sql("NEW.id")} END',
+    "client_search_user_ad": f'AFTER DELETE ON "user" BEGIN DELETE FROM {FTS_TABLE} WHERE rowid = OLD.id; END',
+    "client_search_profile_ai": f"AFTER INSERT ON clientprofile BEGIN {_reindex_user_sql('NEW.user_id')} END",
+    "client_search_profile_au": f"AFTER UPDATE OF nickname, whatsapp_number, user_id ON clientprofile BEGIN {_reindex_user_sql('OLD.user_id')} {_reindex_user_sql('NEW.user_id')} END",
+    "client_search_profile_ad": f"AFTER DELETE ON clientprofile BEGIN {_reindex_user_sql('OLD.user_id')} END",
+}
+
+
+def create_client_search(connection: Connection) -> bool:
+    """Creates the FTS table and its triggers; False (nothing created) when SQLite lacks FTS5 or the trigram tokenizer (3.34+)."""
+    try:
+        connection.exec_driver_sql(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(full_name, email, nickname, phone_digits, tokenize = 'trigram')")
+    except OperationalError as e:
+        print(f"WARNING:  Client search index not created ({e}); the admin client search keeps using ILIKE")
+        return False
+    for name, body in TRIGGERS.items(): connection.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    return True
+
+
+def backfill_client_search(connection: Connection, first_id: int, last_id: int) -> None:
+    connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid BETWEEN :first_id AND :last_id"), {"first_id": first_id, "last_id": last_id})
+    connection.execute(
+        text(
+            f"INSERT INTO {FTS_TABLE} (rowid, full_name, email, nickname, phone_digits) "
+            f'SELECT {INDEXED_COLUMNS_SQL} FROM "user" AS u LEFT JOIN clientprofile AS p ON p.user_id = u.id WHERE u.id BETWEEN :first_id AND :last_id'
+        ),
+        {"first_id": first_id, "last_id": last_id},
+    )
+
+
+_ready_checked_at: Optional[float] = None
+_ready = False
+
+
+def client_search_ready(connection: Connection) -> bool:
+    """Index exists and its backfill has completed. Cached per process; rechecked every minute until it is ready."""
+    global _ready, _ready_checked_at
+    if _ready or (_ready_checked_at is not None and time.monotonic() - _ready_checked_at < READY_RECHECK_SECONDS): return _ready
+    _ready_checked_at = time.monotonic()
+    exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}).first() is not None
+    completed = exists and connection.execute(
+        text("SELECT 1 FROM backfillcheckpoint WHERE name = :name AND completed_at IS NOT NULL"), {"name": SEARCH_BACKFILL}
+    ).first() is not None
+    _ready = completed
+    return _ready
+
+
+# --- Queries ---
+def fold_text(term: str) -> str:
+    folded = "".join(FOLDED_CHARACTERS.get(character, character) for character in term.lower())
+    return unicodedata.normalize("NFKD", folded).encode("ascii", "ignore").decode() # Any other accent: drop the mark
+
+
+def phone_digits(term: str) -> str:
+    digits = re.sub(r"\D", "", term)
+    return digits[-PHONE_SIGNIFICANT_DIGITS:]
+
+
+def _quote(fragment: str) -> str:
+    return '"' + fragment.replace('"', '""') + '"'
+
+
+def _pieces(word: str) -> List[str]:
+    length = FUZZY_PIECE_LENGTH if len(word) > FUZZY_PIECE_LENGTH else MIN_TERM_LENGTH
+    return [word[i:i + length] for i in range(len(word) - length + 1)]
+
+
+def match_expressions(term: str) -> Optional[tuple]:
+    """(substring expression, fuzzy expression) for FTS5 MATCH, or None when the term is too short for the index."""
+    words = [word for word in re.split(r"\s+", fold_text(term).strip()) if len(word) >= MIN_TERM_LENGTH]
+    digits = phone_digits(term)
+    if len(digits) >= MIN_TERM_LENGTH and len(digits) * 2 >= len(re.sub(r"\s", "", term)): # Mostly digits: a phone number
+        pieces = sorted(set(_pieces(digits)))
+        return f"phone_digits : {_quote(digits)}", " OR ".join(f"phone_digits : {_quote(piece)}" for piece in pieces)
+    if not words: return None
+    pieces = sorted({piece for word in words for piece in _pieces(word)})
+    return " AND ".join(_quote(word) for word in words), " OR ".join(_quote(piece) for piece in pieces)
+
+
+COUNT_MATCHES_SQL = f"SELECT count(*) FROM (SELECT 1 FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :query LIMIT {RANK_CANDIDATE_LIMIT + 1})"
+
+
+def choose_match(term: str, count_matches: Callable[[str], int]) -> Optional[Tuple[str, bool]]:
+    """
+    (MATCH expression, rank with bm25) for `term`: the substring expression, or the fuzzy one when that
+    finds nothing. `count_matches(expression)` counts up to RANK_CANDIDATE_LIMIT + 1 matches (an unranked scan stops there).
+    """
+    expressions = match_expressions(term)
+    if expressions is None: return None
+    exact, fuzzy = expressions
+    expression, matches = exact, count_matches(exact)
+    if not matches: expression, matches = fuzzy, count_matches(fuzzy)
+    return expression, matches <= RANK_CANDIDATE_LIMIT
+
+
+def ranked_user_ids(connection: Connection, term: str):
+    """
+    Subquery (user_id, score) of the users matching `term`, lower score = better (0 for all when the
+    term is too broad to rank), or None when the ILIKE filters should be used instead (index not ready,
+    term too short).
+    """
+    if match_expressions(term) is None or not client_search_ready(connection): return None
+    expression, ranked = choose_match(term, lambda candidate: connection.execute(text(COUNT_MATCHES_SQL), {"query": candidate}).scalar_one())
+    score = literal_column(BM25_WEIGHTS) if ranked else literal_column("0.0")
+    return (
+        select(client_search.c.rowid.label("user_id"), score.label("score"))
+        .select_from(client_search).where(text(f"{FTS_TABLE} MATCH :query").bindparams(query=expression))
+        .subquery("client_matches")
+    )
+
+
+# --- CLI ---
+FIRST_NAMES = ("María", "José", "Ana", "Luis", "Carmen", "Jorge", "Rosa", "Carlos", "Lucía", "Miguel", "Elena", "Pedro", "Sofía", "Juan")
+LAST_NAMES = ("García", "Quispe", "Flores", "Rodríguez", "Sánchez", "Huamán", "Torres", "Mendoza", "Ramírez", "Castillo", "Vargas", "Rojas")
+
+
+def _bench(clients: int, queries: int) -> None:
+    """Seeds a throwaway database with the same table, triggers and index, then times ranked lookups."""
+    path = os.path.join(tempfile.mkdtemp(), "client_search_bench.db")
+    connection = sqlite3.connect(path)
+    connection.executescript(
+        'CREATE TABLE "user" (id INTEGER PRIMARY KEY, email TEXT, full_name TEXT);'
+        "CREATE TABLE clientprofile (id INTEGER PRIMARY KEY, user_id INTEGER UNIQUE, nickname TEXT, whatsapp_number TEXT);"
+        f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(full_name, email, nickname, phone_digits, tokenize = 'trigram');"
+        + "".join(f"CREATE TRIGGER {name} {body};" for name, body in TRIGGERS.items())
+    )
+    rng = random.Random(7)
+    people = []
+    for user_id in range(1, clients + 1):
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}"
+        phone = f"9{rng.randrange(10**8):08d}"
+        people.append((name, phone))
+        connection.execute('INSERT INTO "user" (id, email, full_name) VALUES (?, ?, ?)', (user_id, f"cliente{user_id}@example.com", name))
+        connection.execute("INSERT INTO clientprofile (user_id, nickname, whatsapp_number) VALUES (?, ?, ?)", (user_id, name.split()[0].lower() + str(user_id % 97), f"{phone[:3]} {phone[3:6]} {phone[6:]}"))
+    connection.commit()
+
+    terms = []
+    for _ in range(queries):
+        name, phone = rng.choice(people)
+        terms.append(rng.choice((phone[-6:], f"+51 {phone}", name.split()[1][:-1] + "x", f"{name.split()[0]} {name.split()[2]}")))
+    timings = []
+    count_sql = COUNT_MATCHES_SQL.replace(":query", "?")
+    for term in terms:
+        start = time.perf_counter()
+        expression, ranked = choose_match(term, lambda candidate: connection.execute(count_sql, (candidate,)).fetchone()[0])
+        connection.execute(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ? ORDER BY {BM25_WEIGHTS if ranked else '0.0'}, rowid LIMIT 100", (expression,)
+        ).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    connection.close()
+    os.remove(path)
+    timings.sort()
+    print(f"{clients} clients, {queries} lookups: median {timings[len(timings) // 2]:.2f} ms, p95 {timings[int(len(timings) * 0.95)]:.2f} ms, max {timings[-1]:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the client search index, or benchmark it on synthetic data.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    query_parser = subparsers.add_parser("query", help="Print the ranked matches for a term.")
+    query_parser.add_argument("term")
+    query_parser.add_argument("--limit", type=int, default=20)
+    bench_parser = subparsers.add_parser("bench", help="Time lookups over a throwaway database of synthetic clients.")
+    bench_parser.add_argument("--clients", type=int, default=100000)
+    bench_parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        _bench(args.clients, args.queries)
+        return
+    from .database import engine, User, ClientProfile
+    with engine.connect() as connection:
+        matches = ranked_user_ids(connection, args.term)
+        if matches is None:
+            print("Index not ready or term too short: the admin search uses the ILIKE filters for this term.")
+            return
+        start = time.perf_counter()
+        rows = connection.execute(
+            select(User.id, User.full_name, User.email, ClientProfile.whatsapp_number, matches.c.score)
+            .join(matches, matches.c.user_id == User.id).join(ClientProfile, ClientProfile.user_id == User.id, isouter=True)
+            .order_by(matches.c.score, User.id).limit(args.limit)
+        ).all()
+        elapsed = (time.perf_counter() - start) * 1000
+    for user_id, full_name, email, whatsapp_number, score in rows: print(f"  #{user_id:<7} {score:8.3f}  {full_name or '-':30} {email:32} {whatsapp_number or ''}")
+    print(f"{len(rows)} match(es) in {elapsed:.1f} ms.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import gzip
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try: # Optional dependency: without it only gzip is negotiated
+    import brotli
+except ImportError: # pragma: no cover - depends on the environment
+    brotli = None
+
+# Responses that are already compressed (images) or must not be buffered (SSE) are left alone.
+COMPRESSIBLE_CONTENT_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+NON_COMPRESSIBLE_CONTENT_TYPES = ("text/event-stream",)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Picks "br" or "gzip" from an Accept-Encoding header, honouring q=0 exclusions."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token: continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try: q = float(params[2:])
+            except ValueError: q = 0.0
+        accepted[token] = q
+    if brotli is not None and accepted.get("br", 0) > 0: return "br"
+    if accepted.get("gzip", accepted.get("*", 0)) > 0: return "gzip"
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._impl = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._impl = zlib.compressobj(gzip_level, zlib.DEFLATED, 31) # wbits=31 -> gzip container
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br": return self._impl.process(data) + self._impl.flush()
+        return self._impl.compress(data) + self._impl.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br": return self._impl.finish()
+        return self._impl.flush(zlib.Z_FINISH)
+
+
+def compress_body(body: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 4) -> bytes:
+    if encoding == "br": return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware negotiating br/gzip response compression.
+
+    Single-message responses (every JSON endpoint) are compressed in one shot when they reach
+    `minimum_size`; streaming responses are compressed incrementally chunk by chunk.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[dict] = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                passthrough = (
+                    "content-encoding" in headers
+                    or not content_type.startswith(COMPRESSIBLE_CONTENT_TYPES)
+                    or content_type.startswith(NON_COMPRESSIBLE_CONTENT_TYPES)
+                )
+                if passthrough: await send(message)
+                else: start_message = message # Held until we know the body size
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start_message is not None and not more_body:
+                # Whole response in one message: compress only above the threshold.
+                if len(body) >= self.minimum_size:
+                    body = compress_body(body, encoding, self.gzip_level, self.brotli_quality)
+                    self._mark_encoded(start_message, encoding, len(body))
+                await send(start_message); start_message = None
+                await send({"type": "http.response.body", "body": body})
+                return
+            if start_message is not None:
+                compressor = _Compressor(encoding, self.gzip_level, self.brotli_quality)
+                self._mark_encoded(start_message, encoding, None)
+                await send(start_message); start_message = None
+            chunk = compressor.compress(body) if body else b""
+            if not more_body: chunk += compressor.finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _mark_encoded(start_message: dict, encoding: str, content_length: Optional[int]) -> None:
+        headers = MutableHeaders(raw=start_message["headers"])
+        headers["Content-Encoding"] = encoding
+        headers.add_vary_header("Accept-Encoding")
+        if content_length is None: del headers["Content-Length"]
+        else: headers["Content-Length"] = str(content_length)
+        start_message["headers"] = headers.raw
@@ -1,8 +1,9 @@
-from datetime import datetime
+import os
+from datetime import datetime, date
 from typing import Optional, Any, Dict, List
 
 import enum # Ensure enum is imported
-from sqlalchemy import create_engine, UniqueConstraint # Ensure UniqueConstraint is imported
+from sqlalchemy import create_engine, text, UniqueConstraint, Index # Ensure UniqueConstraint is imported
 from sqlmodel import Field, Session, SQLModel, Relationship
 from pydantic import model_validator, computed_field, BaseModel
 
@@ -21,10 +22,22 @@ class RedemptionRequestStatusEnum(str, enum.Enum):
     ENTREGADO = "entregado"
     RECHAZADO = "rechazado"
     CANCELADO_POR_CLIENTE = "cancelado_por_cliente"
+
+class StockMovementReasonEnum(str, enum.Enum):
+    VENTA = "venta"
+    CANCELACION = "cancelacion"
+    MANUAL = "manual"
+    CANJE = "canje"
+
+class JobStatusEnum(str, enum.Enum):
+    PENDIENTE = "pendiente"
+    EN_CURSO = "en_curso"
+    COMPLETADO = "completado"
+    FALLIDO = "fallido"
 # --- End of Enum Definitions ---
 
 DATABASE_URL = "sqlite:///./showroom_natura.db"
-engine = create_engine(DATABASE_URL, echo=True)
+engine = create_engine(DATABASE_URL, echo=os.environ.get("SQL_ECHO", "1") != "0") # backend.serve turns statement logging off
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
@@ -60,6 +73,7 @@ class ClientProfileRead(SQLModel): # Forward reference
     client_level: str = "Plata"
     profile_image_url: Optional[str] = None
     available_points: int # Added this as it's in the later full definition
+    client_level_manual: bool = False # Admin form: "Nivel automático" is its negation
 
 class UserReadWithClientProfile(UserRead):
     client_profile: Optional[ClientProfileRead] = None
@@ -76,7 +90,9 @@ class ClientProfile(ClientProfileBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id", unique=True, index=True)
     available_points: int = Field(default=0, ge=0, nullable=False)
+    client_level_manual: bool = Field(default=False, nullable=False, sa_column_kwargs={"server_default": "0"}) # Set by hand: levels.py leaves it alone
     user: User = Relationship(back_populates="client_profile")
+    __table_args__ = (Index("ix_clientprofile_client_level_user_id", "client_level", "user_id"),) # Admin clients list filtered by level
 
 class ClientProfileCreate(ClientProfileBase):
     user_id: int
@@ -87,12 +103,14 @@ class ClientProfileUpdate(SQLModel):
     gender: Optional[str] = None
     client_level: Optional[str] = None
     profile_image_url: Optional[str] = None
+    client_level_manual: Optional[bool] = None # false hands the level back to the nightly recomputation; unset: pinned only if client_level changes
 
 # Redefine ClientProfileRead for full structure (matches the one used in UserReadWithClientProfile)
 class ClientProfileRead(ClientProfileBase): # Inherits from ClientProfileBase
     id: int
     user_id: int
     available_points: int
+    client_level_manual: bool = False
 
 # --- Tag and ProductTag Link Models ---
 class ProductTag(SQLModel, table=True):
@@ -102,6 +120,7 @@ class ProductTag(SQLModel, table=True):
 class Tag(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(index=True, unique=True, max_length=100, nullable=False)
+    name_key: Optional[str] = Field(default=None, index=True, max_length=100) # lower(name); backfilled for old rows by the "tag_name_key" backfill
     products: List["Product"] = Relationship(back_populates="tags", link_model=ProductTag)
 
 class TagBase(SQLModel):
@@ -165,16 +184,25 @@ class Product(ProductBase, table=True):
     category_id: Optional[int] = Field(default=None, foreign_key="category.id", index=True, nullable=True)
     category_obj: Optional[Category] = Relationship(back_populates="products")
     catalog_entry_rel: Optional["CatalogEntry"] = Relationship(back_populates="product")
+    price_showroom_manual: bool = Field(default=False, nullable=False, sa_column_kwargs={"server_default": "0"}) # Set explicitly: bulk repricing leaves it alone
+    price_feria_manual: bool = Field(default=False, nullable=False, sa_column_kwargs={"server_default": "0"})
+    is_low_stock: bool = Field(default=False, nullable=False, sa_column_kwargs={"server_default": "0"}) # Maintained by stock.record_stock_change
+    __table_args__ = (
+        Index("ix_product_stock_actual_stock_critico", "stock_actual", "stock_critico"),
+        Index("ix_product_low_stock", "id", sqlite_where=text("is_low_stock = 1")), # low_stock filter: only the flagged rows are indexed
+    )
 
 class ProductCreate(ProductBase):
     category_id: Optional[int] = Field(default=None)
     tag_names: Optional[List[str]] = Field(default_factory=list)
+    price_showroom_manual: bool = Field(default=False) # Derived by the validator from whether the price was given
+    price_feria_manual: bool = Field(default=False)
     @model_validator(mode='before')
     @classmethod
-    def calculate_derived_prices(cls, values: Dict[str, Any]) -> Dict[str, Any]:
-        price_revista = values.get('price_revista', 0.0)
-        if 'price_showroom' not in values or values.get('price_showroom') is None: values['price_showroom'] = price_revista * 0.80
-        if 'price_feria' not in values or values.get('price_feria') is None: values['price_feria'] = price_revista * 0.65
+    def flag_manual_prices(cls, values: Dict[str, Any]) -> Dict[str, Any]:
+        # Prices left empty are derived by the handler (pricing.fill_derived_prices): they need the configured discount
+        values['price_showroom_manual'] = values.get('price_showroom') is not None
+        values['price_feria_manual'] = values.get('price_feria') is not None
         return values
 
 class ProductUpdate(SQLModel):
@@ -188,13 +216,16 @@ class ProductUpdate(SQLModel):
     price_feria: Optional[float] = None
     stock_actual: Optional[int] = None
     stock_critico: Optional[int] = None
+    price_showroom_manual: Optional[bool] = None # false hands the price back to bulk repricing
+    price_feria_manual: Optional[bool] = None
     @model_validator(mode='before')
     @classmethod
-    def calculate_derived_prices_on_update(cls, values: Dict[str, Any]) -> Dict[str, Any]:
-        if 'price_revista' in values and values['price_revista'] is not None:
-            price_revista = values['price_revista']
-            if 'price_showroom' not in values or values.get('price_showroom') is None: values['price_showroom'] = price_revista * 0.80
-            if 'price_feria' not in values or values.get('price_feria') is None: values['price_feria'] = price_revista * 0.65
+    def flag_manual_prices_on_update(cls, values: Dict[str, Any]) -> Dict[str, Any]:
+        if values.get('price_showroom') is not None: values['price_showroom_manual'] = True
+        if values.get('price_feria') is not None: values['price_feria_manual'] = True
+        if values.get('price_revista') is not None: # The handler re-derives the prices not given (pricing.fill_derived_prices)
+            if values.get('price_showroom') is None: values['price_showroom_manual'] = False
+            if values.get('price_feria') is None: values['price_feria_manual'] = False
         return values
 
 # Full definition of ProductRead (it was forward-declared earlier)
@@ -243,6 +274,7 @@ class Sale(SQLModel, table=True):
     points_earned: Optional[int] = Field(default=0)
     user: User = Relationship(back_populates="sales")
     items: List["SaleItem"] = Relationship(back_populates="sale", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
+    __table_args__ = (Index("ix_sale_user_id_status", "user_id", "status"), {"sqlite_autoincrement": True}) # Index: non-admin dashboard cards. AUTOINCREMENT: ids of archived sales are never handed out again
 
 class SaleItemBase(SQLModel):
     product_id: int = Field(gt=0)
@@ -258,6 +290,7 @@ class SaleItem(SQLModel, table=True):
     subtotal: float = Field(default=0.0, ge=0, nullable=False)
     sale: Sale = Relationship(back_populates="items")
     product: Product = Relationship()
+    __table_args__ = {"sqlite_autoincrement": True} # Same as Sale: archived ids stay unique
 
 class SaleItemCreate(SaleItemBase):
     pass
@@ -325,9 +358,17 @@ class CatalogEntry(SQLModel, table=True):
     display_order: int = Field(default=0)
     catalog_price: Optional[float] = Field(default=None)
     catalog_image_url: Optional[str] = Field(default=None, max_length=512)
+    cached_effective_price: Optional[float] = Field(default=None) # See compute_effective_price; backfilled by "catalog_effective_price"
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow, sa_column_kwargs={"onupdate": datetime.utcnow})
     product: Product = Relationship(back_populates="catalog_entry_rel")
+    __table_args__ = (Index("ix_catalogentry_visible_display_order", "is_visible_in_catalog", "display_order"),) # Public catalog listing
+
+def compute_effective_price(catalog_price: Optional[float], price_showroom: Optional[float], price_revista: float) -> float:
+    """Price shown in the catalog: the catalog override, else the showroom price, else the magazine price."""
+    if catalog_price is not None: return catalog_price
+    if price_showroom is not None: return price_showroom
+    return price_revista
 
 class CatalogEntryBase(SQLModel):
     product_id: int
@@ -434,6 +475,10 @@ class SiteConfiguration(SQLModel, table=True):
     showroom_address: Optional[str] = Field(default=None, max_length=1024)
     system_param_points_per_currency_unit: Optional[float] = Field(default=0.1, ge=0)
     system_param_default_showroom_discount_percentage: Optional[int] = Field(default=20, ge=0, le=100)
+    # Client levels from collected (cobrado) sales over the trailing window, see levels.py
+    system_param_client_level_window_days: Optional[int] = Field(default=365, ge=1, sa_column_kwargs={"server_default": "365"})
+    system_param_client_level_oro_min_amount: Optional[float] = Field(default=1000.0, ge=0, sa_column_kwargs={"server_default": "1000.0"})
+    system_param_client_level_diamante_min_amount: Optional[float] = Field(default=3000.0, ge=0, sa_column_kwargs={"server_default": "3000.0"})
     updated_at: datetime = Field(default_factory=datetime.utcnow, sa_column_kwargs={"onupdate": datetime.utcnow}, nullable=False)
 
 class SiteConfigurationRead(SQLModel):
@@ -451,6 +496,9 @@ class SiteConfigurationRead(SQLModel):
     showroom_address: Optional[str]
     system_param_points_per_currency_unit: float
     system_param_default_showroom_discount_percentage: int
+    system_param_client_level_window_days: int = 365
+    system_param_client_level_oro_min_amount: float = 1000.0
+    system_param_client_level_diamante_min_amount: float = 3000.0
     updated_at: datetime
 
 class SiteConfigurationUpdate(SQLModel):
@@ -467,6 +515,9 @@ class SiteConfigurationUpdate(SQLModel):
     showroom_address: Optional[str] = Field(default=None, max_length=1024)
     system_param_points_per_currency_unit: Optional[float] = Field(default=None, ge=0)
     system_param_default_showroom_discount_percentage: Optional[int] = Field(default=None, ge=0, le=100)
+    system_param_client_level_window_days: Optional[int] = Field(default=None, ge=1)
+    system_param_client_level_oro_min_amount: Optional[float] = Field(default=None, ge=0)
+    system_param_client_level_diamante_min_amount: Optional[float] = Field(default=None, ge=0)
 
 # --- Gift Item Model ---
 # Forward declaration for GiftItemRead to be used in RedemptionRequestRead
@@ -489,6 +540,7 @@ class GiftItem(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
     updated_at: datetime = Field(default_factory=datetime.utcnow, sa_column_kwargs={"onupdate": datetime.utcnow}, nullable=False)
     product: Product = Relationship()
+    __table_args__ = (Index("ix_giftitem_active_points_required", "is_active_as_gift", "points_required"),) # Client gift list, cheapest first
 
 class GiftItemBase(SQLModel):
     product_id: int = Field(gt=0)
@@ -504,6 +556,14 @@ class GiftItemUpdate(SQLModel):
     stock_available_for_redeem: Optional[int] = Field(default=None, ge=0)
     is_active_as_gift: Optional[bool] = None
 
+class RedeemableGiftRead(GiftItemRead):
+    affordable: bool # Caller's available_points >= points_required
+    points_missing: int = 0
+
+class RedeemableGiftsResponse(SQLModel):
+    available_points: int
+    gifts: List[RedeemableGiftRead] = []
+
 # Full definition of GiftItemRead (it was forward-declared)
 # class GiftItemRead(GiftItemBase): # No need to redefine if forward was sufficient
 #     id: int
@@ -524,6 +584,11 @@ class RedemptionRequest(SQLModel, table=True):
     admin_notes: Optional[str] = Field(default=None, max_length=512)
     user: User = Relationship()
     gift_item: GiftItem = Relationship()
+    __table_args__ = (
+        Index("ix_redemptionrequest_user_id_requested_at_id", "user_id", "requested_at", "id"), # get_my_redemption_requests
+        Index("ix_redemptionrequest_status_requested_at", "status", "requested_at"), # Admin list filtered by status
+        {"sqlite_autoincrement": True}, # Same as Sale: archived ids stay unique
+    )
 
 class RedemptionRequestBase(SQLModel):
     gift_item_id: int = Field(gt=0)
@@ -550,3 +615,374 @@ class RedemptionRequestRead(SQLModel):
     admin_notes: Optional[str]
     gift_item: GiftItemRead # GiftItemRead is now fully defined or forward-declared
     user: Optional[UserRead] = None
+
+# --- Slim List Schemas ---
+# Flat rows for admin tables, filled from column-only selects (no ORM hydration, no nested models).
+# The full *Read models above stay on the detail endpoints.
+class ProductListItem(SQLModel):
+    id: int
+    name: str
+    image_url: Optional[str] = None
+    price_revista: float
+    price_showroom: Optional[float] = None
+    price_feria: Optional[float] = None
+    stock_actual: int
+    stock_critico: Optional[int] = None
+    category_id: Optional[int] = None
+    category_name: Optional[str] = None
+    price_showroom_manual: bool = False
+    price_feria_manual: bool = False
+    is_low_stock: bool = False
+
+class ClientListItem(SQLModel):
+    id: int # User id
+    email: str
+    full_name: Optional[str] = None
+    is_active: bool
+    nickname: Optional[str] = None
+    whatsapp_number: Optional[str] = None
+    client_level: Optional[str] = None
+    available_points: Optional[int] = None
+
+class SaleListItem(SQLModel):
+    id: int
+    user_id: int
+    user_full_name: Optional[str] = None
+    user_email: Optional[str] = None
+    sale_date: datetime
+    status: SaleStatusEnum
+    total_amount: float
+    points_earned: Optional[int] = None
+    item_count: int = 0
+
+class RedemptionRequestListItem(SQLModel):
+    id: int
+    user_id: int
+    user_full_name: Optional[str] = None
+    user_email: Optional[str] = None
+    gift_item_id: int
+    gift_product_name: Optional[str] = None
+    points_at_request: int
+    status: RedemptionRequestStatusEnum
+    requested_at: datetime
+    updated_at: datetime
+    admin_notes: Optional[str] = None
+
+# --- Migration Bookkeeping Models ---
+class SchemaMigration(SQLModel, table=True):
+    name: str = Field(primary_key=True, max_length=100)
+    applied_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+
+class BackfillCheckpoint(SQLModel, table=True):
+    name: str = Field(primary_key=True, max_length=100)
+    last_id: int = Field(default=0, nullable=False) # Highest primary key already processed
+    rows_done: int = Field(default=0, nullable=False)
+    updated_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    completed_at: Optional[datetime] = Field(default=None)
+
+# --- Cross-Process Cache Invalidation ---
+# One row per cache name; writers bump `version` after committing, every worker process polls the
+# table and clears its local copy when a version moves (see invalidation.py).
+class CacheVersion(SQLModel, table=True):
+    name: str = Field(primary_key=True, max_length=100)
+    version: int = Field(default=0, nullable=False)
+    last_key: Optional[str] = Field(default=None, max_length=100) # Key of a single-key publish; None after a full clear
+    updated_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+
+# --- Cross-Process Admin Events ---
+# Admin live-update events, appended by the worker that raised them and read by every worker's relay
+# thread (see events.py). The row id is the SSE event id in all workers; rows are pruned after an hour.
+class AdminEvent(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    type: str = Field(max_length=50, nullable=False)
+    data: str = Field(default="{}", nullable=False) # JSON
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False, index=True)
+    __table_args__ = {"sqlite_autoincrement": True} # Event ids must keep growing after old rows are pruned
+
+# --- Background Job Models ---
+# Durable queue for deferred side effects (see jobs.py). Rows are inserted in the request's own
+# transaction, so a job exists if and only if the write that scheduled it committed.
+class Job(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str = Field(max_length=100, nullable=False)
+    payload: str = Field(default="{}", nullable=False) # JSON
+    dedupe_key: Optional[str] = Field(default=None, max_length=200, unique=True) # At most one job per key while the row is kept (see jobs.COMPLETED_JOB_RETENTION_DAYS)
+    status: JobStatusEnum = Field(default=JobStatusEnum.PENDIENTE, nullable=False)
+    attempts: int = Field(default=0, nullable=False)
+    max_attempts: int = Field(default=5, nullable=False)
+    run_after: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    locked_at: Optional[datetime] = Field(default=None)
+    last_error: Optional[str] = Field(default=None, max_length=2000)
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    finished_at: Optional[datetime] = Field(default=None)
+    __table_args__ = (Index("ix_job_status_run_after", "status", "run_after"),) # Worker claim query
+
+class JobRead(SQLModel):
+    id: int
+    kind: str
+    payload: str
+    dedupe_key: Optional[str] = None
+    status: JobStatusEnum
+    attempts: int
+    max_attempts: int
+    run_after: datetime
+    last_error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+class JobQueueStatus(SQLModel):
+    counts: Dict[str, int] = {}
+    oldest_pending_at: Optional[datetime] = None
+    workers_running: int = 0
+    recent_failures: List[JobRead] = []
+
+# --- Sales Rollup Models ---
+# Pre-aggregated daily totals, maintained incrementally by sale writes (see rollups.py) and rebuilt
+# for recent days by the nightly compaction job. Revenue on item rollups is the line subtotal
+# (before the sale-level discount); sale rollups carry the net total_amount.
+class SaleDailyRollup(SQLModel, table=True):
+    day: date = Field(primary_key=True)
+    user_id: int = Field(primary_key=True)
+    status: SaleStatusEnum = Field(primary_key=True)
+    sale_count: int = Field(default=0, nullable=False)
+    total_amount: float = Field(default=0.0, nullable=False)
+    discount_amount: float = Field(default=0.0, nullable=False)
+    points_earned: int = Field(default=0, nullable=False)
+
+class SaleItemDailyRollup(SQLModel, table=True):
+    day: date = Field(primary_key=True)
+    product_id: int = Field(primary_key=True)
+    status: SaleStatusEnum = Field(primary_key=True)
+    category_id: Optional[int] = Field(default=None, index=True) # Product's category when last written
+    units: int = Field(default=0, nullable=False)
+    revenue: float = Field(default=0.0, nullable=False)
+    line_count: int = Field(default=0, nullable=False)
+
+class SalesReportRow(SQLModel):
+    period: Optional[str] = None # "2024-05-13" (day), "2024-W20" (week), "2024-05" (month); None for the whole range
+    key: Optional[str] = None # Product/category/user id or status value, depending on group_by
+    label: Optional[str] = None
+    sale_count: int = 0
+    units: int = 0
+    revenue: float = 0.0
+
+class SalesReportResponse(SQLModel):
+    group_by: str
+    period: str
+    date_from: date
+    date_to: date
+    rows: List[SalesReportRow] = []
+
+class RepriceRequest(SQLModel):
+    showroom_discount_percentage: Optional[int] = Field(default=None, ge=0, le=100) # Default: current SiteConfiguration value
+    feria_factor: Optional[float] = Field(default=None, gt=0, le=1) # Default: 0.65
+    category_id: Optional[int] = None
+    dry_run: bool = True
+
+class RepriceChange(SQLModel):
+    product_id: int
+    name: str
+    price_revista: float
+    price_showroom: Optional[float] = None
+    new_price_showroom: Optional[float] = None
+    price_feria: Optional[float] = None
+    new_price_feria: Optional[float] = None
+
+class RepriceResult(SQLModel):
+    dry_run: bool
+    showroom_factor: float
+    feria_factor: float
+    products_scanned: int = 0
+    products_changed: int = 0
+    manual_overrides_kept: int = 0
+    preview: List[RepriceChange] = []
+
+class RollupMismatch(SQLModel):
+    table: str
+    key: str
+    expected: str
+    actual: str
+
+# --- Stock Movement Log ---
+class StockMovement(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    product_id: int = Field(foreign_key="product.id", nullable=False)
+    reason: StockMovementReasonEnum = Field(nullable=False)
+    quantity_change: int = Field(default=0, nullable=False) # stock_after - stock_before
+    stock_before: int = Field(nullable=False)
+    stock_after: int = Field(nullable=False)
+    stock_critico: Optional[int] = None
+    low_stock_entered: Optional[bool] = None # True: fell to/below stock_critico, False: back above it, None: no crossing
+    sale_id: Optional[int] = None
+    user_id: Optional[int] = None # Admin who made a manual change
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    __table_args__ = (
+        Index("ix_stockmovement_product_id_id", "product_id", "id"),
+        Index("ix_stockmovement_alerts", "id", sqlite_where=text("low_stock_entered IS NOT NULL")), # Alert feed
+    )
+
+class StockMovementRead(SQLModel):
+    id: int
+    product_id: int
+    product_name: Optional[str] = None
+    reason: StockMovementReasonEnum
+    quantity_change: int
+    stock_before: int
+    stock_after: int
+    stock_critico: Optional[int] = None
+    low_stock_entered: Optional[bool] = None
+    sale_id: Optional[int] = None
+    user_id: Optional[int] = None
+    created_at: datetime
+
+# --- Client Level Schemas ---
+class ClientLevelChange(SQLModel):
+    user_id: int
+    previous_level: Optional[str] = None
+    new_level: str
+    volume: float # Collected sales in the window
+
+class ClientLevelResult(SQLModel):
+    dry_run: bool
+    window_days: int
+    profiles_scanned: int = 0
+    profiles_changed: int = 0
+    manual_levels_kept: int = 0
+    level_counts: Dict[str, int] = {} # Resulting level -> profiles (non-manual)
+    preview: List[ClientLevelChange] = []
+
+# --- Archive Models ---
+# Closed sales (cobrado/cancelado) and redemption requests (entregado/rechazado/cancelado_por_cliente)
+# moved out of the hot tables by archive.py once older than the retention window. Same columns and
+# ids as the hot rows plus `archived_at`; read-only from the API.
+class SaleArchive(SQLModel, table=True):
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    user_id: int = Field(foreign_key="user.id", nullable=False)
+    sale_date: datetime = Field(nullable=False, index=True)
+    updated_at: datetime = Field(nullable=False)
+    status: SaleStatusEnum = Field(nullable=False, index=True) # Dashboard 'Cobradas' total
+    total_amount: float = Field(default=0.0)
+    discount_amount: Optional[float] = Field(default=0.0)
+    points_earned: int = Field(default=0, nullable=False) # As SaleRead; archive.py copies NULL as 0
+    archived_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    user: User = Relationship()
+    items: List["SaleItemArchive"] = Relationship(back_populates="sale")
+    __table_args__ = (Index("ix_salearchive_user_id_sale_date", "user_id", "sale_date"),) # Sales history with include_archived
+
+class SaleItemArchive(SQLModel, table=True):
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    sale_id: int = Field(foreign_key="salearchive.id", index=True, nullable=False)
+    product_id: int = Field(foreign_key="product.id", index=True, nullable=False)
+    quantity: int = Field(nullable=False)
+    price_at_sale: float = Field(nullable=False)
+    subtotal: float = Field(default=0.0, nullable=False)
+    sale: SaleArchive = Relationship(back_populates="items")
+    product: Product = Relationship()
+
+class RedemptionRequestArchive(SQLModel, table=True):
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    user_id: int = Field(foreign_key="user.id", nullable=False)
+    gift_item_id: int = Field(foreign_key="giftitem.id", nullable=False)
+    points_at_request: int = Field(nullable=False)
+    product_details_at_request: Optional[str] = Field(default=None, max_length=1024)
+    status: RedemptionRequestStatusEnum = Field(nullable=False)
+    requested_at: datetime = Field(nullable=False)
+    updated_at: datetime = Field(nullable=False)
+    admin_notes: Optional[str] = Field(default=None, max_length=512)
+    archived_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    user: User = Relationship()
+    gift_item: GiftItem = Relationship()
+    __table_args__ = (Index("ix_redemptionrequestarchive_user_id_requested_at_id", "user_id", "requested_at", "id"),)
+
+class ArchiveRunResult(SQLModel):
+    dry_run: bool
+    cutoff: datetime
+    sales: int = 0
+    sale_items: int = 0
+    redemption_requests: int = 0
+
+# --- Request Profiler Schemas (captures live in memory, see profiling.py) ---
+class ProfilerSettings(SQLModel):
+    sample_rate: float = 0.0 # Fraction of requests profiled from their start
+    slow_threshold_ms: Optional[float] = None # Requests slower than this are captured; None = off
+    interval_ms: float = 5.0 # Stack sampling interval
+    max_captures: int = 50
+
+class ProfilerSettingsUpdate(SQLModel):
+    sample_rate: Optional[float] = Field(default=None, ge=0, le=1)
+    slow_threshold_ms: Optional[float] = Field(default=None, ge=0) # 0 turns slow capture off
+    interval_ms: Optional[float] = Field(default=None, ge=1, le=1000)
+    max_captures: Optional[int] = Field(default=None, ge=1, le=1000)
+
+class ProfiledStatement(SQLModel):
+    statement: str
+    duration_ms: float
+
+class ProfileCaptureSummary(SQLModel):
+    id: int
+    method: str
+    path: str
+    reason: str # "header", "sampled" or "slow"
+    status_code: Optional[int] = None
+    started_at: datetime
+    duration_ms: float
+    sql_count: int = 0
+    sql_ms: float = 0.0
+    samples: int = 0
+
+class ProfileCaptureRead(ProfileCaptureSummary):
+    query_string: str = ""
+    sql: List[ProfiledStatement] = [] # First MAX_SQL_STATEMENTS statements, in order
+    stacks: Dict[str, int] = {} # Folded stacks ("root;...;leaf") -> sample count
+
+# --- Popularity and Related Products (see popularity.py) ---
+class ProductPopularity(SQLModel, table=True):
+    product_id: int = Field(foreign_key="product.id", primary_key=True)
+    wished_count: int = Field(default=0, nullable=False) # Wishlists holding the product
+    in_cart_count: int = Field(default=0, nullable=False) # Carts holding the product
+    sold_units_recent: int = Field(default=0, nullable=False) # Units in non-cancelled sales of the trailing window
+    score: float = Field(default=0.0, nullable=False, index=True) # popularity_score() of the three counters
+    updated_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+
+class ProductRelation(SQLModel, table=True):
+    product_id: int = Field(foreign_key="product.id", primary_key=True)
+    rank: int = Field(primary_key=True) # 1 = most related
+    related_product_id: int = Field(foreign_key="product.id", nullable=False)
+    score: float = Field(nullable=False) # Cosine similarity of the two products' basket vectors
+    co_occurrences: int = Field(nullable=False)
+
+class PopularityRebuildResult(SQLModel):
+    sold_window_days: int
+    basket_window_days: int
+    products_counted: int = 0
+    baskets: int = 0
+    baskets_skipped: int = 0 # Larger than MAX_BASKET_SIZE
+    relations: int = 0
+    engine: str # "scipy" or "python"
+    seconds: float = 0.0
+
+# --- Reporting Snapshot Schemas (see snapshots.py) ---
+class ReportingSnapshotStatus(SQLModel):
+    enabled: bool
+    serving: str # "snapshot" or "live": where reporting reads go right now
+    taken_at: Optional[datetime] = None
+    age_seconds: Optional[float] = None
+    interval_seconds: float
+    max_age_seconds: float
+    size_bytes: Optional[int] = None
+    last_refresh_seconds: Optional[float] = None # Duration of this process's last refresh
+
+# --- Catalog Sync (see catalog_sync.py) ---
+# Append-only log: every write that can change what a product's catalog card shows adds a row, and
+# the row id is the catalog version. AUTOINCREMENT keeps versions increasing after old rows are pruned.
+class CatalogChange(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    product_id: int = Field(nullable=False, index=True)
+    changed_at: datetime = Field(default_factory=datetime.utcnow, nullable=False, index=True)
+    __table_args__ = {"sqlite_autoincrement": True}
+
+class CatalogChangesResponse(SQLModel):
+    version: int # Pass as `since` on the next call
+    full_reload: bool = False # True: `since` is too old (or too far behind); fetch /api/catalog/bundle instead
+    entries: List[CatalogEntryApiResponse] = [] # Visible entries changed since `since`, to add or replace
+    removed_product_ids: List[int] = [] # Changed products that are no longer (or never were) in the visible catalog
@@ -0,0 +1,235 @@
+"""
+Admin live updates (SSE): an in-process broker plus a relay that shares events between worker processes.
+
+Handlers call `admin_events.publish(type, data)` after their commit. While the relay runs (started
+with the app), the event is appended to the `adminevent` table and every worker's relay thread reads
+new rows every `poll_interval` seconds (the publishing worker right away) and hands them to its local
+subscribers, so an admin sees events raised by any worker. The row id is the event id everywhere,
+which keeps Last-Event-ID meaningful when a reconnect lands on another worker. Without the relay
+(scripts, tests) events go straight to the local subscribers.
+"""
+import asyncio
+import itertools
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, List, Optional
+
+import orjson
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.engine import Engine
+
+from .database import engine, AdminEvent
+
+# --- Event Types ---
+REDEMPTION_CREATED = "redemption.created"
+REDEMPTION_STATUS = "redemption.status"
+SALE_STATUS = "sale.status"
+STOCK_ALERT = "stock.alert" # A product crossed its stock_critico threshold (either way)
+RESYNC = "resync" # Tells a client its delta stream has a gap and it should refetch once
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscription:
+    """One connected stream. Events are handed over on the subscriber's own event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue_size: int):
+        self.loop = loop
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def offer(self, event: Dict[str, Any]) -> None:
+        """Runs on `self.loop`. A consumer that falls `queue_size` events behind gets its backlog replaced by one resync."""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += self.queue.qsize()
+            while not self.queue.empty(): self.queue.get_nowait()
+            self.queue.put_nowait({"id": event["id"], "type": RESYNC, "data": {}})
+
+
+class EventBroker:
+    """
+    In-process pub/sub for admin live updates (SSE).
+
+    `publish` is called from request handlers after their commit succeeded; sync handlers run in the
+    threadpool, so delivery goes through `loop.call_soon_threadsafe`. Subscriber count and per-
+    subscriber queue length are bounded, and a short replay buffer lets a reconnecting client
+    (Last-Event-ID) catch up without a full refetch.
+    """
+
+    def __init__(self, max_subscribers: int = 20, queue_size: int = 200, replay_size: int = 500):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self._subscribers: List[Subscription] = []
+        self._replay: Deque[Dict[str, Any]] = deque(maxlen=replay_size)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.relay: Optional["EventRelay"] = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> Subscription:
+        subscription = Subscription(asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers: raise TooManySubscribers()
+            self._subscribers.append(subscription)
+            if last_event_id is not None:
+                missed = [event for event in self._replay if event["id"] > last_event_id]
+                if self._replay and self._replay[0]["id"] > last_event_id + 1: # Gap older than the replay buffer
+                    missed = [{"id": self._replay[-1]["id"], "type": RESYNC, "data": {}}]
+                for event in missed: subscription.offer(event)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            if subscription in self._subscribers: self._subscribers.remove(subscription)
+
+    def publish(self, event_type: str, data: Dict[str, Any]) -> None:
+        if self.relay is not None and self.relay.running: self.relay.append(event_type, data); return
+        self.deliver({"id": next(self._ids), "type": event_type, "data": data})
+
+    def deliver(self, event: Dict[str, Any]) -> None:
+        """Hands an event that already has its id to this process's subscribers."""
+        with self._lock:
+            self._replay.append(event)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError: # Loop already closed (worker shutting down)
+                self.unsubscribe(subscription)
+
+
+def format_sse(event: Dict[str, Any]) -> bytes:
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (event["id"], event["type"].encode(), orjson.dumps(event["data"]))
+
+
+async def sse_stream(broker: EventBroker, subscription: Subscription, is_disconnected, heartbeat_seconds: float = 15.0):
+    """Yields SSE frames for `subscription` until the client disconnects; comment frames keep proxies from timing out."""
+    try:
+        yield b"retry: 5000\n\n"
+        while not await is_disconnected():
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat_seconds)
+            except asyncio.TimeoutError:
+                yield b": keep-alive\n\n"
+                continue
+            yield format_sse(event)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+class EventRelay:
+    """Moves events between worker processes through the `adminevent` table (see the module docstring)."""
+
+    def __init__(self, broker: EventBroker, target_engine: Engine = engine, poll_interval: float = 1.0, retention_seconds: float = 3600, batch_size: int = 500):
+        self.broker = broker
+        self.engine = target_engine
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self.batch_size = batch_size
+        self._last_id = 0
+        self._next_prune_at = 0.0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        broker.relay = self
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def append(self, event_type: str, data: Dict[str, Any]) -> None:
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(insert(admin_event_log).values(type=event_type, data=orjson.dumps(data).decode(), created_at=datetime.utcnow()))
+        except Exception as e: # Event lost: tell this worker's admins to refetch instead
+            print(f"WARNING:  Could not relay admin event '{event_type}': {e}")
+            self.broker.deliver({"id": self._last_id, "type": RESYNC, "data": {}})
+        self._wake.set()
+
+    def poll_once(self) -> int:
+        """Delivers events appended since the last poll (by any process). Returns how many."""
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                select(admin_event_log.c.id, admin_event_log.c.type, admin_event_log.c.data)
+                .where(admin_event_log.c.id > self._last_id).order_by(admin_event_log.c.id).limit(self.batch_size)
+            ).all()
+        for event_id, event_type, data in rows:
+            self.broker.deliver({"id": event_id, "type": event_type, "data": orjson.loads(data)})
+            self._last_id = event_id
+        if time.monotonic() >= self._next_prune_at:
+            self._next_prune_at = time.monotonic() + self.retention_seconds / 4
+            with self.engine.begin() as connection:
+                connection.execute(delete(admin_event_log).where(admin_event_log.c.created_at < datetime.utcnow() - timedelta(seconds=self.retention_seconds)))
+        return len(rows)
+
+    def start(self) -> None:
+        if self.running: return
+        self._stop.clear()
+        with self.engine.connect() as connection: # Only events raised from now on
+            self._last_id = connection.execute(select(func.coalesce(func.max(admin_event_log.c.id), 0))).scalar_one()
+        self._thread = threading.Thread(target=self._watch, name="admin-event-relay", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set(); self._wake.set()
+        if self._thread is not None: self._thread.join(self.poll_interval * 2)
+        self._thread = None
+
+    def _watch(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self.poll_once() == self.batch_size: continue # More waiting
+            except Exception as e: print(f"WARNING:  Admin event relay poll failed: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+
+admin_event_log = AdminEvent.__table__
+admin_events = EventBroker()
+admin_event_relay = EventRelay(admin_events)
+
+
+def sale_status_delta(sale, previous_status) -> Dict[str, Any]:
+    return {
+        "id": sale.id, "user_id": sale.user_id, "previous_status": getattr(previous_status, "value", previous_status),
+        "status": sale.status.value, "total_amount": sale.total_amount, "updated_at": sale.updated_at or datetime.utcnow(),
+    }
+
+
+def redemption_status_delta(redemption_request) -> Dict[str, Any]:
+    return {
+        "id": redemption_request.id, "status": redemption_request.status.value,
+        "admin_notes": redemption_request.admin_notes, "updated_at": redemption_request.updated_at,
+    }
+
+
+def redemption_created_delta(redemption_request) -> Dict[str, Any]:
+    """Same fields as a RedemptionRequestListItem row, so the admin table can insert it directly."""
+    gift_item = redemption_request.gift_item
+    user = redemption_request.user
+    return {
+        "id": redemption_request.id, "user_id": redemption_request.user_id,
+        "user_full_name": user.full_name if user else None, "user_email": user.email if user else None,
+        "gift_item_id": redemption_request.gift_item_id,
+        "gift_product_name": gift_item.product.name if gift_item and gift_item.product else None,
+        "points_at_request": redemption_request.points_at_request, "status": redemption_request.status.value,
+        "requested_at": redemption_request.requested_at, "updated_at": redemption_request.updated_at,
+        "admin_notes": redemption_request.admin_notes,
+    }
+
+
+def stock_alert_delta(product, movement) -> Dict[str, Any]:
+    return {
+        "product_id": product.id, "product_name": product.name, "low_stock": movement.low_stock_entered,
+        "reason": movement.reason.value, "stock_actual": movement.stock_after, "stock_critico": movement.stock_critico,
+        "created_at": movement.created_at,
+    }
@@ -0,0 +1,123 @@
+"""
+Streaming CSV/XLSX exports for accounting (sales with items, redemption requests, clients).
+
+Rows are read in keyset pages (`WHERE (keys) > (last keys) ORDER BY keys LIMIT n`), each page in its
+own short read transaction on its own connection. Memory stays constant regardless of row count, and
+a large export never holds the SQLite read lock long enough to block checkout or admin writes
+(pysqlite has no server-side cursors, so one long `yield_per` cursor would keep the lock for the
+whole download).
+"""
+import csv
+import enum
+import importlib.util
+import io
+import os
+import tempfile
+from datetime import date, datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, tuple_
+from sqlalchemy.engine import Engine
+
+from .database import engine
+
+# Optional dependency: without it only CSV exports are available. Imported on the first XLSX export,
+# not at startup (openpyxl is the slowest import in the app).
+XLSX_AVAILABLE = importlib.util.find_spec("openpyxl") is not None
+
+EXPORT_FORMATS = ("csv", "xlsx")
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FILE_CHUNK_SIZE = 64 * 1024
+CSV_MEDIA_TYPE = "text/csv; charset=utf-8"
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def iter_export_rows(statement, key_columns: Sequence[Any], batch_size: int = EXPORT_BATCH_SIZE, target_engine: Engine = engine) -> Iterator[List[tuple]]:
+    """
+    Yields pages of rows for a column-only `statement`, keyset-paginated on `key_columns`.
+
+    The key columns must be unique together and non-null (wrap outer-joined keys in coalesce); they
+    are added to the select and stripped from the rows handed back.
+    """
+    width = len(statement.selected_columns)
+    keys = [column.label(f"_export_key_{position}") for position, column in enumerate(key_columns)]
+    paged = statement.add_columns(*keys).order_by(None).order_by(*key_columns).limit(batch_size)
+    last_key = None
+    while True:
+        page = paged if last_key is None else paged.where(tuple_(*key_columns) > tuple_(*last_key))
+        with target_engine.connect() as connection:
+            rows = connection.execute(page).all()
+        if not rows: return
+        yield [tuple(row[:width]) for row in rows]
+        if len(rows) < batch_size: return
+        last_key = tuple(rows[-1][width:])
+
+
+def _csv_cell(value: Any) -> Any:
+    if isinstance(value, enum.Enum): return value.value
+    if isinstance(value, datetime): return value.isoformat(sep=" ", timespec="seconds")
+    if isinstance(value, date): return value.isoformat()
+    return value
+
+
+def _xlsx_cell(value: Any) -> Any:
+    if isinstance(value, enum.Enum): return value.value
+    if isinstance(value, datetime) and value.tzinfo is not None: return value.replace(tzinfo=None) # Excel has no time zones
+    return value
+
+
+def csv_chunks(headers: Sequence[str], pages: Iterator[List[tuple]]) -> Iterator[bytes]:
+    """One encoded chunk per page. The UTF-8 BOM makes Excel read accents correctly."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")
+    writer.writerow(headers)
+    for rows in pages:
+        writer.writerows([_csv_cell(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0); buffer.truncate(0)
+    if buffer.tell(): yield buffer.getvalue().encode("utf-8") # Header only: empty export
+
+
+def xlsx_chunks(headers: Sequence[str], pages: Iterator[List[tuple]], sheet_title: str) -> Iterator[bytes]:
+    """
+    Write-only workbook (rows go straight to openpyxl's temp files, not kept in memory), saved to a
+    temp file and streamed back. The download starts once the workbook has been written.
+    """
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_title)
+    sheet.append(list(headers))
+    for rows in pages:
+        for row in rows: sheet.append([_xlsx_cell(value) for value in row])
+    fd, temp_path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        workbook.save(temp_path)
+        with open(temp_path, "rb") as xlsx_file:
+            while True:
+                chunk = xlsx_file.read(EXPORT_FILE_CHUNK_SIZE)
+                if not chunk: break
+                yield chunk
+    finally:
+        os.remove(temp_path)
+
+
+def export_response(statement, key_columns: Sequence[Any], headers: Sequence[str], basename: str, export_format: str = "csv", target_engine: Engine = engine, extra_headers: Optional[Dict[str, str]] = None) -> StreamingResponse:
+    """StreamingResponse for `statement` as CSV or XLSX, named `<basename>_<today>.<ext>`; pages are read from `target_engine`."""
+    if export_format not in EXPORT_FORMATS: raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    if export_format == "xlsx" and not XLSX_AVAILABLE: raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="XLSX export requires openpyxl on the server; use format=csv")
+    if len(headers) != len(statement.selected_columns): raise ValueError("One header per selected column is required")
+    pages = iter_export_rows(statement, key_columns, target_engine=target_engine)
+    filename = f"{basename}_{date.today().isoformat()}.{export_format}"
+    if export_format == "xlsx": body, media_type = xlsx_chunks(headers, pages, basename[:31]), XLSX_MEDIA_TYPE
+    else: body, media_type = csv_chunks(headers, pages), CSV_MEDIA_TYPE
+    response_headers = {"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store", **(extra_headers or {})}
+    return StreamingResponse(body, media_type=media_type, headers=response_headers)
+
+
+def outer_key(column) -> Any:
+    """Key column from an outer-joined table (e.g. a sale without items): NULL becomes 0."""
+    return func.coalesce(column, 0)
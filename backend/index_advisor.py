@@ -0,0 +1,152 @@
+"""
+Index advisor: runs EXPLAIN QUERY PLAN over the query shapes used by the API endpoints against a
+seeded SQLite database and flags full table scans and temp-B-tree sorts.
+
+Usage (from the project root):
+    python -m backend.index_advisor                      # seeded throwaway DB
+    python -m backend.index_advisor --db showroom_natura.db   # an existing DB (read-only queries)
+    python -m backend.index_advisor --strict             # exit code 1 when a full scan is found
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from sqlalchemy import create_engine, insert, func, or_
+from sqlalchemy.engine import Engine
+from sqlmodel import SQLModel, select
+
+from .database import (
+    User, ClientProfile, Category, Product, Sale, SaleItem, SaleStatusEnum, CatalogEntry, GiftItem,
+    RedemptionRequest, RedemptionRequestStatusEnum, WishlistItem,
+)
+from .migrations import run_migrations
+from .stock import is_low_stock
+
+SAMPLE_USER_ID = 7
+
+
+def seed_database(target_engine: Engine, users: int = 2000, products: int = 3000, sales: int = 20000, redemptions: int = 5000) -> None:
+    """Fills an empty DB with synthetic rows so SQLite's planner sees realistic table sizes."""
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    sale_statuses = list(SaleStatusEnum)
+    redemption_statuses = list(RedemptionRequestStatusEnum)
+    with target_engine.begin() as conn:
+        conn.execute(insert(Category.__table__), [{"id": i, "name": f"Categoria {i}"} for i in range(1, 21)])
+        conn.execute(insert(User.__table__), [
+            {"id": i, "email": f"cliente{i}@example.com", "full_name": f"Cliente {i}", "hashed_password": "x", "is_active": True, "is_superuser": i == 1, "is_seller": False}
+            for i in range(1, users + 1)
+        ])
+        conn.execute(insert(ClientProfile.__table__), [
+            {"user_id": i, "client_level": rng.choice(["Plata", "Oro", "Diamante"]), "available_points": rng.randint(0, 500), "whatsapp_number": f"9{i:08d}"}
+            for i in range(1, users + 1)
+        ])
+        product_rows = [
+            {"id": i, "name": f"Producto {i}", "price_revista": 100.0, "price_showroom": 80.0, "price_feria": 65.0,
+             "stock_actual": rng.randint(0, 50), "stock_critico": rng.choice([0, 5, 10]), "category_id": rng.randint(1, 20)}
+            for i in range(1, products + 1)
+        ]
+        for row in product_rows: row["is_low_stock"] = is_low_stock(row["stock_actual"], row["stock_critico"])
+        conn.execute(insert(Product.__table__), product_rows)
+        conn.execute(insert(CatalogEntry.__table__), [
+            {"product_id": i, "is_visible_in_catalog": rng.random() < 0.8, "is_sold_out_in_catalog": False, "display_order": rng.randint(0, 100), "created_at": now, "updated_at": now}
+            for i in range(1, products + 1, 2)
+        ])
+        conn.execute(insert(GiftItem.__table__), [
+            {"id": i, "product_id": i, "points_required": rng.randint(50, 500), "stock_available_for_redeem": rng.randint(0, 5), "is_active_as_gift": rng.random() < 0.7, "created_at": now, "updated_at": now}
+            for i in range(1, 201)
+        ])
+        conn.execute(insert(Sale.__table__), [
+            {"id": i, "user_id": rng.randint(1, users), "sale_date": now - timedelta(days=rng.randint(0, 700)), "updated_at": now,
+             "status": rng.choice(sale_statuses), "total_amount": 150.0, "discount_amount": 0.0, "points_earned": 15}
+            for i in range(1, sales + 1)
+        ])
+        conn.execute(insert(SaleItem.__table__), [
+            {"sale_id": rng.randint(1, sales), "product_id": rng.randint(1, products), "quantity": 1, "price_at_sale": 80.0, "subtotal": 80.0}
+            for _ in range(sales * 2)
+        ])
+        conn.execute(insert(RedemptionRequest.__table__), [
+            {"user_id": rng.randint(1, users), "gift_item_id": rng.randint(1, 200), "points_at_request": 100,
+             "status": rng.choice(redemption_statuses), "requested_at": now - timedelta(days=rng.randint(0, 365)), "updated_at": now}
+            for _ in range(redemptions)
+        ])
+        wishlist_pairs = {(rng.randint(1, users), rng.randint(1, products)) for _ in range(users * 3)}
+        conn.execute(insert(WishlistItem.__table__), [{"user_id": u, "product_id": p, "added_at": now} for u, p in wishlist_pairs])
+        conn.exec_driver_sql("ANALYZE")
+
+
+def query_shapes(user_id: int = SAMPLE_USER_ID) -> Dict[str, object]:
+    """The WHERE/ORDER BY shapes issued by the endpoints, keyed by endpoint."""
+    a_entregar = or_(Sale.status == SaleStatusEnum.ARMADO, Sale.status == SaleStatusEnum.EN_CAMINO)
+    return {
+        "dashboard cards (client): count Sale by user_id + status": select(func.count(Sale.id)).where(Sale.status == SaleStatusEnum.ENTREGADO, Sale.user_id == user_id),
+        "dashboard /a-entregar (client)": select(func.count(Sale.id)).where(a_entregar, Sale.user_id == user_id),
+        "dashboard /cobradas (admin)": select(func.sum(Sale.total_amount)).where(Sale.status == SaleStatusEnum.COBRADO),
+        "read_products_filtered (low_stock=true)": select(Product).where(Product.is_low_stock == True).order_by(Product.id).limit(100),
+        "read_products_filtered (category_id)": select(Product).where(Product.category_id == 3).order_by(Product.id).limit(100),
+        "read_all_client_profiles_admin_filtered (client_level)": select(User).join(ClientProfile, isouter=True).where(ClientProfile.client_level == "Oro").order_by(User.id).limit(100),
+        "list_redemption_requests_admin (status_filter)": select(RedemptionRequest).where(RedemptionRequest.status == RedemptionRequestStatusEnum.PENDIENTE_APROBACION).order_by(RedemptionRequest.requested_at.desc(), RedemptionRequest.id.desc()).limit(100),
+        "get_my_redemption_requests": select(RedemptionRequest).where(RedemptionRequest.user_id == user_id).order_by(RedemptionRequest.requested_at.desc(), RedemptionRequest.id.desc()).limit(50),
+        "get_user_sales_history": select(Sale).where(Sale.user_id == user_id).limit(100),
+        "public catalog (visible, display_order)": select(CatalogEntry).where(CatalogEntry.is_visible_in_catalog == True).order_by(CatalogEntry.display_order, CatalogEntry.id).limit(50),
+        "wishlist check (user_id, product_id)": select(WishlistItem).where(WishlistItem.user_id == user_id, WishlistItem.product_id == 10),
+        "active gifts by points": select(GiftItem).where(GiftItem.is_active_as_gift == True, GiftItem.stock_available_for_redeem > 0).order_by(GiftItem.points_required),
+    }
+
+
+def explain(target_engine: Engine, statement) -> List[str]:
+    sql = str(statement.compile(dialect=target_engine.dialect, compile_kwargs={"literal_binds": True}))
+    with target_engine.connect() as conn:
+        return [row[3] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+def classify(plan: List[str]) -> Tuple[str, List[str]]:
+    """Returns (verdict, flagged plan lines). "SCAN <table>" without an index is a full table scan."""
+    flagged, verdict = [], "OK"
+    for detail in plan:
+        if detail.startswith("SCAN ") and " INDEX " not in f"{detail} " and "INTEGER PRIMARY KEY" not in detail:
+            flagged.append(detail); verdict = "FULL SCAN"
+        elif "USE TEMP B-TREE" in detail:
+            flagged.append(detail)
+            if verdict == "OK": verdict = "SORT"
+    return verdict, flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN QUERY PLAN report for the API query shapes.")
+    parser.add_argument("--db", help="Existing SQLite file to analyze instead of a seeded throwaway DB.")
+    parser.add_argument("--strict", action="store_true", help="Exit with status 1 when a full table scan is found.")
+    args = parser.parse_args()
+
+    tmp_dir = None
+    if args.db:
+        target_engine = create_engine(f"sqlite:///{args.db}")
+    else:
+        tmp_dir = tempfile.TemporaryDirectory()
+        target_engine = create_engine(f"sqlite:///{os.path.join(tmp_dir.name, 'advisor.db')}")
+        SQLModel.metadata.create_all(target_engine)
+        run_migrations(target_engine)
+        print("Seeding throwaway database...")
+        seed_database(target_engine)
+
+    full_scans = 0
+    for name, statement in query_shapes().items():
+        plan = explain(target_engine, statement)
+        verdict, flagged = classify(plan)
+        full_scans += verdict == "FULL SCAN"
+        print(f"\n[{verdict:9}] {name}")
+        for detail in plan:
+            marker = "  !! " if detail in flagged else "     "
+            print(f"{marker}{detail}")
+    print(f"\n{full_scans} query shape(s) with full table scans.")
+    target_engine.dispose()
+    if tmp_dir is not None: tmp_dir.cleanup()
+    if args.strict and full_scans: sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Cross-process invalidation for the in-process caches (site configuration, redeemable gifts,
+wishlist ids).
+
+Every worker process keeps its own LRUCache copies. `invalidation.publish(name)` clears the local
+copy and bumps `cacheversion.version` for `name`; a daemon thread in every process reads the (tiny)
+version table every `poll_interval` seconds and runs the registered callbacks for names whose
+version moved. Other workers therefore serve stale data for at most one poll interval, instead of
+for the cache TTL. With a single worker the poll is one cheap SELECT per second.
+
+Per-user caches publish a single key (`publish(name, key=...)`): the version row remembers it, and a
+worker that sees exactly one new version drops only that key. If it missed versions in between it
+clears the whole cache, as for a full publish.
+"""
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Hashable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Engine
+
+from .database import engine, CacheVersion
+
+cache_versions = CacheVersion.__table__
+
+
+class InvalidationChannel:
+    def __init__(self, target_engine: Engine = engine, poll_interval: float = 1.0):
+        self.engine = target_engine
+        self.poll_interval = poll_interval
+        self._callbacks: Dict[str, List[Callable[[], None]]] = {}
+        self._key_callbacks: Dict[str, List[Callable[[str], None]]] = {}
+        self._seen: Optional[Dict[str, int]] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, name: str, callback: Callable[[], None], key_callback: Optional[Callable[[str], None]] = None) -> None:
+        """`callback` clears this process's copy of cache `name`; `key_callback(key)` drops one key (received as a string)."""
+        self._callbacks.setdefault(name, []).append(callback)
+        if key_callback is not None: self._key_callbacks.setdefault(name, []).append(key_callback)
+
+    def publish(self, name: str, key: Optional[Hashable] = None) -> None:
+        """Call after the write has committed. With `key`, only that key is dropped here and in the other processes."""
+        last_key = None if key is None else str(key)
+        self._run_callbacks(name, last_key)
+        try:
+            with self.engine.begin() as connection:
+                version = connection.execute(
+                    insert(cache_versions).values(name=name, version=1, last_key=last_key, updated_at=datetime.utcnow())
+                    .on_conflict_do_update(index_elements=["name"], set_={"version": cache_versions.c.version + 1, "last_key": last_key, "updated_at": datetime.utcnow()})
+                    .returning(cache_versions.c.version)
+                ).scalar_one()
+            seen = self._seen
+            if seen is not None and seen.get(name, 0) == version - 1: seen[name] = version # Our own bump: no need to re-run callbacks here
+        except Exception as e: # The local copy is already cleared; other workers fall back to their cache TTL
+            print(f"WARNING:  Could not publish invalidation '{name}': {e}")
+
+    def poll_once(self) -> List[str]:
+        """Runs callbacks for versions changed since the last poll. The first poll only records versions."""
+        with self.engine.connect() as connection:
+            rows = connection.execute(select(cache_versions.c.name, cache_versions.c.version, cache_versions.c.last_key)).all()
+        versions = {name: version for name, version, _ in rows}
+        if self._seen is None:
+            self._seen = versions
+            return []
+        seen, self._seen = self._seen, versions
+        changed = []
+        for name, version, last_key in rows:
+            if seen.get(name) == version: continue
+            changed.append(name)
+            self._run_callbacks(name, last_key if seen.get(name) == version - 1 else None) # Missed a version: its key is unknown, clear everything
+        return changed
+
+    def _run_callbacks(self, name: str, key: Optional[str] = None) -> None:
+        key_callbacks = self._key_callbacks.get(name) if key is not None else None
+        if key_callbacks:
+            for key_callback in key_callbacks: key_callback(key)
+            return
+        for callback in self._callbacks.get(name, []): callback()
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive(): return
+        self._stop.clear()
+        self._seen = None
+        self.poll_once()
+        self._thread = threading.Thread(target=self._watch, name="cache-invalidation", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None: self._thread.join(self.poll_interval * 2)
+        self._thread = None
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try: self.poll_once()
+            except Exception as e: print(f"WARNING:  Cache invalidation poll failed: {e}")
+
+
+invalidation = InvalidationChannel()
+
+# Cache names
+SITE_CONFIGURATION = "site_configuration"
+REDEEMABLE_GIFTS = "redeemable_gifts"
+WISHLIST_PRODUCT_IDS = "wishlist_product_ids"
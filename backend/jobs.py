@@ -0,0 +1,331 @@
+"""
+In-process background jobs backed by the `job` table.
+
+Request handlers call `enqueue_job(session, kind, payload)` before their commit: the job row is part
+of the same transaction, so deferred work is never lost after a successful write and never runs for
+a rolled-back one. After the commit they call `job_runner.wake()`.
+
+Worker threads claim due jobs with a conditional UPDATE (safe with several workers or processes),
+run the handler in a fresh session and commit the handler's writes together with the job's
+`completado` status, so a retried job never applies its effect twice. Failures are retried with
+exponential backoff up to `max_attempts`; jobs left `en_curso` by a crashed process are released
+after `STALE_LOCK_SECONDS`. Idle workers prune finished jobs past their retention about once an hour.
+"""
+import random
+import threading
+import time
+import traceback
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+import orjson
+from sqlalchemy import and_, delete, func, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from .database import engine, Job, JobStatusEnum, JobRead, JobQueueStatus, Product, ClientProfile, StockMovementReasonEnum
+from .stock import adjust_stock
+from .levels import recompute_client_levels
+from .popularity import rebuild_popularity
+from .snapshots import reporting_snapshot
+from .catalog_sync import build_catalog_bundle, prune_catalog_changes
+from .rollups import rebuild_rollups, unrolled_history_start, REBUILD_DAYS
+from .uploads import remove_static_file
+
+# --- Job Kinds ---
+DELETE_STATIC_FILE = "delete_static_file"
+RESTORE_SALE_STOCK = "restore_sale_stock"
+CREDIT_SALE_POINTS = "credit_sale_points"
+RECOMPUTE_CLIENT_LEVELS = "recompute_client_levels"
+REBUILD_POPULARITY = "rebuild_popularity"
+REFRESH_REPORTING_SNAPSHOT = "refresh_reporting_snapshot"
+REBUILD_CATALOG_BUNDLE = "rebuild_catalog_bundle"
+REBUILD_ROLLUPS = "rebuild_rollups"
+
+CLIENT_LEVELS_RUN_HOUR_UTC = 7 # 02:00 in Lima, after the day's sales are collected
+POPULARITY_RUN_HOUR_UTC = 8
+CATALOG_BUNDLE_RUN_HOUR_UTC = 9 # After the popularity rebuild, before the shop opens
+ROLLUPS_RUN_HOUR_UTC = 6 # Before client levels and popularity
+
+BACKOFF_BASE_SECONDS = 2.0
+BACKOFF_MAX_SECONDS = 600.0
+STALE_LOCK_SECONDS = 300
+COMPLETED_JOB_RETENTION_DAYS = 7
+FAILED_JOB_RETENTION_DAYS = 30 # Kept longer: listed in the admin queue status until someone looks
+PRUNE_INTERVAL_SECONDS = 3600
+
+JobHandler = Callable[[Session, Dict[str, Any]], None]
+_handlers: Dict[str, JobHandler] = {}
+
+
+def job_handler(kind: str):
+    """Registers `handler(session, payload)`. Handlers must not commit; the runner commits their writes with the job."""
+    def register(handler: JobHandler) -> JobHandler:
+        _handlers[kind] = handler
+        return handler
+    return register
+
+
+def enqueue_job(session: Session, kind: str, payload: Optional[Dict[str, Any]] = None, dedupe_key: Optional[str] = None, delay_seconds: float = 0, max_attempts: int = 5) -> Optional[Job]:
+    """
+    Adds a job to `session` (no commit). With `dedupe_key`, nothing is added if a job with that key
+    already exists in any state (until the runner prunes it); returns None in that case. Keys for
+    repeatable events must name the occurrence, e.g. the sale version a status change was made from.
+    """
+    if kind not in _handlers: raise ValueError(f"No handler registered for job kind '{kind}'")
+    if dedupe_key is not None and session.exec(select(Job.id).where(Job.dedupe_key == dedupe_key)).first() is not None: return None
+    job = Job(
+        kind=kind, payload=orjson.dumps(payload or {}).decode(), dedupe_key=dedupe_key, max_attempts=max_attempts,
+        run_after=datetime.utcnow() + timedelta(seconds=delay_seconds),
+    )
+    session.add(job)
+    return job
+
+
+def backoff_seconds(attempts: int) -> float:
+    """2s, 4s, 8s ... capped at 10 minutes, with +-20% jitter so failed jobs do not retry in lockstep."""
+    return min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+
+
+class JobRunner:
+    def __init__(self, threads: int = 1, poll_interval: float = 2.0):
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._workers = []
+        self._prune_lock = threading.Lock()
+        self._next_prune_at = 0.0 # time.monotonic(); the first idle worker prunes right after startup
+
+    @property
+    def running(self) -> int:
+        return sum(worker.is_alive() for worker in self._workers)
+
+    def start(self) -> None:
+        if self.running: return
+        self._stop.clear()
+        self.release_stale_locks()
+        self._workers = [threading.Thread(target=self._work, name=f"job-worker-{n}", daemon=True) for n in range(self.threads)]
+        for worker in self._workers: worker.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set(); self._wake.set()
+        for worker in self._workers: worker.join(timeout)
+        self._workers = []
+
+    def wake(self) -> None: # Call after committing a transaction that enqueued jobs
+        self._wake.set()
+
+    def release_stale_locks(self) -> int:
+        with Session(engine) as session:
+            result = session.execute(
+                update(Job).where(Job.status == JobStatusEnum.EN_CURSO, Job.locked_at < datetime.utcnow() - timedelta(seconds=STALE_LOCK_SECONDS))
+                .values(status=JobStatusEnum.PENDIENTE, locked_at=None)
+            )
+            session.commit()
+            return result.rowcount
+
+    def prune_finished_jobs(self, now: Optional[datetime] = None) -> int:
+        """Deletes `completado` and `fallido` jobs finished before their retention window. Returns the number of rows removed."""
+        now = now or datetime.utcnow()
+        with Session(engine) as session:
+            result = session.execute(delete(Job).where(or_(
+                and_(Job.status == JobStatusEnum.COMPLETADO, Job.finished_at < now - timedelta(days=COMPLETED_JOB_RETENTION_DAYS)),
+                and_(Job.status == JobStatusEnum.FALLIDO, Job.finished_at < now - timedelta(days=FAILED_JOB_RETENTION_DAYS)),
+            )))
+            session.commit()
+            return result.rowcount
+
+    def _prune_if_due(self) -> None:
+        with self._prune_lock: # One worker per interval
+            if time.monotonic() < self._next_prune_at: return
+            self._next_prune_at = time.monotonic() + PRUNE_INTERVAL_SECONDS
+        pruned = self.prune_finished_jobs()
+        if pruned: print(f"INFO:     {pruned} finished job(s) pruned")
+
+    def _claim(self) -> Optional[int]:
+        with Session(engine) as session:
+            now = datetime.utcnow()
+            job_id = session.exec(
+                select(Job.id).where(Job.status == JobStatusEnum.PENDIENTE, Job.run_after <= now).order_by(Job.run_after, Job.id).limit(1)
+            ).first()
+            if job_id is None: return None
+            claimed = session.execute(
+                update(Job).where(Job.id == job_id, Job.status == JobStatusEnum.PENDIENTE)
+                .values(status=JobStatusEnum.EN_CURSO, locked_at=now, attempts=Job.attempts + 1)
+            ).rowcount
+            session.commit()
+            return job_id if claimed else self._claim() # Another worker won the race; try the next one
+
+    def run_job(self, job_id: int) -> None:
+        with Session(engine) as session:
+            job = session.get(Job, job_id)
+            if job is None: return
+            job_kind = job.kind
+            try:
+                handler = _handlers.get(job.kind)
+                if handler is None: raise LookupError(f"No handler registered for job kind '{job.kind}'")
+                handler(session, orjson.loads(job.payload))
+                job.status = JobStatusEnum.COMPLETADO; job.finished_at = datetime.utcnow(); job.last_error = None
+                session.add(job); session.commit()
+                return
+            except Exception:
+                session.rollback()
+                error = traceback.format_exc(limit=5)[-2000:]
+        with Session(engine) as session: # Record the failure outside the rolled-back transaction
+            job = session.get(Job, job_id)
+            job.last_error = error; job.locked_at = None
+            attempts, max_attempts = job.attempts, job.max_attempts
+            if attempts >= max_attempts: job.status = JobStatusEnum.FALLIDO; job.finished_at = datetime.utcnow()
+            else: job.status = JobStatusEnum.PENDIENTE; job.run_after = datetime.utcnow() + timedelta(seconds=backoff_seconds(attempts))
+            session.add(job); session.commit()
+        print(f"WARNING:  Job {job_id} ({job_kind}) failed, attempt {attempts}/{max_attempts}")
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job_id = self._claim()
+                if job_id is not None:
+                    self.run_job(job_id)
+                    continue
+                self._prune_if_due()
+            except Exception as e: # DB locked or similar: back off and poll again
+                print(f"ERROR:    Job worker error: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def retry(self, job_id: int) -> Optional[Job]:
+        """Puts a `fallido` job back in the queue with a fresh attempt budget."""
+        with Session(engine) as session:
+            job = session.get(Job, job_id)
+            if job is None or job.status != JobStatusEnum.FALLIDO: return job
+            job.status = JobStatusEnum.PENDIENTE; job.attempts = 0; job.run_after = datetime.utcnow(); job.finished_at = None
+            session.add(job); session.commit(); session.refresh(job)
+        self.wake()
+        return job
+
+    def queue_status(self, failures: int = 20) -> JobQueueStatus:
+        with Session(engine) as session:
+            counts = {row[0].value: row[1] for row in session.execute(select(Job.status, func.count(Job.id)).group_by(Job.status))}
+            oldest_pending_at = session.exec(select(func.min(Job.created_at)).where(Job.status == JobStatusEnum.PENDIENTE)).one()
+            recent_failures = session.exec(select(Job).where(Job.status == JobStatusEnum.FALLIDO).order_by(Job.finished_at.desc()).limit(failures)).all()
+            return JobQueueStatus(
+                counts={job_status.value: counts.get(job_status.value, 0) for job_status in JobStatusEnum},
+                oldest_pending_at=oldest_pending_at, workers_running=self.running,
+                recent_failures=[JobRead.model_validate(job) for job in recent_failures],
+            )
+
+
+job_runner = JobRunner()
+
+
+# --- Handlers ---
+@job_handler(DELETE_STATIC_FILE)
+def delete_static_file_job(session: Session, payload: Dict[str, Any]) -> None:
+    remove_static_file(payload.get("image_url"))
+
+
+@job_handler(RESTORE_SALE_STOCK)
+def restore_sale_stock_job(session: Session, payload: Dict[str, Any]) -> None:
+    """payload: {"sale_id", "items": [[product_id, quantity], ...]} captured when the sale was cancelled."""
+    for product_id, quantity in payload["items"]:
+        product = session.get(Product, product_id)
+        if product: adjust_stock(session, product, quantity, StockMovementReasonEnum.CANCELACION, sale_id=payload["sale_id"])
+
+
+@job_handler(CREDIT_SALE_POINTS)
+def credit_sale_points_job(session: Session, payload: Dict[str, Any]) -> None:
+    """payload: {"sale_id", "user_id", "points"} captured when the sale was marked cobrado."""
+    client_profile = session.exec(select(ClientProfile).where(ClientProfile.user_id == payload["user_id"])).first()
+    if client_profile is None: return # Client without profile: nothing to credit (same as the inline behaviour)
+    client_profile.available_points += payload["points"]
+    session.add(client_profile)
+
+
+def schedule_daily(session: Session, kind: str, key_prefix: str, hour_utc: int, now: Optional[datetime] = None) -> Optional[Job]:
+    """Enqueues the next run of a daily job (no commit). The dedupe key makes it once per day across workers."""
+    now = now or datetime.utcnow()
+    run_at = now.replace(hour=hour_utc, minute=0, second=0, microsecond=0)
+    if run_at <= now: run_at += timedelta(days=1)
+    return enqueue_job(session, kind, {}, dedupe_key=f"{key_prefix}:{run_at.date().isoformat()}", delay_seconds=(run_at - now).total_seconds())
+
+
+def schedule_client_levels(session: Session, now: Optional[datetime] = None) -> Optional[Job]:
+    return schedule_daily(session, RECOMPUTE_CLIENT_LEVELS, "client_levels", CLIENT_LEVELS_RUN_HOUR_UTC, now)
+
+
+def schedule_popularity(session: Session, now: Optional[datetime] = None) -> Optional[Job]:
+    return schedule_daily(session, REBUILD_POPULARITY, "popularity", POPULARITY_RUN_HOUR_UTC, now)
+
+
+def schedule_catalog_bundle(session: Session, now: Optional[datetime] = None) -> Optional[Job]:
+    return schedule_daily(session, REBUILD_CATALOG_BUNDLE, "catalog_bundle", CATALOG_BUNDLE_RUN_HOUR_UTC, now)
+
+
+def schedule_rollups(session: Session, now: Optional[datetime] = None) -> Optional[Job]:
+    return schedule_daily(session, REBUILD_ROLLUPS, "rollups", ROLLUPS_RUN_HOUR_UTC, now)
+
+
+def schedule_rollup_history(session: Session, now: Optional[datetime] = None) -> Optional[Job]:
+    """One rebuild from the first sale day when older sales were never rolled up (e.g. right after upgrading)."""
+    first_day = unrolled_history_start(session)
+    if first_day is None: return None
+    return enqueue_job(session, REBUILD_ROLLUPS, {"date_from": first_day.isoformat()}, dedupe_key=f"rollups_history:{first_day.isoformat()}")
+
+
+def schedule_reporting_snapshot(session: Session, now: Optional[datetime] = None) -> Optional[Job]:
+    """Next refresh at the next `interval_seconds` boundary, or right away when there is no snapshot yet."""
+    if not reporting_snapshot.enabled: return None
+    now = now or datetime.utcnow()
+    interval = reporting_snapshot.interval_seconds
+    slot = int(now.timestamp() // interval) + (1 if reporting_snapshot.taken_at() is not None else 0)
+    delay_seconds = max(0.0, slot * interval - now.timestamp())
+    return enqueue_job(session, REFRESH_REPORTING_SNAPSHOT, {}, dedupe_key=f"reporting_snapshot:{slot}", delay_seconds=delay_seconds, max_attempts=2)
+
+
+def ensure_recurring_jobs_scheduled() -> None:
+    """Called on startup, so the recurring chains exist even on a fresh database."""
+    for schedule in (schedule_rollups, schedule_rollup_history, schedule_client_levels, schedule_popularity, schedule_catalog_bundle, schedule_reporting_snapshot):
+        with Session(engine) as session:
+            try:
+                if schedule(session) is not None: session.commit()
+            except IntegrityError: # Another worker scheduled it first
+                session.rollback()
+
+
+@job_handler(RECOMPUTE_CLIENT_LEVELS)
+def recompute_client_levels_job(session: Session, payload: Dict[str, Any]) -> None:
+    result = recompute_client_levels(session.connection(), dry_run=False)
+    print(f"INFO:     Client levels recomputed: {result.profiles_changed} of {result.profiles_scanned} profile(s) changed")
+    schedule_client_levels(session) # Next run commits together with this one
+
+
+@job_handler(REBUILD_ROLLUPS)
+def rebuild_rollups_job(session: Session, payload: Dict[str, Any]) -> None:
+    """payload: {} for the nightly trailing days, {"date_from"} for a one-time rebuild up to today."""
+    date_to = datetime.utcnow().date()
+    date_from = date.fromisoformat(payload["date_from"]) if payload.get("date_from") else date_to - timedelta(days=REBUILD_DAYS - 1)
+    days = rebuild_rollups(date_from, date_to) # Own short transactions, one per chunk
+    print(f"INFO:     Sales rollups rebuilt for {days} day(s): {date_from} .. {date_to}")
+    if not payload.get("date_from"): schedule_rollups(session)
+
+
+@job_handler(REBUILD_POPULARITY)
+def rebuild_popularity_job(session: Session, payload: Dict[str, Any]) -> None:
+    result = rebuild_popularity(session.connection())
+    print(f"INFO:     Popularity rebuilt: {result.products_counted} product(s) counted, {result.relations} relation(s) from {result.baskets} basket(s) ({result.engine}, {result.seconds:.2f}s)")
+    schedule_popularity(session)
+
+
+@job_handler(REFRESH_REPORTING_SNAPSHOT)
+def refresh_reporting_snapshot_job(session: Session, payload: Dict[str, Any]) -> None:
+    reporting_snapshot.refresh() # Own connections; the job session only records completion
+    schedule_reporting_snapshot(session)
+
+
+@job_handler(REBUILD_CATALOG_BUNDLE)
+def rebuild_catalog_bundle_job(session: Session, payload: Dict[str, Any]) -> None:
+    pruned = prune_catalog_changes()
+    manifest = build_catalog_bundle()
+    print(f"INFO:     Catalog bundle {manifest['file']} built ({manifest['entries']} entries, {manifest['size']} bytes); {pruned} change log row(s) pruned")
+    schedule_catalog_bundle(session)
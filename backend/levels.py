@@ -0,0 +1,98 @@
+"""
+Client levels derived from trailing collected-sales volume.
+
+One grouped query sums `total_amount` of cobrado sales (hot and archived) per client over the
+configured window; each profile gets the highest level whose threshold its volume reaches
+(SiteConfiguration `system_param_client_level_*`). Only rows whose level actually changes are
+written, as one executemany UPDATE per batch. Levels set by hand (`client_level_manual`) are kept.
+
+The job runner recomputes levels daily (jobs.RECOMPUTE_CLIENT_LEVELS); this CLI and
+POST /api/admin/client-profiles/recompute-levels run it on demand.
+
+Usage (from the project root):
+    python -m backend.levels [--window-days 365] [--apply]
+"""
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.engine import Connection
+
+from .archive import sales_with_archive
+from .database import engine, ClientProfile, SaleStatusEnum, ClientLevelChange, ClientLevelResult
+from .site_config import get_site_configuration
+
+DEFAULT_CLIENT_LEVEL = "Plata"
+PREVIEW_LIMIT = 50
+
+client_profiles = ClientProfile.__table__
+
+
+def level_thresholds() -> List[Tuple[str, float]]:
+    """(level, minimum volume), highest first; below every threshold a client is Plata."""
+    config = get_site_configuration()
+    return [("Diamante", config.system_param_client_level_diamante_min_amount), ("Oro", config.system_param_client_level_oro_min_amount)]
+
+
+def level_for_volume(volume: float, thresholds: List[Tuple[str, float]]) -> str:
+    return next((level for level, minimum in thresholds if volume >= minimum), DEFAULT_CLIENT_LEVEL)
+
+
+def trailing_volumes(connection: Connection, window_days: int) -> Dict[int, float]:
+    """{user_id: collected sales total} over the last `window_days`, in one grouped query."""
+    now = datetime.utcnow()
+    sales = sales_with_archive(now - timedelta(days=window_days), now + timedelta(days=1))
+    rows = connection.execute(
+        select(sales.c.user_id, func.sum(sales.c.total_amount)).where(sales.c.status == SaleStatusEnum.COBRADO).group_by(sales.c.user_id)
+    ).all()
+    return {user_id: total or 0.0 for user_id, total in rows}
+
+
+def recompute_client_levels(connection: Connection, window_days: Optional[int] = None, dry_run: bool = True, batch_size: int = 500) -> ClientLevelResult:
+    """Runs inside the caller's transaction (CLI: engine.begin(); job: the runner's session connection)."""
+    window_days = window_days or get_site_configuration().system_param_client_level_window_days
+    thresholds = level_thresholds()
+    result = ClientLevelResult(dry_run=dry_run, window_days=window_days)
+    volumes = trailing_volumes(connection, window_days)
+    profiles = connection.execute(select(client_profiles.c.id, client_profiles.c.user_id, client_profiles.c.client_level, client_profiles.c.client_level_manual)).all()
+    changes = []
+    for profile_id, user_id, current_level, manual in profiles:
+        result.profiles_scanned += 1
+        if manual:
+            result.manual_levels_kept += 1
+            continue
+        volume = round(volumes.get(user_id, 0.0), 2)
+        new_level = level_for_volume(volume, thresholds)
+        result.level_counts[new_level] = result.level_counts.get(new_level, 0) + 1
+        if new_level == current_level: continue
+        changes.append({"profile_id": profile_id, "new_level": new_level})
+        if len(result.preview) < PREVIEW_LIMIT: result.preview.append(ClientLevelChange(user_id=user_id, previous_level=current_level, new_level=new_level, volume=volume))
+    result.profiles_changed = len(changes)
+    if not dry_run:
+        statement = (
+            update(client_profiles)
+            .where(client_profiles.c.id == bindparam("profile_id"), client_profiles.c.client_level_manual == False) # Re-checked: an admin may have just set it
+            .values(client_level=bindparam("new_level"))
+        )
+        for start in range(0, len(changes), batch_size): connection.execute(statement, changes[start:start + batch_size])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute client levels from collected sales (dry run unless --apply).")
+    parser.add_argument("--window-days", type=int, default=None, help="Trailing days of cobrado sales (default: site configuration).")
+    parser.add_argument("--apply", action="store_true", help="Write the new levels (default is a dry run).")
+    args = parser.parse_args()
+
+    with engine.begin() as connection:
+        result = recompute_client_levels(connection, args.window_days, dry_run=not args.apply)
+    for change in result.preview:
+        print(f"  user #{change.user_id:<6} {change.previous_level or '-':>9} -> {change.new_level:9} ({change.volume:.2f})")
+    action = "would change" if result.dry_run else "changed"
+    levels = ", ".join(f"{level}: {count}" for level, count in sorted(result.level_counts.items()))
+    print(f"{result.profiles_scanned} profile(s) scanned over {result.window_days} days, {action} {result.profiles_changed}, {result.manual_levels_kept} manual level(s) kept ({levels}).")
+
+
+if __name__ == "__main__":
+    main()
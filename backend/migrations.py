@@ -0,0 +1,381 @@
+"""
+Versioned schema migrations and online, batched backfills.
+
+`create_db_and_tables()` builds fresh databases straight from the models, but `create_all` never
+touches tables that already exist. Migrations bring existing databases up to date; each one is
+idempotent and recorded in the `schemamigration` table once applied. Application startup calls
+`ensure_schema()`, which skips both when the stored schema version matches the code's.
+
+Migrations only make cheap schema changes (indexes, nullable columns). Populating a new column on a
+large table is a backfill: it walks the table in primary-key order in short transactions, records a
+checkpoint after every batch (so it can be stopped and resumed) and sleeps between batches so
+checkout and admin writes keep getting the SQLite write lock.
+
+Usage (from the project root):
+    python -m backend.migrations migrate
+    python -m backend.migrations check
+    python -m backend.migrations status
+    python -m backend.migrations backfill tag_name_key [--batch-size 500] [--pause 0.05] [--max-batches N]
+    python -m backend.migrations backfill client_search
+"""
+import argparse
+import hashlib
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import Table, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateTable
+from sqlmodel import SQLModel
+
+from .database import (
+    engine, User, Sale, SaleItem, RedemptionRequest, SaleArchive, SaleItemArchive, RedemptionRequestArchive, Product, CatalogEntry, Tag, GiftItem, ClientProfile, SiteConfiguration, CacheVersion, SchemaMigration, BackfillCheckpoint,
+)
+from .catalog_sync import record_catalog_changes
+from .client_search import SEARCH_BACKFILL, create_client_search, backfill_client_search
+from .snapshots import reporting_snapshot
+
+
+# --- Schema Helpers ---
+def _create_indexes(connection: Connection, table: Table, *index_names: str) -> None:
+    for index in table.indexes:
+        if index.name in index_names: index.create(connection, checkfirst=True)
+
+
+def _add_column(connection: Connection, table: Table, column_name: str) -> None:
+    """ALTER TABLE ... ADD COLUMN using the model's column type (and server default), unless the column already exists."""
+    existing_columns = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    if column_name in existing_columns: return
+    column = table.c[column_name]
+    column_sql = column.type.compile(dialect=connection.dialect)
+    if column.server_default is not None: # SQLite only accepts NOT NULL on an added column together with a default
+        column_sql += f" DEFAULT {column.server_default.arg}" + ("" if column.nullable else " NOT NULL")
+    connection.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column_name}" {column_sql}')
+
+
+def _backfill_in_migration(connection: Connection, name: str) -> None:
+    """Applies backfill `name` to the whole table in the migration's transaction and records its checkpoint as completed."""
+    table, apply_batch = BACKFILLS[name]
+    first_id, last_id, rows = connection.execute(select(func.min(table.c.id), func.max(table.c.id), func.count(table.c.id))).one()
+    if rows: apply_batch(connection, first_id, last_id)
+    checkpoints, now = BackfillCheckpoint.__table__, datetime.utcnow()
+    connection.execute(checkpoints.delete().where(checkpoints.c.name == name))
+    connection.execute(checkpoints.insert().values(name=name, last_id=last_id or 0, rows_done=rows, updated_at=now, completed_at=now))
+
+
+def _rebuild_table(connection: Connection, table: Table) -> None:
+    """
+    Recreates `table` from its model (SQLite cannot ALTER e.g. AUTOINCREMENT onto a table) and copies the
+    rows, ids included: create the new table, copy, drop the old one, rename, recreate the indexes.
+    Relies on foreign key enforcement being off (the engine does not turn it on).
+    """
+    quoted_name = connection.dialect.identifier_preparer.format_table(table)
+    new_name = f"{table.name}__rebuild"
+    create_sql = str(CreateTable(table).compile(dialect=connection.dialect)).strip().replace(f"CREATE TABLE {quoted_name} (", f'CREATE TABLE "{new_name}" (', 1)
+    connection.exec_driver_sql(create_sql)
+    existing_columns = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    columns = ", ".join(f'"{column.name}"' for column in table.columns if column.name in existing_columns)
+    connection.exec_driver_sql(f'INSERT INTO "{new_name}" ({columns}) SELECT {columns} FROM {quoted_name}')
+    connection.exec_driver_sql(f"DROP TABLE {quoted_name}")
+    connection.exec_driver_sql(f'ALTER TABLE "{new_name}" RENAME TO {quoted_name}')
+    _create_indexes(connection, table, *(index.name for index in table.indexes))
+
+
+# --- Migrations ---
+def add_query_shape_indexes(connection: Connection) -> None:
+    """Composite indexes matching the dashboard, redemption list, low-stock and catalog filters."""
+    _create_indexes(connection, Sale.__table__, "ix_sale_user_id_status")
+    _create_indexes(connection, RedemptionRequest.__table__, "ix_redemptionrequest_user_id_requested_at_id", "ix_redemptionrequest_status_requested_at")
+    _create_indexes(connection, Product.__table__, "ix_product_stock_actual_stock_critico")
+    _create_indexes(connection, CatalogEntry.__table__, "ix_catalogentry_visible_display_order")
+
+
+def add_tag_name_key(connection: Connection) -> None:
+    _add_column(connection, Tag.__table__, "name_key")
+    _create_indexes(connection, Tag.__table__, "ix_tag_name_key")
+
+
+def add_catalog_cached_effective_price(connection: Connection) -> None:
+    _add_column(connection, CatalogEntry.__table__, "cached_effective_price")
+
+
+def add_gift_points_index(connection: Connection) -> None:
+    _create_indexes(connection, GiftItem.__table__, "ix_giftitem_active_points_required")
+
+
+def add_product_price_override_flags(connection: Connection) -> None:
+    _add_column(connection, Product.__table__, "price_showroom_manual")
+    _add_column(connection, Product.__table__, "price_feria_manual")
+    _backfill_in_migration(connection, "product_price_overrides") # Before any reprice: hand-set prices must be flagged as such
+
+
+def add_product_low_stock_flag(connection: Connection) -> None:
+    _add_column(connection, Product.__table__, "is_low_stock")
+    _backfill_in_migration(connection, "product_low_stock_flag") # The low_stock filter reads only the flag
+    _create_indexes(connection, Product.__table__, "ix_product_low_stock")
+
+
+def add_client_level_recomputation(connection: Connection) -> None:
+    _add_column(connection, ClientProfile.__table__, "client_level_manual")
+    _create_indexes(connection, ClientProfile.__table__, "ix_clientprofile_client_level_user_id")
+    for column_name in ("system_param_client_level_window_days", "system_param_client_level_oro_min_amount", "system_param_client_level_diamante_min_amount"):
+        _add_column(connection, SiteConfiguration.__table__, column_name)
+
+
+def add_client_search(connection: Connection) -> None:
+    if not create_client_search(connection): return
+    # The triggers index every user written from now on; existing users need the client_search backfill.
+    if connection.execute(select(User.id).limit(1)).first() is None:
+        now = datetime.utcnow()
+        connection.execute(BackfillCheckpoint.__table__.insert().values(name=SEARCH_BACKFILL, last_id=0, rows_done=0, updated_at=now, completed_at=now))
+
+
+def add_archive_safe_ids(connection: Connection) -> None:
+    """
+    Live tables whose rows are moved to an archive get AUTOINCREMENT, and their id sequence starts above
+    every archived id: otherwise SQLite reuses the highest ids once those rows are archived.
+    """
+    for table, archive_table in ((Sale.__table__, SaleArchive.__table__), (SaleItem.__table__, SaleItemArchive.__table__), (RedemptionRequest.__table__, RedemptionRequestArchive.__table__)):
+        table_sql = connection.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table.name}).scalar()
+        if "AUTOINCREMENT" not in (table_sql or "").upper(): _rebuild_table(connection, table)
+        high_water = max(
+            connection.execute(select(func.coalesce(func.max(table.c.id), 0))).scalar_one(),
+            connection.execute(select(func.coalesce(func.max(archive_table.c.id), 0))).scalar_one(),
+        )
+        connection.execute(text("DELETE FROM sqlite_sequence WHERE name IN (:name, :rebuild_name)"), {"name": table.name, "rebuild_name": f"{table.name}__rebuild"})
+        connection.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"), {"name": table.name, "seq": high_water})
+    connection.execute(text("UPDATE salearchive SET points_earned = 0 WHERE points_earned IS NULL")) # Now NOT NULL in the model (SaleRead)
+
+
+def add_cache_version_last_key(connection: Connection) -> None:
+    _add_column(connection, CacheVersion.__table__, "last_key")
+
+
+MIGRATIONS: List[Tuple[str, Callable[[Connection], None]]] = [
+    ("0001_query_shape_indexes", add_query_shape_indexes),
+    ("0002_tag_name_key", add_tag_name_key),
+    ("0003_catalog_cached_effective_price", add_catalog_cached_effective_price),
+    ("0004_gift_points_index", add_gift_points_index),
+    ("0005_product_price_override_flags", add_product_price_override_flags),
+    ("0006_product_low_stock_flag", add_product_low_stock_flag),
+    ("0007_client_level_recomputation", add_client_level_recomputation),
+    ("0008_client_search", add_client_search),
+    ("0009_archive_safe_ids", add_archive_safe_ids),
+    ("0010_cache_version_last_key", add_cache_version_last_key),
+]
+
+
+def applied_migrations(target_engine: Engine = engine) -> Dict[str, datetime]:
+    SchemaMigration.__table__.create(target_engine, checkfirst=True)
+    with target_engine.connect() as connection:
+        rows = connection.execute(select(SchemaMigration.name, SchemaMigration.applied_at)).all()
+    return {name: applied_at for name, applied_at in rows}
+
+
+def run_migrations(target_engine: Engine = engine) -> List[str]:
+    """Applies pending migrations in order, each in its own transaction. Returns the names applied."""
+    already_applied = applied_migrations(target_engine)
+    newly_applied = []
+    for name, migrate in MIGRATIONS:
+        if name in already_applied: continue
+        with target_engine.begin() as connection:
+            migrate(connection)
+            connection.execute(SchemaMigration.__table__.insert().values(name=name, applied_at=datetime.utcnow()))
+        print(f"INFO:     Applied migration {name}")
+        newly_applied.append(name)
+    return newly_applied
+
+
+SCHEMA_VERSION_PREFIX = "schema:"
+
+
+def schema_version() -> str:
+    """Fingerprint of the model tables, columns and indexes plus the migration list; changes whenever either does."""
+    digest = hashlib.sha1()
+    for table in sorted(SQLModel.metadata.tables.values(), key=lambda table: table.name):
+        digest.update(table.name.encode())
+        for column in table.columns: digest.update(f"|{column.name}:{type(column.type).__name__}:{column.nullable}".encode())
+        for index in sorted(table.indexes, key=lambda index: index.name or ""): digest.update(f"|{index.name}".encode())
+    for name, _ in MIGRATIONS: digest.update(f"|{name}".encode())
+    return SCHEMA_VERSION_PREFIX + digest.hexdigest()[:16]
+
+
+def schema_is_current(target_engine: Engine = engine) -> bool:
+    try:
+        with target_engine.connect() as connection:
+            return connection.execute(select(SchemaMigration.name).where(SchemaMigration.name == schema_version())).first() is not None
+    except OperationalError: # Fresh database: no schemamigration table yet
+        return False
+
+
+def record_schema_version(target_engine: Engine = engine) -> None:
+    table = SchemaMigration.__table__
+    with target_engine.begin() as connection:
+        connection.execute(table.delete().where(table.c.name.like(SCHEMA_VERSION_PREFIX + "%")))
+        connection.execute(table.insert().values(name=schema_version(), applied_at=datetime.utcnow()))
+
+
+def ensure_schema(target_engine: Engine = engine) -> bool:
+    """
+    Startup path: a single SELECT when the database already carries this code's schema version;
+    otherwise `create_all` plus pending migrations, then the version is recorded (and the reporting
+    snapshot, which still has the old schema, is dropped). Returns True when schema work ran.
+    """
+    if schema_is_current(target_engine): return False
+    SQLModel.metadata.create_all(target_engine)
+    run_migrations(target_engine)
+    record_schema_version(target_engine)
+    if target_engine is engine: reporting_snapshot.discard()
+    return True
+
+
+# --- Backfills ---
+def backfill_tag_name_key(connection: Connection, first_id: int, last_id: int) -> None:
+    connection.execute(
+        text("UPDATE tag SET name_key = lower(name) WHERE id BETWEEN :first_id AND :last_id AND name_key IS NULL"),
+        {"first_id": first_id, "last_id": last_id},
+    )
+
+
+def backfill_catalog_effective_price(connection: Connection, first_id: int, last_id: int) -> None:
+    # Same rule as database.compute_effective_price, set-based.
+    connection.execute(
+        text(
+            "UPDATE catalogentry SET cached_effective_price = COALESCE(catalog_price, "
+            "(SELECT COALESCE(product.price_showroom, product.price_revista) FROM product WHERE product.id = catalogentry.product_id)) "
+            "WHERE id BETWEEN :first_id AND :last_id"
+        ),
+        {"first_id": first_id, "last_id": last_id},
+    )
+    record_catalog_changes(connection, select(CatalogEntry.__table__.c.product_id).where(CatalogEntry.__table__.c.id.between(first_id, last_id)))
+
+
+def _record_product_window(connection: Connection, first_id: int, last_id: int) -> None:
+    """Product backfills bypass the ORM listener: log the window so catalog deltas and cached product payloads see the rewrite."""
+    products = Product.__table__
+    record_catalog_changes(connection, select(products.c.id).where(products.c.id.between(first_id, last_id)))
+
+
+def backfill_product_price_overrides(connection: Connection, first_id: int, last_id: int) -> None:
+    # Prices that do not match the rule they would have been derived with (80% / 65% of price_revista) were set by hand.
+    connection.execute(
+        text(
+            "UPDATE product SET "
+            "price_showroom_manual = (price_showroom IS NOT NULL AND abs(price_showroom - price_revista * 0.80) >= 0.005), "
+            "price_feria_manual = (price_feria IS NOT NULL AND abs(price_feria - price_revista * 0.65) >= 0.005) "
+            "WHERE id BETWEEN :first_id AND :last_id"
+        ),
+        {"first_id": first_id, "last_id": last_id},
+    )
+    _record_product_window(connection, first_id, last_id)
+
+
+def backfill_product_low_stock_flag(connection: Connection, first_id: int, last_id: int) -> None:
+    # Same rule as stock.is_low_stock, set-based.
+    connection.execute(
+        text("UPDATE product SET is_low_stock = (COALESCE(stock_critico, 0) > 0 AND stock_actual <= stock_critico) WHERE id BETWEEN :first_id AND :last_id"),
+        {"first_id": first_id, "last_id": last_id},
+    )
+    _record_product_window(connection, first_id, last_id)
+
+
+BACKFILLS: Dict[str, Tuple[Table, Callable[[Connection, int, int], None]]] = {
+    "tag_name_key": (Tag.__table__, backfill_tag_name_key),
+    "catalog_effective_price": (CatalogEntry.__table__, backfill_catalog_effective_price),
+    "product_price_overrides": (Product.__table__, backfill_product_price_overrides),
+    "product_low_stock_flag": (Product.__table__, backfill_product_low_stock_flag),
+    SEARCH_BACKFILL: (User.__table__, backfill_client_search),
+}
+
+
+def run_backfill(name: str, batch_size: int = 500, pause_seconds: float = 0.05, max_batches: Optional[int] = None, restart: bool = False, target_engine: Engine = engine) -> BackfillCheckpoint:
+    """
+    Runs (or resumes) the backfill `name` from its checkpoint.
+
+    Each batch is one short transaction covering at most `batch_size` primary keys; the checkpoint is
+    committed together with the batch. `max_batches` bounds a single run (e.g. from a cron during
+    business hours); call again to continue where it stopped.
+    """
+    if name not in BACKFILLS: raise ValueError(f"Unknown backfill '{name}'. Available: {', '.join(BACKFILLS)}")
+    table, apply_batch = BACKFILLS[name]
+    checkpoints = BackfillCheckpoint.__table__
+    checkpoints.create(target_engine, checkfirst=True)
+    with target_engine.begin() as connection:
+        exists = connection.execute(select(checkpoints.c.name).where(checkpoints.c.name == name)).first()
+        if not exists: connection.execute(checkpoints.insert().values(name=name, last_id=0, rows_done=0, updated_at=datetime.utcnow()))
+        elif restart: connection.execute(checkpoints.update().where(checkpoints.c.name == name).values(last_id=0, rows_done=0, completed_at=None, updated_at=datetime.utcnow()))
+
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with target_engine.begin() as connection:
+            checkpoint = connection.execute(select(checkpoints).where(checkpoints.c.name == name)).one()
+            ids = connection.execute(
+                select(table.c.id).where(table.c.id > checkpoint.last_id).order_by(table.c.id).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                connection.execute(checkpoints.update().where(checkpoints.c.name == name).values(completed_at=datetime.utcnow(), updated_at=datetime.utcnow()))
+                break
+            apply_batch(connection, ids[0], ids[-1])
+            connection.execute(
+                checkpoints.update().where(checkpoints.c.name == name)
+                .values(last_id=ids[-1], rows_done=checkpoint.rows_done + len(ids), updated_at=datetime.utcnow())
+            )
+        batches += 1
+        if pause_seconds: time.sleep(pause_seconds) # Throttle: leave the write lock to request traffic
+
+    with target_engine.connect() as connection:
+        row = connection.execute(select(checkpoints).where(checkpoints.c.name == name)).one()
+    return BackfillCheckpoint(**row._mapping)
+
+
+def _print_status(target_engine: Engine) -> None:
+    applied = applied_migrations(target_engine)
+    for name, _ in MIGRATIONS:
+        print(f"  {'applied ' + applied[name].isoformat(' ', 'seconds') if name in applied else 'PENDING':28} {name}")
+    BackfillCheckpoint.__table__.create(target_engine, checkfirst=True)
+    with target_engine.connect() as connection:
+        checkpoints = {row.name: row for row in connection.execute(select(BackfillCheckpoint.__table__))}
+    for name in BACKFILLS:
+        checkpoint = checkpoints.get(name)
+        if checkpoint is None: state = "not started"
+        elif checkpoint.completed_at: state = f"done ({checkpoint.rows_done} rows)"
+        else: state = f"in progress (last id {checkpoint.last_id}, {checkpoint.rows_done} rows)"
+        print(f"  backfill {name:28} {state}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Schema migrations and batched backfills.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate", help="Create missing tables and apply pending migrations.")
+    subparsers.add_parser("check", help="Exit with status 1 if the database schema is not current.")
+    subparsers.add_parser("status", help="Show applied migrations and backfill checkpoints.")
+    backfill_parser = subparsers.add_parser("backfill", help="Run or resume a backfill.")
+    backfill_parser.add_argument("name", choices=sorted(BACKFILLS))
+    backfill_parser.add_argument("--batch-size", type=int, default=500)
+    backfill_parser.add_argument("--pause", type=float, default=0.05, help="Seconds to sleep between batches.")
+    backfill_parser.add_argument("--max-batches", type=int, default=None)
+    backfill_parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the first row.")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        SQLModel.metadata.create_all(engine)
+        applied = run_migrations(engine)
+        record_schema_version(engine)
+        reporting_snapshot.discard()
+        print(f"{len(applied)} migration(s) applied.")
+    elif args.command == "check":
+        current = schema_is_current(engine)
+        print(f"Schema {schema_version()}: {'current' if current else 'needs migrate'}.")
+        if not current: raise SystemExit(1)
+    elif args.command == "status":
+        _print_status(engine)
+    else:
+        checkpoint = run_backfill(args.name, batch_size=args.batch_size, pause_seconds=args.pause, max_batches=args.max_batches, restart=args.restart)
+        state = "completed" if checkpoint.completed_at else f"paused at id {checkpoint.last_id}"
+        print(f"Backfill {args.name}: {checkpoint.rows_done} rows processed, {state}.")
+
+
+if __name__ == "__main__":
+    main()
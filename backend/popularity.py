@@ -0,0 +1,216 @@
+"""
+Product popularity counters and "related products" from basket co-occurrence.
+
+`productpopularity` keeps per-product counters: wishlists and carts holding the product, and units
+sold in the trailing `sold_window_days`, with the combined `score` that the public catalog orders by
+(`order_by=popular`). Writes that change a counter call `bump_popularity` in their own transaction,
+so the catalog reads one indexed column instead of aggregating wishlists and sales per request. The
+nightly rebuild recounts everything from the source tables: it corrects any drift and lets units
+sold before the window drop out.
+
+The same job builds `productrelation`: each non-cancelled sale and each client's wishlist is a basket,
+the basket x product 0/1 matrix B gives co-occurrence counts C = BᵀB, and each product keeps its
+`top_k` neighbours by cosine similarity C[i,j] / sqrt(C[i,i] * C[j,j]). With SciPy installed this is
+one sparse product; without it the pairs are counted in Python (same result, fine for small catalogs).
+GET /api/catalog/products/{id}/related only reads the precomputed rows.
+
+Usage (from the project root):
+    python -m backend.popularity rebuild [--sold-days 30] [--basket-days 365] [--top-k 10]
+    python -m backend.popularity show PRODUCT_ID
+"""
+import argparse
+import importlib.util
+import itertools
+import math
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Sequence, Tuple
+
+from sqlalchemy import delete, func, insert, literal, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection
+from sqlmodel import Session
+
+from .archive import sale_items_with_archive
+from .database import (
+    engine, Product, WishlistItem, CartItem, SaleStatusEnum, SaleItemDailyRollup, ProductPopularity, ProductRelation, PopularityRebuildResult,
+)
+
+# Optional dependency: without it co-occurrence is counted in pure Python. Imported by the nightly
+# rebuild, not at startup (numpy alone adds tens of milliseconds to every worker boot).
+SCIPY_AVAILABLE = importlib.util.find_spec("scipy") is not None and importlib.util.find_spec("numpy") is not None
+
+DEFAULT_SOLD_WINDOW_DAYS = 30
+DEFAULT_BASKET_WINDOW_DAYS = 365
+DEFAULT_TOP_K = 10
+MAX_BASKET_SIZE = 100 # Bigger baskets (bulk wishlists) relate everything to everything; they are skipped
+
+WISHED_WEIGHT, IN_CART_WEIGHT, SOLD_WEIGHT = 1.0, 2.0, 3.0
+
+popularity, relations = ProductPopularity.__table__, ProductRelation.__table__
+
+Neighbors = Dict[int, List[Tuple[int, float, int]]] # product_id -> [(related_id, score, co_occurrences)], best first
+
+
+def popularity_score(wished, in_cart, sold):
+    """Works on ints and on SQL column expressions alike."""
+    return wished * WISHED_WEIGHT + in_cart * IN_CART_WEIGHT + sold * SOLD_WEIGHT
+
+
+# --- Incremental Maintenance ---
+def sold_window_start(sold_window_days: int = DEFAULT_SOLD_WINDOW_DAYS) -> date:
+    """First day counted in `sold_units_recent`; older sales are outside the counter."""
+    return (datetime.utcnow() - timedelta(days=sold_window_days)).date()
+
+
+def bump_popularity(session: Session, product_id: int, wished: int = 0, in_cart: int = 0, sold: int = 0) -> None:
+    """Adds the deltas to the product's counters (one upsert, no commit); counters never go below zero."""
+    if not (wished or in_cart or sold): return
+    columns = popularity.c
+    new_wished, new_in_cart, new_sold = (func.max(columns.wished_count + wished, 0), func.max(columns.in_cart_count + in_cart, 0), func.max(columns.sold_units_recent + sold, 0))
+    first = (max(wished, 0), max(in_cart, 0), max(sold, 0))
+    session.execute(
+        sqlite_insert(popularity).values(
+            product_id=product_id, wished_count=first[0], in_cart_count=first[1], sold_units_recent=first[2], score=popularity_score(*first), updated_at=datetime.utcnow(),
+        ).on_conflict_do_update(index_elements=["product_id"], set_={
+            "wished_count": new_wished, "in_cart_count": new_in_cart, "sold_units_recent": new_sold,
+            "score": popularity_score(new_wished, new_in_cart, new_sold), "updated_at": datetime.utcnow(),
+        })
+    )
+
+
+def forget_product(session: Session, product_id: int) -> None:
+    """Drops the product's counters and relations (both directions); call when deleting the product."""
+    session.execute(delete(popularity).where(popularity.c.product_id == product_id))
+    session.execute(delete(relations).where((relations.c.product_id == product_id) | (relations.c.related_product_id == product_id)))
+
+
+# --- Nightly Rebuild ---
+def recount_popularity(connection: Connection, sold_window_days: int) -> int:
+    """Replaces every counter row with a fresh count, in one INSERT ... SELECT over the source tables."""
+    wished = select(WishlistItem.product_id, func.count().label("n")).group_by(WishlistItem.product_id).subquery("wished")
+    in_cart = select(CartItem.product_id, func.count().label("n")).group_by(CartItem.product_id).subquery("in_cart")
+    sold = (
+        select(SaleItemDailyRollup.product_id, func.sum(SaleItemDailyRollup.units).label("n"))
+        .where(SaleItemDailyRollup.day >= sold_window_start(sold_window_days), SaleItemDailyRollup.status != SaleStatusEnum.CANCELADO)
+        .group_by(SaleItemDailyRollup.product_id).subquery("sold")
+    )
+    counts = (func.coalesce(wished.c.n, 0), func.coalesce(in_cart.c.n, 0), func.max(func.coalesce(sold.c.n, 0), 0))
+    rows = (
+        select(Product.id, *counts, popularity_score(*counts), literal(datetime.utcnow()))
+        .select_from(Product.__table__)
+        .outerjoin(wished, wished.c.product_id == Product.id).outerjoin(in_cart, in_cart.c.product_id == Product.id).outerjoin(sold, sold.c.product_id == Product.id)
+        .where((wished.c.n != None) | (in_cart.c.n != None) | (sold.c.n != None))
+    )
+    connection.execute(delete(popularity))
+    return connection.execute(insert(popularity).from_select(["product_id", "wished_count", "in_cart_count", "sold_units_recent", "score", "updated_at"], rows)).rowcount
+
+
+def load_baskets(connection: Connection, basket_window_days: int) -> List[List[int]]:
+    """Product ids of each non-cancelled sale in the window (hot and archived), then of each client's wishlist."""
+    now = datetime.utcnow()
+    items = sale_items_with_archive(now - timedelta(days=basket_window_days), now + timedelta(days=1))
+    baskets: Dict[tuple, set] = defaultdict(set)
+    for sale_id, product_id in connection.execute(select(items.c.sale_id, items.c.product_id).where(items.c.status != SaleStatusEnum.CANCELADO)):
+        baskets[("sale", sale_id)].add(product_id)
+    for user_id, product_id in connection.execute(select(WishlistItem.user_id, WishlistItem.product_id)):
+        baskets[("wishlist", user_id)].add(product_id)
+    return [sorted(products) for products in baskets.values()]
+
+
+def _neighbors_scipy(baskets: Sequence[List[int]], top_k: int) -> Neighbors:
+    import numpy
+    from scipy import sparse
+    product_ids = sorted({product_id for basket in baskets for product_id in basket})
+    column = {product_id: index for index, product_id in enumerate(product_ids)}
+    rows = [row for row, basket in enumerate(baskets) for _ in basket]
+    cols = [column[product_id] for basket in baskets for product_id in basket]
+    matrix = sparse.csr_matrix((numpy.ones(len(rows)), (rows, cols)), shape=(len(baskets), len(product_ids)))
+    co = (matrix.T @ matrix).tocsr()
+    norms = numpy.sqrt(co.diagonal())
+    co.setdiag(0); co.eliminate_zeros(); co.sort_indices()
+    neighbors: Neighbors = {}
+    for i in range(co.shape[0]):
+        start, end = co.indptr[i], co.indptr[i + 1]
+        if start == end: continue
+        others, counts = co.indices[start:end], co.data[start:end]
+        scores = counts / (norms[i] * norms[others])
+        best = numpy.argsort(-scores, kind="stable")[:top_k] # Ties: lower product id first (indices are sorted)
+        neighbors[product_ids[i]] = [(product_ids[others[j]], float(scores[j]), int(counts[j])) for j in best]
+    return neighbors
+
+
+def _neighbors_python(baskets: Sequence[List[int]], top_k: int) -> Neighbors:
+    occurrences, pairs = Counter(), Counter()
+    for basket in baskets:
+        occurrences.update(basket)
+        pairs.update(itertools.combinations(basket, 2)) # Baskets are sorted: each pair is counted once as (low, high)
+    candidates: Dict[int, List[Tuple[int, float, int]]] = defaultdict(list)
+    for (a, b), count in pairs.items():
+        score = count / math.sqrt(occurrences[a] * occurrences[b])
+        candidates[a].append((b, score, count)); candidates[b].append((a, score, count))
+    return {product_id: sorted(others, key=lambda other: (-other[1], other[0]))[:top_k] for product_id, others in candidates.items()}
+
+
+def cooccurrence_neighbors(baskets: Sequence[List[int]], top_k: int = DEFAULT_TOP_K) -> Neighbors:
+    """Top-`top_k` neighbours per product; single-product baskets relate nothing but still count in the norms."""
+    if not baskets: return {}
+    return (_neighbors_scipy if SCIPY_AVAILABLE else _neighbors_python)(baskets, top_k)
+
+
+def rebuild_popularity(connection: Connection, sold_window_days: int = DEFAULT_SOLD_WINDOW_DAYS, basket_window_days: int = DEFAULT_BASKET_WINDOW_DAYS, top_k: int = DEFAULT_TOP_K) -> PopularityRebuildResult:
+    """Recounts the counters and rebuilds the relation table inside the caller's transaction."""
+    started = time.perf_counter()
+    result = PopularityRebuildResult(sold_window_days=sold_window_days, basket_window_days=basket_window_days, engine="scipy" if SCIPY_AVAILABLE else "python")
+    result.products_counted = recount_popularity(connection, sold_window_days)
+    baskets = load_baskets(connection, basket_window_days)
+    kept = [basket for basket in baskets if len(basket) <= MAX_BASKET_SIZE]
+    result.baskets, result.baskets_skipped = len(kept), len(baskets) - len(kept)
+    rows = [
+        {"product_id": product_id, "rank": rank, "related_product_id": related_id, "score": round(score, 6), "co_occurrences": count}
+        for product_id, others in cooccurrence_neighbors(kept, top_k).items() for rank, (related_id, score, count) in enumerate(others, start=1)
+    ]
+    connection.execute(delete(relations))
+    if rows: connection.execute(insert(relations), rows)
+    result.relations = len(rows)
+    result.seconds = round(time.perf_counter() - started, 3)
+    return result
+
+
+def _print_product(product_id: int) -> None:
+    with engine.connect() as connection:
+        counters = connection.execute(select(popularity).where(popularity.c.product_id == product_id)).first()
+        related = connection.execute(
+            select(relations.c.rank, relations.c.related_product_id, Product.name, relations.c.score, relations.c.co_occurrences)
+            .join(Product.__table__, Product.id == relations.c.related_product_id).where(relations.c.product_id == product_id).order_by(relations.c.rank)
+        ).all()
+    if counters is None: print(f"Product #{product_id}: no counters (never wished, in a cart or sold recently).")
+    else: print(f"Product #{product_id}: wished {counters.wished_count}, in carts {counters.in_cart_count}, sold {counters.sold_units_recent} recently, score {counters.score:g}")
+    for rank, related_id, name, score, count in related: print(f"  {rank:>3}. #{related_id:<6} {score:.3f} ({count} basket(s))  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild popularity counters and related products, or show them for one product.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subparsers.add_parser("rebuild", help="Recount the counters and recompute the related products.")
+    rebuild_parser.add_argument("--sold-days", type=int, default=DEFAULT_SOLD_WINDOW_DAYS, help="Trailing days counted in sold_units_recent.")
+    rebuild_parser.add_argument("--basket-days", type=int, default=DEFAULT_BASKET_WINDOW_DAYS, help="Trailing days of sales used as baskets.")
+    rebuild_parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K, help="Related products kept per product.")
+    show_parser = subparsers.add_parser("show", help="Print one product's counters and related products.")
+    show_parser.add_argument("product_id", type=int)
+    args = parser.parse_args()
+
+    if args.command == "show":
+        _print_product(args.product_id)
+        return
+    with engine.begin() as connection:
+        result = rebuild_popularity(connection, args.sold_days, args.basket_days, args.top_k)
+    print(
+        f"{result.products_counted} product(s) counted; {result.relations} relation(s) from {result.baskets} basket(s) "
+        f"({result.baskets_skipped} oversized skipped) with {result.engine} in {result.seconds:.2f}s."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Bulk repricing: recomputes the derived showroom/feria prices from price_revista after the campaign
+discount changes.
+
+Runs set-based UPDATEs over primary-key windows of `batch_size` products, one short transaction per
+window (same throttling idea as the backfills in migrations.py), and keeps the catalog's
+denormalized `cached_effective_price` and the catalog change log in step within the same transaction. Prices flagged
+`price_*_manual` are never touched. A dry run reports counts and a preview of the changes instead.
+
+Usage (from the project root):
+    python -m backend.pricing [--discount 25] [--feria-factor 0.65] [--category-id 3] [--apply]
+"""
+import argparse
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy import and_, case, func, or_, select, update
+from sqlalchemy.engine import Connection, Engine
+
+from .database import engine, Product, CatalogEntry, RepriceChange, RepriceResult
+from .site_config import showroom_price_factor, FERIA_PRICE_FACTOR
+from .catalog_sync import record_catalog_changes
+
+PRICE_TOLERANCE = 0.005 # Differences below half a cent are not a change
+PREVIEW_LIMIT = 50
+
+products = Product.__table__
+catalog_entries = CatalogEntry.__table__
+
+
+def fill_derived_prices(values: Dict[str, Any], session=None) -> Dict[str, Any]:
+    """
+    Fills `price_showroom`/`price_feria` left empty from `price_revista` (product create, or an update that
+    sets price_revista). Done by the handlers rather than the request schemas, which must not query the database.
+    """
+    price_revista = values.get("price_revista")
+    if price_revista is None: return values
+    if values.get("price_showroom") is None: values["price_showroom"] = price_revista * showroom_price_factor(session)
+    if values.get("price_feria") is None: values["price_feria"] = price_revista * FERIA_PRICE_FACTOR
+    return values
+
+
+def _derived_price(factor: float):
+    return func.round(products.c.price_revista * factor, 2)
+
+
+def _needs_update(price_column, manual_column, factor: float):
+    new_price = _derived_price(factor)
+    return and_(manual_column == False, or_(price_column == None, func.abs(price_column - new_price) >= PRICE_TOLERANCE))
+
+
+def _window_filter(first_id: int, last_id: int, category_id: Optional[int]):
+    condition = products.c.id.between(first_id, last_id)
+    if category_id is not None: condition = and_(condition, products.c.category_id == category_id)
+    return condition
+
+
+def _reprice_window(connection: Connection, first_id: int, last_id: int, showroom_factor: float, feria_factor: float, category_id: Optional[int]) -> int:
+    showroom_changes = _needs_update(products.c.price_showroom, products.c.price_showroom_manual, showroom_factor)
+    feria_changes = _needs_update(products.c.price_feria, products.c.price_feria_manual, feria_factor)
+    # Logged before the UPDATE, while the predicate still selects exactly the rows about to change. Every product, not only
+    # catalog entries: the log is also the row version of the product detail cache.
+    record_catalog_changes(connection, select(products.c.id).where(_window_filter(first_id, last_id, category_id), or_(showroom_changes, feria_changes)))
+    result = connection.execute(
+        update(products)
+        .where(_window_filter(first_id, last_id, category_id), or_(showroom_changes, feria_changes))
+        .values(
+            price_showroom=case((products.c.price_showroom_manual == False, _derived_price(showroom_factor)), else_=products.c.price_showroom),
+            price_feria=case((products.c.price_feria_manual == False, _derived_price(feria_factor)), else_=products.c.price_feria),
+        )
+    )
+    if result.rowcount:
+        # Same rule as database.compute_effective_price, set-based.
+        product_price = (
+            select(func.coalesce(products.c.price_showroom, products.c.price_revista))
+            .where(products.c.id == catalog_entries.c.product_id).scalar_subquery()
+        )
+        connection.execute(
+            update(catalog_entries)
+            .where(catalog_entries.c.product_id.between(first_id, last_id), catalog_entries.c.catalog_price == None)
+            .values(cached_effective_price=product_price)
+        )
+    return result.rowcount
+
+
+def _preview_window(connection: Connection, first_id: int, last_id: int, showroom_factor: float, feria_factor: float, category_id: Optional[int], result: RepriceResult) -> None:
+    showroom_changes = _needs_update(products.c.price_showroom, products.c.price_showroom_manual, showroom_factor)
+    feria_changes = _needs_update(products.c.price_feria, products.c.price_feria_manual, feria_factor)
+    rows = connection.execute(
+        select(
+            products.c.id, products.c.name, products.c.price_revista, products.c.price_showroom, products.c.price_feria,
+            case((showroom_changes, _derived_price(showroom_factor)), else_=None).label("new_price_showroom"),
+            case((feria_changes, _derived_price(feria_factor)), else_=None).label("new_price_feria"),
+        )
+        .where(_window_filter(first_id, last_id, category_id), or_(showroom_changes, feria_changes))
+        .order_by(products.c.id)
+    ).all()
+    result.products_changed += len(rows)
+    for row in rows[:max(0, PREVIEW_LIMIT - len(result.preview))]:
+        result.preview.append(RepriceChange(product_id=row.id, **{key: value for key, value in row._mapping.items() if key != "id"}))
+
+
+def reprice_products(showroom_factor: Optional[float] = None, feria_factor: Optional[float] = None, category_id: Optional[int] = None, dry_run: bool = True, batch_size: int = 500, pause_seconds: float = 0.02, target_engine: Engine = engine) -> RepriceResult:
+    """
+    Recomputes non-manual showroom/feria prices as `round(price_revista * factor, 2)`.
+
+    `showroom_factor` defaults to the configured showroom discount, `feria_factor` to 0.65. Callers
+    that serve cached product data invalidate it once after a non-dry run (see main.run_reprice).
+    """
+    result = RepriceResult(
+        dry_run=dry_run,
+        showroom_factor=showroom_factor if showroom_factor is not None else showroom_price_factor(),
+        feria_factor=feria_factor if feria_factor is not None else FERIA_PRICE_FACTOR,
+    )
+    last_id = 0
+    while True:
+        with target_engine.begin() as connection:
+            scope = products.c.id > last_id
+            if category_id is not None: scope = and_(scope, products.c.category_id == category_id)
+            ids = connection.execute(select(products.c.id).where(scope).order_by(products.c.id).limit(batch_size)).scalars().all()
+            if not ids: break
+            result.products_scanned += len(ids)
+            result.manual_overrides_kept += connection.execute(
+                select(func.count()).select_from(products)
+                .where(_window_filter(ids[0], ids[-1], category_id), or_(products.c.price_showroom_manual == True, products.c.price_feria_manual == True))
+            ).scalar_one()
+            if dry_run: _preview_window(connection, ids[0], ids[-1], result.showroom_factor, result.feria_factor, category_id, result)
+            else: result.products_changed += _reprice_window(connection, ids[0], ids[-1], result.showroom_factor, result.feria_factor, category_id)
+        last_id = ids[-1]
+        if pause_seconds and not dry_run: time.sleep(pause_seconds) # Leave the write lock to request traffic
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute derived showroom/feria prices (dry run unless --apply).")
+    parser.add_argument("--discount", type=int, default=None, help="Showroom discount percentage (default: site configuration).")
+    parser.add_argument("--feria-factor", type=float, default=None, help=f"Feria price as a fraction of price_revista (default: {FERIA_PRICE_FACTOR}).")
+    parser.add_argument("--category-id", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--apply", action="store_true", help="Write the new prices (default is a dry run).")
+    args = parser.parse_args()
+
+    showroom_factor = (100 - args.discount) / 100 if args.discount is not None else None
+    result = reprice_products(showroom_factor, args.feria_factor, args.category_id, dry_run=not args.apply, batch_size=args.batch_size)
+    for change in result.preview:
+        print(f"  #{change.product_id:<6} {change.name[:40]:40} showroom {change.price_showroom} -> {change.new_price_showroom}   feria {change.price_feria} -> {change.new_price_feria}")
+    action = "would change" if result.dry_run else "changed"
+    print(f"{result.products_scanned} product(s) scanned, {action} {result.products_changed}, {result.manual_overrides_kept} with manual prices kept "
+          f"(showroom x{result.showroom_factor:.2f}, feria x{result.feria_factor:.2f}).")
+    if not result.dry_run: print("Running API workers pick up the new prices once their caches expire.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Opt-in request profiling and slow-request capture.
+
+A request is profiled when
+  * a superuser sends `X-Profile: 1` (the token is only checked when the header is present),
+  * it is picked by `sample_rate` (a fraction of traffic), or
+  * it runs longer than `slow_threshold_ms`. Stack sampling for these starts at half the threshold,
+    so the dump covers the slow part of the request without sampling every fast one.
+
+While a request is profiled, SQLAlchemy cursor events record each statement and its duration, and a
+sampler thread reads the stacks of the threads serving it (the event loop, plus the threadpool
+threads that ran its SQL) every `interval_ms`. Attribution is approximate when several requests share
+a thread concurrently. Finished captures go into a bounded ring buffer served by
+/api/admin/profiler; stacks use the collapsed ("folded") format read by flamegraph.pl and speedscope.
+
+With sampling and slow capture off, a request costs one header scan, and each SQL statement one
+context variable lookup. Settings and captures are per worker process.
+"""
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .database import ProfilerSettings, ProfilerSettingsUpdate, ProfiledStatement, ProfileCaptureSummary, ProfileCaptureRead
+
+PROFILE_HEADER = b"x-profile"
+CAPTURE_HEADER = b"x-profile-capture"
+MAX_SQL_STATEMENTS = 200
+SQL_TEXT_LIMIT = 500
+MAX_STACK_DEPTH = 64
+IDLE_LEAVES = {("selectors.py", "select"), ("threading.py", "wait")} # Event loop / threadpool thread waiting for work
+
+_current: ContextVar[Optional["RequestProfile"]] = ContextVar("request_profile", default=None)
+
+
+def fold_stack(frame) -> str:
+    """`file:function` frames from the root to `frame`, ';'-separated (one line of a folded stack file)."""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _is_idle(frame) -> bool:
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_LEAVES
+
+
+class RequestProfile:
+    def __init__(self, capture_id: int, method: str, path: str, query_string: str, reason: Optional[str], sample_from: float):
+        self.id = capture_id
+        self.method = method
+        self.path = path
+        self.query_string = query_string
+        self.reason = reason # None until the request turns out slow
+        self.started = time.perf_counter()
+        self.started_at = datetime.utcnow()
+        self.sample_from = sample_from # perf_counter() value from which stacks are sampled
+        self.status_code: Optional[int] = None
+        self.threads: Set[int] = {threading.get_ident()}
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.sql: List[ProfiledStatement] = []
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+
+    def record_sql(self, statement: str, seconds: float) -> None:
+        self.sql_count += 1
+        self.sql_seconds += seconds
+        if len(self.sql) < MAX_SQL_STATEMENTS: self.sql.append(ProfiledStatement(statement=statement[:SQL_TEXT_LIMIT], duration_ms=round(seconds * 1000, 3)))
+
+    def to_capture(self, duration_seconds: float) -> ProfileCaptureRead:
+        return ProfileCaptureRead(
+            id=self.id, method=self.method, path=self.path, reason=self.reason, status_code=self.status_code, started_at=self.started_at,
+            duration_ms=round(duration_seconds * 1000, 3), sql_count=self.sql_count, sql_ms=round(self.sql_seconds * 1000, 3),
+            samples=self.samples, query_string=self.query_string, sql=self.sql, stacks=dict(self.stacks.most_common()),
+        )
+
+
+class StackSampler:
+    """One daemon thread, running only while profiled requests are in flight."""
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self._profiles: Dict[int, RequestProfile] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles[profile.id] = profile
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def remove(self, profile: RequestProfile) -> None:
+        with self._lock: self._profiles.pop(profile.id, None)
+
+    def _run(self) -> None:
+        sampler_ident = threading.get_ident()
+        while True:
+            self._wake.clear()
+            with self._lock: profiles = list(self._profiles.values())
+            if not profiles:
+                self._wake.wait()
+                continue
+            time.sleep(self.interval_seconds)
+            now = time.perf_counter()
+            due = [profile for profile in profiles if now >= profile.sample_from]
+            if not due: continue
+            frames = sys._current_frames()
+            for profile in due:
+                profile.samples += 1
+                for ident in list(profile.threads):
+                    frame = frames.get(ident)
+                    if frame is not None and ident != sampler_ident and not _is_idle(frame): profile.stacks[fold_stack(frame)] += 1
+
+
+class RequestProfiler:
+    def __init__(self, sample_rate: float = 0.0, slow_threshold_ms: Optional[float] = None, interval_ms: float = 5.0, max_captures: int = 50):
+        self.sample_rate = sample_rate
+        self.slow_threshold_ms = slow_threshold_ms or None
+        self._ids = itertools.count(1)
+        self._captures: Deque[ProfileCaptureRead] = deque(maxlen=max_captures)
+        self._lock = threading.Lock()
+        self._sampler = StackSampler(interval_ms / 1000)
+
+    def settings(self) -> ProfilerSettings:
+        return ProfilerSettings(
+            sample_rate=self.sample_rate, slow_threshold_ms=self.slow_threshold_ms,
+            interval_ms=self._sampler.interval_seconds * 1000, max_captures=self._captures.maxlen,
+        )
+
+    def update_settings(self, settings_in: ProfilerSettingsUpdate) -> ProfilerSettings:
+        changes = settings_in.model_dump(exclude_unset=True)
+        if changes.get("sample_rate") is not None: self.sample_rate = changes["sample_rate"]
+        if "slow_threshold_ms" in changes: self.slow_threshold_ms = changes["slow_threshold_ms"] or None
+        if changes.get("interval_ms") is not None: self._sampler.interval_seconds = changes["interval_ms"] / 1000
+        if changes.get("max_captures") is not None:
+            with self._lock: self._captures = deque(self._captures, maxlen=changes["max_captures"])
+        return self.settings()
+
+    def install(self, target_engine: Engine) -> None:
+        event.listen(target_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(target_engine, "after_cursor_execute", _after_cursor_execute)
+
+    def begin(self, scope, reason: Optional[str]) -> RequestProfile:
+        now = time.perf_counter()
+        sample_from = now if reason else now + self.slow_threshold_ms / 2000
+        profile = RequestProfile(next(self._ids), scope["method"], scope["path"], scope.get("query_string", b"").decode("latin-1"), reason, sample_from)
+        self._sampler.add(profile)
+        return profile
+
+    def finish(self, profile: RequestProfile) -> Optional[ProfileCaptureRead]:
+        self._sampler.remove(profile)
+        duration = time.perf_counter() - profile.started
+        if profile.reason is None:
+            if self.slow_threshold_ms is None or duration * 1000 < self.slow_threshold_ms: return None
+            profile.reason = "slow"
+        capture = profile.to_capture(duration)
+        with self._lock: self._captures.append(capture)
+        if profile.reason == "slow": print(f"WARNING:  Slow request {profile.method} {profile.path}: {capture.duration_ms:.0f} ms (profile capture {capture.id})")
+        return capture
+
+    def captures(self) -> List[ProfileCaptureSummary]:
+        with self._lock: captures = list(self._captures)
+        return [ProfileCaptureSummary.model_validate(capture.model_dump(include=set(ProfileCaptureSummary.model_fields))) for capture in reversed(captures)]
+
+    def get_capture(self, capture_id: int) -> Optional[ProfileCaptureRead]:
+        with self._lock: return next((capture for capture in self._captures if capture.id == capture_id), None)
+
+    def clear(self) -> None:
+        with self._lock: self._captures.clear()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    if profile is None or context is None: return
+    profile.threads.add(threading.get_ident()) # Threadpool thread serving this request
+    context._profile_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    if profile is None or context is None: return
+    started = getattr(context, "_profile_started", None)
+    if started is not None: profile.record_sql(statement, time.perf_counter() - started)
+
+
+def folded_text(capture: ProfileCaptureRead) -> str:
+    """Input for `flamegraph.pl` or speedscope: one "stack count" line per distinct stack."""
+    return "".join(f"{stack} {count}\n" for stack, count in capture.stacks.items())
+
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware. `authorize(scope)` decides whether an `X-Profile` header is honoured (superusers
+    only); profiled responses carry `X-Profile-Capture: <id>`.
+    """
+
+    def __init__(self, app, profiler: "RequestProfiler", authorize: Callable[[dict], Awaitable[bool]],
+                 exempt_prefixes=("/static", "/api/admin/events/stream", "/api/admin/profiler")):
+        self.app = app
+        self.profiler = profiler
+        self.authorize = authorize
+        self.exempt_prefixes = tuple(exempt_prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exempt_prefixes):
+            await self.app(scope, receive, send)
+            return
+        profiler = self.profiler
+        if any(name == PROFILE_HEADER for name, _ in scope["headers"]) and await self.authorize(scope): reason = "header"
+        elif profiler.sample_rate and random.random() < profiler.sample_rate: reason = "sampled"
+        elif profiler.slow_threshold_ms is not None: reason = None
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        profile = profiler.begin(scope, reason)
+        token = _current.set(profile)
+
+        async def send_with_capture_id(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                if reason: message["headers"] = list(message.get("headers", [])) + [(CAPTURE_HEADER, str(profile.id).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_capture_id)
+        finally:
+            _current.reset(token)
+            profiler.finish(profile)
+
+
+def _env_float(name: str) -> float:
+    try: return float(os.environ.get(name, "0") or 0)
+    except ValueError: return 0.0
+
+
+profiler = RequestProfiler(sample_rate=_env_float("PROFILE_SAMPLE_RATE"), slow_threshold_ms=_env_float("PROFILE_SLOW_MS") or None)
@@ -0,0 +1,234 @@
+"""
+Request admission control: per-client token buckets and a global concurrency limit.
+
+`RateLimitMiddleware` matches each request against an ordered list of `RateLimitRule`s (first match
+wins) and takes a token from the bucket of the rule's key (client IP, or the account of a caller whose
+bearer token verifies; an unverified token counts as its IP, so random tokens do not buy fresh
+buckets). An empty bucket answers 429 with Retry-After before any route code, DB
+session or bcrypt runs. Admitted requests then wait at most `queue_timeout` seconds for one of
+`max_concurrent` slots; a request that cannot get one is shed with 503 + Retry-After instead of
+piling up behind the SQLite connection pool.
+
+Buckets live in process memory by default. With several worker processes, pass a
+`SQLiteBucketStore` (a small separate DB file, never the application DB) so every worker draws
+from the same buckets.
+"""
+import asyncio
+import hashlib
+import itertools
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import orjson
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+
+
+class RateLimitRule:
+    def __init__(self, name: str, path_prefix: str, rate_per_minute: float, burst: int, methods: Optional[Iterable[str]] = None, key: str = "ip", path_regex: Optional[str] = None):
+        self.name = name
+        self.path_prefix = path_prefix
+        self.path_regex = re.compile(path_regex) if path_regex else None # Checked after the (cheap) prefix
+        self.rate_per_second = rate_per_minute / 60.0
+        self.burst = burst
+        self.methods = {method.upper() for method in methods} if methods else None
+        self.key = key # "ip" or "client" (account of a verified bearer token, else IP)
+
+    def matches(self, method: str, path: str) -> bool:
+        if not path.startswith(self.path_prefix) or (self.methods is not None and method not in self.methods): return False
+        return self.path_regex is None or self.path_regex.match(path) is not None
+
+
+# Ordered: first match wins. Budgets are per key (IP or client) and per process unless a shared store is used.
+DEFAULT_RULES = [
+    RateLimitRule("login", "/token", rate_per_minute=10, burst=5, methods=["POST"]), # bcrypt per attempt
+    RateLimitRule("signup", "/users/", rate_per_minute=5, burst=3, methods=["POST"], path_regex=r"^/users/?$"), # Unauthenticated, bcrypt per request
+    RateLimitRule("public_catalog", "/api/catalog", rate_per_minute=120, burst=60, methods=["GET"]),
+    RateLimitRule("product_batch", "/api/products/batch", rate_per_minute=30, burst=10, methods=["GET"]), # Public, up to 200 products per call
+    RateLimitRule("product_detail", "/api/products/", rate_per_minute=120, burst=60, methods=["GET"], path_regex=r"^/api/products/\d+/?$"), # Public, unauthenticated
+    RateLimitRule("exports", "/api/", rate_per_minute=6, burst=3, methods=["GET"], key="client", path_regex=r"^/api/.*/export$"),
+    RateLimitRule("api", "/api/", rate_per_minute=600, burst=120, key="client"),
+]
+
+
+class MemoryBucketStore:
+    """Token buckets in a bounded LRU dict (idle keys are evicted first)."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate_per_second: float, burst: int, now: Optional[float] = None) -> Tuple[bool, float]:
+        """Returns (allowed, retry_after_seconds)."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (float(burst), now))
+            tokens = min(float(burst), tokens + (now - updated) * rate_per_second)
+            allowed = tokens >= 1.0
+            if allowed: tokens -= 1.0
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys: self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1.0 - tokens) / rate_per_second
+
+
+class SQLiteBucketStore:
+    """
+    Token buckets shared by every worker process through a small WAL-mode SQLite file. Each take is
+    one BEGIN IMMEDIATE transaction on a per-thread connection (well under a millisecond, but up to
+    the 1 s busy timeout under contention, hence `blocking`: the middleware calls it in the threadpool).
+    Every `purge_every` takes, a process deletes buckets idle for `idle_seconds` (long enough to have
+    refilled completely, so dropping them changes no decision).
+    """
+    blocking = True
+
+    def __init__(self, path: str, purge_every: int = 10_000, idle_seconds: float = 3600):
+        self.path = path
+        self.purge_every = purge_every
+        self.idle_seconds = idle_seconds
+        self._takes = itertools.count(1)
+        self._local = threading.local()
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+        connection.commit(); connection.close() # Created before a (preload) fork: nothing may be shared with the workers
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            connection.execute("PRAGMA synchronous=OFF") # Losing a few tokens on power loss is fine
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def take(self, key: str, rate_per_second: float, burst: int, now: Optional[float] = None) -> Tuple[bool, float]:
+        now = time.time() if now is None else now # Wall clock: shared between processes
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT tokens, updated FROM bucket WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (float(burst), now)
+            tokens = min(float(burst), tokens + max(0.0, now - updated) * rate_per_second)
+            allowed = tokens >= 1.0
+            if allowed: tokens -= 1.0
+            connection.execute("INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            connection.execute("COMMIT")
+            if next(self._takes) % self.purge_every == 0: self.purge(self.idle_seconds)
+        except sqlite3.OperationalError: # Store busy or unavailable: fail open rather than reject traffic
+            if connection.in_transaction: connection.execute("ROLLBACK")
+            return True, 0.0
+        return allowed, 0.0 if allowed else (1.0 - tokens) / rate_per_second
+
+    def purge(self, older_than_seconds: float = 3600) -> int:
+        """Deletes buckets not used for `older_than_seconds`. Returns the number removed."""
+        connection = self._connect()
+        return connection.execute("DELETE FROM bucket WHERE updated < ?", (time.time() - older_than_seconds,)).rowcount
+
+
+class AdmissionMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rules: Dict[str, Dict[str, int]] = {}
+        self.admitted = 0
+        self.shed = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def count_rule(self, rule_name: str, allowed: bool) -> None:
+        with self._lock:
+            counters = self.rules.setdefault(rule_name, {"allowed": 0, "limited": 0})
+            counters["allowed" if allowed else "limited"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            rules = {
+                name: {**counters, "limited_ratio": round(counters["limited"] / max(1, counters["allowed"] + counters["limited"]), 4)}
+                for name, counters in self.rules.items()
+            }
+            return {"rules": rules, "admitted": self.admitted, "shed": self.shed, "in_flight": self.in_flight, "peak_in_flight": self.peak_in_flight}
+
+
+def _client_ip(scope, trust_forwarded: bool) -> str:
+    if trust_forwarded:
+        forwarded_for = Headers(scope=scope).get("x-forwarded-for")
+        if forwarded_for: return forwarded_for.split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _client_key(scope, trust_forwarded: bool, principal: Optional[Callable[[str], Optional[str]]]) -> str:
+    """Account key when `principal` verifies the bearer token (signature and expiry, no DB), else the client IP."""
+    authorization = Headers(scope=scope).get("authorization", "")
+    if principal is not None and authorization.lower().startswith("bearer "):
+        subject = principal(authorization[7:].strip())
+        if subject: return "user:" + hashlib.sha1(subject.encode()).hexdigest()
+    return "ip:" + _client_ip(scope, trust_forwarded)
+
+
+async def _reject(send, status_code: int, detail: str, retry_after: float) -> None:
+    body = orjson.dumps({"detail": detail})
+    await send({
+        "type": "http.response.start", "status": status_code,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), (b"retry-after", str(max(1, math.ceil(retry_after))).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware: token-bucket rate limiting, then a concurrency gate. Paths in `exempt_prefixes`
+    (static files, long-lived SSE streams) bypass both. `principal(token)` returns the account a valid
+    bearer token belongs to (None when it does not verify); without it every caller is keyed by IP.
+    """
+
+    def __init__(self, app, rules: Optional[List[RateLimitRule]] = None, store=None, max_concurrent: int = 15, queue_timeout: float = 2.0,
+                 exempt_prefixes: Iterable[str] = ("/static", "/api/admin/events/stream"), trust_forwarded: bool = False, metrics: Optional[AdmissionMetrics] = None,
+                 principal: Optional[Callable[[str], Optional[str]]] = None):
+        self.app = app
+        self.rules = DEFAULT_RULES if rules is None else rules
+        self.store = store or MemoryBucketStore()
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.exempt_prefixes = tuple(exempt_prefixes)
+        self.trust_forwarded = trust_forwarded
+        self.metrics = metrics or AdmissionMetrics()
+        self.principal = principal
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exempt_prefixes):
+            await self.app(scope, receive, send)
+            return
+        method, path = scope["method"], scope["path"]
+        rule = next((rule for rule in self.rules if rule.matches(method, path)), None)
+        if rule is not None:
+            key = _client_key(scope, self.trust_forwarded, self.principal) if rule.key == "client" else "ip:" + _client_ip(scope, self.trust_forwarded)
+            if getattr(self.store, "blocking", False): allowed, retry_after = await run_in_threadpool(self.store.take, f"{rule.name}|{key}", rule.rate_per_second, rule.burst) # Never wait on a file lock in the event loop
+            else: allowed, retry_after = self.store.take(f"{rule.name}|{key}", rule.rate_per_second, rule.burst)
+            self.metrics.count_rule(rule.name, allowed)
+            if not allowed:
+                await _reject(send, 429, "Too many requests", retry_after)
+                return
+
+        if self._semaphore is None: self._semaphore = asyncio.Semaphore(self.max_concurrent) # Bound to the serving loop
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.metrics.shed += 1
+            await _reject(send, 503, "Server busy, retry shortly", 1)
+            return
+        metrics = self.metrics
+        metrics.admitted += 1; metrics.in_flight += 1
+        metrics.peak_in_flight = max(metrics.peak_in_flight, metrics.in_flight)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            metrics.in_flight -= 1
+            self._semaphore.release()
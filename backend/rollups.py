@@ -0,0 +1,263 @@
+"""
+Daily sales rollups: incremental maintenance, nightly compaction and cross-checks.
+
+Sale writes call `apply_rollup_delta(session, before, after)` inside their own transaction, with the
+sale's contributions captured before and after the change, so rollups commit (or roll back) together
+with the sale. The nightly job (jobs.REBUILD_ROLLUPS) recomputes the trailing `REBUILD_DAYS` from the
+raw tables, which also folds in late category changes and drops rows that netted out to zero. On a
+database with sales from before the rollups existed, startup enqueues one rebuild from the first
+sale day (`unrolled_history_start`).
+
+Usage (from the project root):
+    python -m backend.rollups rebuild [--days 3] [--from 2024-01-01 --to 2024-12-31]
+    python -m backend.rollups verify [--days 30]
+"""
+import argparse
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session
+
+from .database import (
+    engine, Sale, SaleArchive, Product, Category, User, SaleStatusEnum, SaleDailyRollup, SaleItemDailyRollup,
+    SalesReportRow, RollupMismatch,
+)
+from .archive import sales_with_archive, sale_items_with_archive
+
+SaleKey = Tuple[date, int, SaleStatusEnum]
+ItemKey = Tuple[date, int, SaleStatusEnum]
+Contributions = Tuple[Dict[SaleKey, tuple], Dict[ItemKey, tuple]]
+
+GROUP_BY_OPTIONS = ("day", "status", "client", "product", "category")
+PERIOD_OPTIONS = ("total", "day", "week", "month")
+COMPACTION_CHUNK_DAYS = 31 # One short transaction per chunk
+REBUILD_DAYS = 3 # Nightly: today plus late edits
+
+
+# --- Incremental Maintenance ---
+def sale_contributions(sale: Sale) -> Contributions:
+    """What `sale` currently adds to each rollup row: ({sale_key: (count, total, discount, points)}, {item_key: (category_id, units, revenue, lines)})."""
+    day = sale.sale_date.date()
+    sale_rows = {(day, sale.user_id, sale.status): (1, sale.total_amount or 0.0, sale.discount_amount or 0.0, sale.points_earned or 0)}
+    item_rows: Dict[ItemKey, tuple] = {}
+    for item in sale.items:
+        key = (day, item.product_id, sale.status)
+        category_id = item.product.category_id if item.product else None
+        _, units, revenue, lines = item_rows.get(key, (None, 0, 0.0, 0))
+        item_rows[key] = (category_id, units + item.quantity, revenue + (item.subtotal or 0.0), lines + 1)
+    return sale_rows, item_rows
+
+
+NO_CONTRIBUTIONS: Contributions = ({}, {})
+
+
+sale_rollups, item_rollups = SaleDailyRollup.__table__, SaleItemDailyRollup.__table__
+
+
+def _increment(table, key_columns: Dict[str, object], deltas: Dict[str, object], rounded: Iterable[str] = (), keep_if_null: Iterable[str] = ()):
+    """
+    INSERT ... ON CONFLICT DO UPDATE adding `deltas` to the row of `key_columns`: one atomic statement,
+    so two writers creating the same day's row cannot collide on its primary key.
+    """
+    statement = sqlite_insert(table).values(**key_columns, **deltas)
+    updates = {}
+    for name in deltas:
+        if name in keep_if_null: updates[name] = func.coalesce(statement.excluded[name], table.c[name])
+        elif name in rounded: updates[name] = func.round(table.c[name] + statement.excluded[name], 2)
+        else: updates[name] = table.c[name] + statement.excluded[name]
+    return statement.on_conflict_do_update(index_elements=list(key_columns), set_=updates)
+
+
+def apply_rollup_delta(session: Session, before: Contributions, after: Contributions) -> None:
+    """Adds `after - before` to the rollup rows. Does not commit; call inside the sale's transaction."""
+    before_sales, before_items = before
+    after_sales, after_items = after
+    for key in set(before_sales) | set(after_sales):
+        old, new = before_sales.get(key, (0, 0.0, 0.0, 0)), after_sales.get(key, (0, 0.0, 0.0, 0))
+        if old == new: continue
+        session.execute(_increment(
+            sale_rollups, {"day": key[0], "user_id": key[1], "status": key[2]},
+            {"sale_count": new[0] - old[0], "total_amount": round(new[1] - old[1], 2), "discount_amount": round(new[2] - old[2], 2), "points_earned": new[3] - old[3]},
+            rounded=("total_amount", "discount_amount"),
+        ))
+    for key in set(before_items) | set(after_items):
+        old, new = before_items.get(key, (None, 0, 0.0, 0)), after_items.get(key, (None, 0, 0.0, 0))
+        if old[1:] == new[1:]: continue
+        session.execute(_increment(
+            item_rollups, {"day": key[0], "product_id": key[1], "status": key[2]},
+            {"category_id": new[0], "units": new[1] - old[1], "revenue": round(new[2] - old[2], 2), "line_count": new[3] - old[3]},
+            rounded=("revenue",), keep_if_null=("category_id",),
+        ))
+
+
+# --- Compaction (recompute from raw tables) ---
+def _raw_sale_aggregates(start: datetime, end: datetime):
+    sales = sales_with_archive(start, end) # Archived sales keep counting in their days
+    day = func.date(sales.c.sale_date)
+    return (
+        select(day.label("day"), sales.c.user_id, sales.c.status, func.count(sales.c.id), func.coalesce(func.sum(sales.c.total_amount), 0.0),
+               func.coalesce(func.sum(sales.c.discount_amount), 0.0), func.coalesce(func.sum(sales.c.points_earned), 0))
+        .group_by(day, sales.c.user_id, sales.c.status)
+    )
+
+
+def _raw_item_aggregates(start: datetime, end: datetime):
+    items = sale_items_with_archive(start, end)
+    day = func.date(items.c.sale_date)
+    return (
+        select(day.label("day"), items.c.product_id, items.c.status, func.max(Product.category_id), func.sum(items.c.quantity),
+               func.coalesce(func.sum(items.c.subtotal), 0.0), func.count(items.c.id))
+        .join(Product, items.c.product_id == Product.id, isouter=True)
+        .group_by(day, items.c.product_id, items.c.status)
+    )
+
+
+def _day_bounds(date_from: date, date_to: date) -> Tuple[datetime, datetime]:
+    return datetime.combine(date_from, time.min), datetime.combine(date_to + timedelta(days=1), time.min)
+
+
+def rebuild_rollups(date_from: date, date_to: date, target_engine=engine) -> int:
+    """Replaces the rollup rows of [date_from, date_to] with a GROUP BY over the raw (hot and archive) tables. Returns the number of days rebuilt."""
+    sale_table, item_table = sale_rollups, item_rollups
+    chunk_start = date_from
+    while chunk_start <= date_to:
+        chunk_end = min(chunk_start + timedelta(days=COMPACTION_CHUNK_DAYS - 1), date_to)
+        start, end = _day_bounds(chunk_start, chunk_end)
+        with target_engine.begin() as connection:
+            connection.execute(delete(sale_table).where(sale_table.c.day >= chunk_start, sale_table.c.day <= chunk_end))
+            connection.execute(delete(item_table).where(item_table.c.day >= chunk_start, item_table.c.day <= chunk_end))
+            connection.execute(insert(sale_table).from_select(
+                ["day", "user_id", "status", "sale_count", "total_amount", "discount_amount", "points_earned"], _raw_sale_aggregates(start, end)))
+            connection.execute(insert(item_table).from_select(
+                ["day", "product_id", "status", "category_id", "units", "revenue", "line_count"], _raw_item_aggregates(start, end)))
+        chunk_start = chunk_end + timedelta(days=1)
+    return (date_to - date_from).days + 1
+
+
+def unrolled_history_start(session: Session) -> Optional[date]:
+    """First sale day (hot or archived) older than every rollup row, i.e. history never rolled up; None when covered."""
+    first_sale = min((day for day in (session.execute(select(func.min(model.sale_date))).scalar() for model in (Sale, SaleArchive)) if day is not None), default=None)
+    if first_sale is None: return None
+    first_rollup_day = session.execute(select(func.min(sale_rollups.c.day))).scalar()
+    return first_sale.date() if first_rollup_day is None or first_sale.date() < first_rollup_day else None
+
+
+def verify_rollups(session: Session, date_from: date, date_to: date, tolerance: float = 0.01) -> List[RollupMismatch]:
+    """Cross-checks rollup rows against a recomputation from Sale/SaleItem (and their archive tables). An empty list means they agree."""
+    start, end = _day_bounds(date_from, date_to)
+    mismatches: List[RollupMismatch] = []
+
+    def compare(table_name: str, expected: Dict[tuple, tuple], actual: Dict[tuple, tuple]):
+        for key in set(expected) | set(actual):
+            exp, act = expected.get(key), actual.get(key)
+            if exp is not None and act is not None and all(abs(float(a or 0) - float(b or 0)) <= tolerance for a, b in zip(exp, act)): continue
+            if exp is None and act is not None and not any(act): continue # Netted-out row awaiting compaction
+            mismatches.append(RollupMismatch(table=table_name, key=str(key), expected=str(exp), actual=str(act)))
+
+    def as_key(day_value, *rest) -> tuple:
+        return (str(day_value),) + tuple(getattr(value, "value", value) for value in rest)
+
+    expected_sales = {as_key(r[0], r[1], r[2]): tuple(r[3:]) for r in session.execute(_raw_sale_aggregates(start, end)).all()}
+    actual_sales = {
+        as_key(r.day, r.user_id, r.status): (r.sale_count, r.total_amount, r.discount_amount, r.points_earned)
+        for r in session.execute(select(SaleDailyRollup).where(SaleDailyRollup.day >= date_from, SaleDailyRollup.day <= date_to)).scalars().all()
+    }
+    compare("saledailyrollup", expected_sales, actual_sales)
+    expected_items = {as_key(r[0], r[1], r[2]): (r[4], r[5], r[6]) for r in session.execute(_raw_item_aggregates(start, end)).all()}
+    actual_items = {
+        as_key(r.day, r.product_id, r.status): (r.units, r.revenue, r.line_count)
+        for r in session.execute(select(SaleItemDailyRollup).where(SaleItemDailyRollup.day >= date_from, SaleItemDailyRollup.day <= date_to)).scalars().all()
+    }
+    compare("saleitemdailyrollup", expected_items, actual_items)
+    return mismatches
+
+
+# --- Reporting ---
+def _period_label(day: date, period: str) -> Optional[str]:
+    if period == "day": return day.isoformat()
+    if period == "week":
+        iso_year, iso_week, _ = day.isocalendar()
+        return f"{iso_year}-W{iso_week:02d}"
+    if period == "month": return f"{day.year}-{day.month:02d}"
+    return None
+
+
+def sales_report(session: Session, date_from: date, date_to: date, group_by: str, period: str = "total", statuses: Optional[Iterable[SaleStatusEnum]] = None, limit: int = 100) -> List[SalesReportRow]:
+    """Answers revenue/units questions from the rollup tables only; rows are ordered by revenue, highest first."""
+    statuses = list(statuses) if statuses else [s for s in SaleStatusEnum if s != SaleStatusEnum.CANCELADO]
+    if group_by in ("product", "category"):
+        key_column = SaleItemDailyRollup.product_id if group_by == "product" else SaleItemDailyRollup.category_id
+        query = (
+            select(SaleItemDailyRollup.day, key_column, func.sum(SaleItemDailyRollup.units), func.sum(SaleItemDailyRollup.revenue), func.sum(SaleItemDailyRollup.line_count))
+            .where(SaleItemDailyRollup.day >= date_from, SaleItemDailyRollup.day <= date_to, SaleItemDailyRollup.status.in_(statuses))
+            .group_by(SaleItemDailyRollup.day, key_column)
+        )
+        rows = [(day, key, 0, units or 0, revenue or 0.0) for day, key, units, revenue, _ in session.execute(query).all()]
+    else:
+        key_column = {"client": SaleDailyRollup.user_id, "status": SaleDailyRollup.status}.get(group_by)
+        columns = [SaleDailyRollup.day] + ([key_column] if key_column is not None else [])
+        query = (
+            select(*columns, func.sum(SaleDailyRollup.sale_count), func.sum(SaleDailyRollup.total_amount))
+            .where(SaleDailyRollup.day >= date_from, SaleDailyRollup.day <= date_to, SaleDailyRollup.status.in_(statuses))
+            .group_by(*columns)
+        )
+        rows = []
+        for row in session.execute(query).all():
+            day, key = row[0], (row[1] if key_column is not None else None)
+            rows.append((day, key, row[-2] or 0, 0, row[-1] or 0.0))
+
+    bucket_period = "day" if group_by == "day" and period == "total" else period
+    buckets: Dict[tuple, list] = defaultdict(lambda: [0, 0, 0.0])
+    for day, key, sale_count, units, revenue in rows:
+        bucket = buckets[(_period_label(day, bucket_period), None if group_by == "day" else getattr(key, "value", key))]
+        bucket[0] += sale_count; bucket[1] += units; bucket[2] += revenue
+    report = [SalesReportRow(period=p, key=None if k is None else str(k), sale_count=v[0], units=v[1], revenue=round(v[2], 2)) for (p, k), v in buckets.items()]
+    if group_by == "day":
+        report.sort(key=lambda r: r.period or "")
+    else: # Top `limit` keys per period
+        report.sort(key=lambda r: (r.period or "", -r.revenue))
+        per_period: Dict[Optional[str], int] = defaultdict(int)
+        limited = []
+        for row in report:
+            if per_period[row.period] < limit: limited.append(row); per_period[row.period] += 1
+        report = limited
+    _attach_labels(session, group_by, report)
+    return report
+
+
+def _attach_labels(session: Session, group_by: str, report: List[SalesReportRow]) -> None:
+    ids = {int(r.key) for r in report if r.key is not None and r.key.isdigit()}
+    if not ids: return
+    if group_by == "product": labels = dict(session.execute(select(Product.id, Product.name).where(Product.id.in_(ids))).all())
+    elif group_by == "category": labels = dict(session.execute(select(Category.id, Category.name).where(Category.id.in_(ids))).all())
+    elif group_by == "client": labels = dict(session.execute(select(User.id, func.coalesce(User.full_name, User.email)).where(User.id.in_(ids))).all())
+    else: return
+    for row in report:
+        if row.key is not None and row.key.isdigit(): row.label = labels.get(int(row.key))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sales rollup compaction and verification.")
+    parser.add_argument("command", choices=["rebuild", "verify"])
+    parser.add_argument("--days", type=int, default=REBUILD_DAYS, help=f"Trailing days to process (default {REBUILD_DAYS}: today plus late edits).")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat)
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat)
+    args = parser.parse_args()
+    date_to = args.date_to or datetime.utcnow().date()
+    date_from = args.date_from or date_to - timedelta(days=args.days - 1)
+    if args.command == "rebuild":
+        days = rebuild_rollups(date_from, date_to)
+        print(f"Rebuilt rollups for {days} day(s): {date_from} .. {date_to}")
+    else:
+        with Session(engine) as session:
+            mismatches = verify_rollups(session, date_from, date_to)
+        for mismatch in mismatches: print(f"MISMATCH {mismatch.table} {mismatch.key}: expected {mismatch.expected}, got {mismatch.actual}")
+        print(f"{len(mismatches)} mismatch(es) for {date_from} .. {date_to}")
+        if mismatches: raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
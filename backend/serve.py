@@ -0,0 +1,91 @@
+"""
+Multi-process server entry point.
+
+Checks the schema version (creating tables / applying migrations only when it changed) once in the parent, then starts N worker processes (default: one
+per CPU). With gunicorn installed the app is preloaded in the master (workers fork with the
+imports already done) and `kill -HUP <master pid>` replaces the workers gracefully; otherwise it
+falls back to uvicorn's own process manager (no preload).
+
+Per-process state is kept coherent across workers by:
+  * invalidation.py - cache invalidations are relayed through the `cacheversion` table;
+  * ratelimit.py    - token buckets move to a shared SQLite file (RATE_LIMIT_DB, default ratelimit.db);
+  * events.py       - admin SSE live updates are relayed through the `adminevent` table, so an admin
+                      sees events raised by any worker within a poll interval.
+
+Seed a new database once with `python -m backend.bootstrap init`; workers never do it on boot.
+`--startup-profile` prints per-phase import and startup timings instead of serving.
+
+Usage (from the project root):
+    python -m backend.serve [--workers 4] [--host 0.0.0.0] [--port 8000] [--no-preload] [--echo-sql]
+    python -m backend.serve --startup-profile
+"""
+import argparse
+import os
+
+APP_URI = "backend.main:app"
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def prepare_database() -> None:
+    """Bring the schema up to date before any worker starts, so workers never race on it."""
+    from .database import engine
+    from .migrations import ensure_schema
+    ensure_schema()
+    engine.dispose() # No pooled connection may cross the fork
+
+
+def serve_with_gunicorn(args) -> bool:
+    try:
+        from gunicorn.app.base import BaseApplication
+        from gunicorn.util import import_app
+    except ImportError: # pragma: no cover - depends on the environment
+        return False
+
+    class ShowroomApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{args.host}:{args.port}", "workers": args.workers, "worker_class": "uvicorn.workers.UvicornWorker",
+                "preload_app": args.preload, "graceful_timeout": args.graceful_timeout, "timeout": 120, "keepalive": 5,
+            }
+            for key, value in options.items(): self.cfg.set(key, value)
+
+        def load(self):
+            return import_app(APP_URI)
+
+    ShowroomApplication().run()
+    return True
+
+
+def serve_with_uvicorn(args) -> None:
+    import uvicorn
+    if args.workers > 1: print("INFO:     gunicorn not installed: uvicorn workers (no preload, restart to reload).")
+    uvicorn.run(APP_URI, host=args.host, port=args.port, workers=args.workers, timeout_graceful_shutdown=args.graceful_timeout, log_level="info")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with several worker processes.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=default_workers(), help="Worker processes (default: CPU count).")
+    parser.add_argument("--no-preload", dest="preload", action="store_false", help="Import the app in each worker instead of the master (gunicorn only).")
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="Seconds a worker gets to finish in-flight requests on reload/shutdown.")
+    parser.add_argument("--echo-sql", action="store_true", help="Keep SQLAlchemy statement logging on (noisy with several workers).")
+    parser.add_argument("--startup-profile", action="store_true", help="Print per-phase import and startup timings, then exit.")
+    args = parser.parse_args()
+
+    if args.startup_profile:
+        os.environ.setdefault("SQL_ECHO", "0")
+        from .bootstrap import profile_startup, print_profile
+        print_profile(profile_startup())
+        return
+    if args.workers > 1: os.environ.setdefault("RATE_LIMIT_DB", "ratelimit.db") # Before the app (and its middleware) is imported
+    os.environ["SQL_ECHO"] = "1" if args.echo_sql else "0" # Read by database.py in every worker
+    prepare_database()
+    if not serve_with_gunicorn(args): serve_with_uvicorn(args)
+
+
+if __name__ == "__main__":
+    main()
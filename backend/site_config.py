@@ -0,0 +1,65 @@
+"""
+Cached SiteConfiguration (row id=1).
+
+The configuration is read on every sale update, product write and page load (public
+`/api/configuration/`), but changes a few times a year. It is loaded once into an immutable
+`SiteConfigurationRead` snapshot together with its ETag and reloaded after `invalidate()` (called by
+the configuration PUT / logo upload, and relayed to the other worker processes by invalidation.py)
+or when the TTL runs out.
+"""
+import hashlib
+from typing import Optional, Tuple
+
+import orjson
+from sqlmodel import Session
+
+from .cache import LRUCache
+from .database import engine, SiteConfiguration, SiteConfigurationRead
+from .invalidation import invalidation, SITE_CONFIGURATION
+
+SITE_CONFIGURATION_ID = 1
+FERIA_PRICE_FACTOR = 0.65 # No configuration parameter for it (yet)
+
+_config_cache = LRUCache(maxsize=1, ttl_seconds=300)
+invalidation.register(SITE_CONFIGURATION, _config_cache.clear)
+
+
+def _load_snapshot(session: Optional[Session] = None) -> Tuple[SiteConfigurationRead, str]:
+    if session is None:
+        with Session(engine) as own_session: return _load_snapshot(own_session)
+    db_config = session.get(SiteConfiguration, SITE_CONFIGURATION_ID) or SiteConfiguration() # Defaults until the row exists
+    snapshot = SiteConfigurationRead.model_validate(db_config)
+    etag = '"%s"' % hashlib.sha1(orjson.dumps(snapshot.model_dump(mode="json"))).hexdigest()[:20]
+    return snapshot, etag
+
+
+def get_site_configuration_with_etag(session: Optional[Session] = None) -> Tuple[SiteConfigurationRead, str]:
+    """(snapshot, ETag). Pass the request's session to avoid opening a second connection on a miss."""
+    cached = _config_cache.get(SITE_CONFIGURATION_ID)
+    if cached is None:
+        generation = _config_cache.generation # Read before loading: a config write committed meanwhile makes the store a no-op
+        cached = _load_snapshot(session)
+        _config_cache.set(SITE_CONFIGURATION_ID, cached, generation=generation)
+    return cached
+
+
+def get_site_configuration(session: Optional[Session] = None) -> SiteConfigurationRead:
+    return get_site_configuration_with_etag(session)[0]
+
+
+def invalidate_site_configuration() -> None: # Call after any SiteConfiguration write has committed
+    invalidation.publish(SITE_CONFIGURATION) # This process now, the other workers within a poll interval
+
+
+def points_per_currency_unit(session: Optional[Session] = None) -> float:
+    return get_site_configuration(session).system_param_points_per_currency_unit
+
+
+def showroom_price_factor(session: Optional[Session] = None) -> float:
+    """1 - default showroom discount, e.g. 0.80 for the default 20%."""
+    return (100 - get_site_configuration(session).system_param_default_showroom_discount_percentage) / 100
+
+
+def compute_points_earned(total_amount: float, session: Optional[Session] = None) -> int:
+    """Points for a sale total at the configured rate (0.1 = one point per 10 currency units)."""
+    return int(round((total_amount or 0.0) * points_per_currency_unit(session), 6)) # round() absorbs float error (0.29 * 100 is 28.999...)
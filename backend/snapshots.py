@@ -0,0 +1,161 @@
+"""
+Read-only reporting snapshot of the main database.
+
+Sales reports and the CSV/XLSX exports scan Sale/SaleItem for a long time;
+on the single SQLite file their read locks delay checkout and admin commits. These endpoints read a
+copy of the database instead: `refresh()` copies it with the SQLite online backup API (a few hundred
+pages per step, releasing the lock between steps; the copy restarts itself if another connection
+writes meanwhile, so it is always one consistent state) into a temporary file and renames it over
+the snapshot. After `BACKUP_MAX_RESTARTS` restarts (a busy writer could keep it restarting forever)
+it copies the whole file in one step under a single read lock instead. Sessions opened afterwards see the new copy, already open ones finish on the old one.
+
+`route()` picks the engine for a reporting request: the snapshot while it is younger than
+`max_age_seconds`, else the live database (so a stopped refresher degrades to fresh, slower reads,
+not to stale data). Responses say which one was used in `X-Data-Source` and how current it is in
+`X-Data-As-Of`. The job runner refreshes every `interval_seconds` (jobs.REFRESH_REPORTING_SNAPSHOT);
+an applied migration discards the snapshot until the next refresh.
+
+Settings (environment): REPORTING_SNAPSHOT_PATH, REPORTING_SNAPSHOT_INTERVAL_SECONDS (0 turns the
+snapshot off), REPORTING_SNAPSHOT_MAX_AGE_SECONDS.
+
+Usage (from the project root):
+    python -m backend.snapshots refresh
+    python -m backend.snapshots status
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import NullPool
+
+from .database import engine, ReportingSnapshotStatus
+
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP_SECONDS = 0.005
+BACKUP_MAX_RESTARTS = 3
+DATA_SOURCE_HEADER = "X-Data-Source"
+DATA_AS_OF_HEADER = "X-Data-As-Of"
+
+
+class _BackupRestartLimit(Exception):
+    pass
+
+
+def _backup(source: sqlite3.Connection, target: sqlite3.Connection) -> None:
+    """Stepwise online backup; falls back to a single-step copy once writes have restarted it `BACKUP_MAX_RESTARTS` times."""
+    restarts, last_remaining = 0, None
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining: # Went back to the first page: a write restarted the copy
+            restarts += 1
+            if restarts >= BACKUP_MAX_RESTARTS: raise _BackupRestartLimit()
+        last_remaining = remaining
+
+    try: source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=progress, sleep=BACKUP_STEP_SLEEP_SECONDS)
+    except _BackupRestartLimit: source.backup(target, pages=-1) # Writers wait for this one read transaction; it cannot restart
+
+
+class ReportingSnapshot:
+    def __init__(self, source_path: str, path: str, interval_seconds: float = 900, max_age_seconds: float = 3600):
+        self.source_path = source_path
+        self.path = path
+        self.interval_seconds = interval_seconds
+        self.max_age_seconds = max_age_seconds
+        self.last_refresh_seconds: Optional[float] = None
+        self._refresh_lock = threading.Lock()
+        # NullPool: every session opens the file anew, so it picks up the copy renamed in by the last refresh
+        self.engine = create_engine(f"sqlite:///file:{os.path.abspath(path)}?mode=ro&uri=true", poolclass=NullPool)
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval_seconds > 0
+
+    def taken_at(self) -> Optional[datetime]:
+        """UTC time the current copy was completed (its file's mtime), None without a snapshot."""
+        try: return datetime.utcfromtimestamp(os.stat(self.path).st_mtime)
+        except FileNotFoundError: return None
+
+    def age_seconds(self) -> Optional[float]:
+        taken_at = self.taken_at()
+        return None if taken_at is None else max(0.0, (datetime.utcnow() - taken_at).total_seconds())
+
+    def route(self) -> Tuple[Engine, Optional[datetime]]:
+        """(engine, snapshot time) for a reporting read; (live engine, None) when the snapshot is off, missing or too old."""
+        if self.enabled:
+            taken_at = self.taken_at()
+            if taken_at is not None and (datetime.utcnow() - taken_at).total_seconds() <= self.max_age_seconds: return self.engine, taken_at
+        return engine, None
+
+    def headers(self, taken_at: Optional[datetime]) -> Dict[str, str]:
+        as_of = taken_at or datetime.utcnow()
+        return {DATA_SOURCE_HEADER: "snapshot" if taken_at else "live", DATA_AS_OF_HEADER: as_of.replace(microsecond=0).isoformat() + "Z"}
+
+    def refresh(self) -> datetime:
+        """Copies the live database over the snapshot; returns the new snapshot time. One refresh at a time per process."""
+        with self._refresh_lock:
+            started = time.perf_counter()
+            temp_path = f"{self.path}.tmp-{os.getpid()}"
+            source = sqlite3.connect(self.source_path, timeout=30)
+            target = sqlite3.connect(temp_path)
+            try:
+                _backup(source, target)
+            except BaseException:
+                target.close()
+                if os.path.exists(temp_path): os.remove(temp_path)
+                raise
+            finally:
+                source.close()
+            target.close()
+            os.replace(temp_path, self.path) # Atomic: readers see the old copy or the new one, never a partial file
+            self.last_refresh_seconds = round(time.perf_counter() - started, 3)
+            return self.taken_at()
+
+    def discard(self) -> None:
+        """Drops the copy (e.g. after a migration, when its schema no longer matches the models)."""
+        try: os.remove(self.path)
+        except FileNotFoundError: pass
+
+    def status(self) -> ReportingSnapshotStatus:
+        serving_engine, taken_at = self.route()
+        size_bytes = os.path.getsize(self.path) if os.path.exists(self.path) else None
+        return ReportingSnapshotStatus(
+            enabled=self.enabled, serving="snapshot" if serving_engine is self.engine else "live", taken_at=self.taken_at(), age_seconds=self.age_seconds(),
+            interval_seconds=self.interval_seconds, max_age_seconds=self.max_age_seconds, size_bytes=size_bytes, last_refresh_seconds=self.last_refresh_seconds,
+        )
+
+
+def _env_float(name: str, default: float) -> float:
+    try: return float(os.environ.get(name) or default)
+    except ValueError: return default
+
+
+reporting_snapshot = ReportingSnapshot(
+    engine.url.database, os.environ.get("REPORTING_SNAPSHOT_PATH", "./showroom_natura_reporting.db"),
+    interval_seconds=_env_float("REPORTING_SNAPSHOT_INTERVAL_SECONDS", 900), max_age_seconds=_env_float("REPORTING_SNAPSHOT_MAX_AGE_SECONDS", 3600),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh or inspect the read-only reporting snapshot.")
+    parser.add_argument("command", choices=["refresh", "status"])
+    args = parser.parse_args()
+
+    if args.command == "refresh":
+        taken_at = reporting_snapshot.refresh()
+        print(f"Snapshot {reporting_snapshot.path} taken at {taken_at:%Y-%m-%d %H:%M:%S} UTC in {reporting_snapshot.last_refresh_seconds:.2f}s.")
+        return
+    snapshot_status = reporting_snapshot.status()
+    if snapshot_status.taken_at is None: print(f"No snapshot at {reporting_snapshot.path}; reports read the live database.")
+    else: print(f"Snapshot taken at {snapshot_status.taken_at:%Y-%m-%d %H:%M:%S} UTC ({snapshot_status.age_seconds:.0f}s ago, {snapshot_status.size_bytes} bytes); reports read the {snapshot_status.serving} database.")
+    if not snapshot_status.enabled: print("Snapshot routing is off (REPORTING_SNAPSHOT_INTERVAL_SECONDS=0).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Low-stock membership and the stock movement log.
+
+Code that changes `Product.stock_actual` or `stock_critico` calls `record_stock_change` (or
+`adjust_stock`) in the same transaction. It keeps `Product.is_low_stock` in step, so the
+`low_stock=true` filter reads a partial index instead of comparing two columns on every product,
+and it appends a `StockMovement` row with the reason. Movements that cross the threshold are the
+admin alert feed. They are also pushed to the admin SSE stream once the transaction has committed.
+"""
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session
+
+from .database import Product, StockMovement, StockMovementReasonEnum
+from .events import admin_events, STOCK_ALERT, stock_alert_delta
+
+PENDING_ALERTS = "pending_stock_alerts" # session.info key
+
+
+def is_low_stock(stock_actual: Optional[int], stock_critico: Optional[int]) -> bool:
+    """Same rule as the former low_stock filter: a threshold is set and stock is at or below it."""
+    return bool(stock_critico and stock_critico > 0 and (stock_actual or 0) <= stock_critico)
+
+
+def record_stock_change(session: Session, product: Product, stock_before: int, reason: StockMovementReasonEnum, sale_id: Optional[int] = None, user_id: Optional[int] = None) -> Optional[StockMovement]:
+    """
+    Call after setting the product's stock fields, before the commit; the product needs its id
+    (flush new products first). No movement is logged when neither the stock nor the membership changed.
+    """
+    was_low, now_low = product.is_low_stock, is_low_stock(product.stock_actual, product.stock_critico)
+    quantity_change = (product.stock_actual or 0) - (stock_before or 0)
+    if quantity_change == 0 and was_low == now_low: return None
+    product.is_low_stock = now_low
+    movement = StockMovement(
+        product_id=product.id, reason=reason, quantity_change=quantity_change, stock_before=stock_before or 0, stock_after=product.stock_actual or 0,
+        stock_critico=product.stock_critico, low_stock_entered=now_low if now_low != was_low else None, sale_id=sale_id, user_id=user_id,
+    )
+    session.add(product); session.add(movement)
+    if movement.low_stock_entered is not None: session.info.setdefault(PENDING_ALERTS, []).append(stock_alert_delta(product, movement))
+    return movement
+
+
+def adjust_stock(session: Session, product: Product, quantity_change: int, reason: StockMovementReasonEnum, sale_id: Optional[int] = None, user_id: Optional[int] = None) -> Optional[StockMovement]:
+    stock_before = product.stock_actual or 0
+    product.stock_actual = stock_before + quantity_change
+    return record_stock_change(session, product, stock_before, reason, sale_id=sale_id, user_id=user_id)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _publish_stock_alerts(session) -> None:
+    for alert in session.info.pop(PENDING_ALERTS, []): admin_events.publish(STOCK_ALERT, alert)
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _drop_stock_alerts(session) -> None:
+    session.info.pop(PENDING_ALERTS, None)
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import uuid
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile, status
+from starlette.concurrency import run_in_threadpool
+
+# --- Upload Limits ---
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MAX_IMAGE_UPLOAD_BYTES = 5 * 1024 * 1024
+ALLOWED_IMAGE_CONTENT_TYPES = ["image/jpeg", "image/png", "image/gif", "image/webp"]
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Return the image MIME type from the file's magic bytes, or None if it is not a supported image."""
+    if head.startswith(b"\xff\xd8\xff"): return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"): return "image/png"
+    if head[:6] in (b"GIF87a", b"GIF89a"): return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP": return "image/webp"
+    return None
+
+
+def _safe_filename(filename: Optional[str]) -> str:
+    base_name = os.path.basename((filename or "").replace("\\", "/")).replace("..", "")
+    return base_name or "image"
+
+
+async def save_image_upload(image: UploadFile, directory: str, max_bytes: int = MAX_IMAGE_UPLOAD_BYTES) -> str:
+    """
+    Streams an uploaded image into `directory` without blocking the event loop.
+
+    The body is copied chunk by chunk into a temp file (writes run in the threadpool), the size limit
+    is enforced while streaming and the magic bytes are checked before the temp file is atomically
+    renamed into place. Returns the URL path to store in the DB (e.g. "/static/product_images/x.png").
+    """
+    if image.content_type not in ALLOWED_IMAGE_CONTENT_TYPES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid image file type.")
+    fd, tmp_path = await run_in_threadpool(tempfile.mkstemp, dir=directory, suffix=".part")
+    buffer = os.fdopen(fd, "wb")
+    try:
+        total_bytes = 0
+        head = b""
+        while True:
+            chunk = await image.read(UPLOAD_CHUNK_SIZE)
+            if not chunk: break
+            total_bytes += len(chunk)
+            if total_bytes > max_bytes:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Image exceeds the maximum size of {max_bytes // (1024 * 1024)} MB.")
+            if len(head) < 16: head += chunk[:16 - len(head)]
+            await run_in_threadpool(buffer.write, chunk)
+        await run_in_threadpool(buffer.close)
+        if sniff_image_type(head) is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Uploaded file is not a valid image.")
+        file_path = f"{directory}/{uuid.uuid4()}_{_safe_filename(image.filename)}"
+        await run_in_threadpool(os.replace, tmp_path, file_path)
+        return f"/{file_path}"
+    except BaseException:
+        await run_in_threadpool(buffer.close)
+        await run_in_threadpool(_discard_file, tmp_path)
+        raise
+
+
+def _discard_file(file_path: str) -> None:
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def remove_static_file(image_url: Optional[str]) -> None:
+    """Deletes a previously stored file. Meant to run after commit, e.g. as a BackgroundTask."""
+    if not image_url: return
+    file_path = image_url.lstrip('/')
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"WARNING:  Could not delete file {file_path}: {e}")
@@ -106,8 +106,8 @@ async function populateProductDropdown() {
     if (!formEntryProductIdSelect) return;
     const token = getToken();
     try {
-        // Use admin endpoint for products to get all details if needed, or a simpler one if available
-        const response = await fetch(`${API_BASE_URL}/api/products/?limit=2000&is_admin_view=true`, {
+        // Slim summary rows are enough for the dropdown (no tags/category objects)
+        const response = await fetch(`${API_BASE_URL}/api/products/summary/?limit=2000`, {
             headers: token ? { 'Authorization': `Bearer ${token}` } : {}
         });
         if (!response.ok) throw new Error("No se pudieron cargar los productos para el dropdown.");
@@ -61,7 +61,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         // 2. Fetch Sales History (this endpoint should work for both admin and user for their own sales)
         try {
-            const salesResponse = await fetch(`${API_BASE_URL}/api/users/${userId}/sales/?limit=200`, {
+            const salesResponse = await fetch(`${API_BASE_URL}/api/users/${userId}/sales/?limit=200&include_archived=true`, {
                 headers: { 'Authorization': `Bearer ${token}` }
             });
 
@@ -121,11 +121,40 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Full history (all sales, one row per item) streamed by the server as CSV
+    async function downloadSalesExport(userId) {
+        const token = getToken();
+        if (!token) { window.location.href = 'login.html'; return; }
+        try {
+            const response = await fetch(`${API_BASE_URL}/api/sales/export?format=csv&user_id_filter=${userId}`, {
+                headers: { 'Authorization': `Bearer ${token}` }
+            });
+            if (response.status === 401) { logout(); window.location.href = 'login.html'; return; }
+            if (!response.ok) {
+                const errData = await response.json().catch(() => ({detail: `status: ${response.status}`}));
+                throw new Error(errData.detail || response.statusText);
+            }
+            const blob = await response.blob();
+            const link = document.createElement('a');
+            link.href = URL.createObjectURL(blob);
+            link.download = `ventas_cliente_${userId}.csv`;
+            document.body.appendChild(link);
+            link.click();
+            link.remove();
+            URL.revokeObjectURL(link.href);
+        } catch (exportError) {
+            console.error('Error exporting sales history:', exportError);
+            alert(`Error al exportar historial de compras: ${exportError.message}`);
+        }
+    }
+
     const params = new URLSearchParams(window.location.search);
     const userId = params.get('user_id');
 
     if (userId && !isNaN(parseInt(userId))) {
         loadClientAndSalesHistory(parseInt(userId));
+        const exportButton = document.getElementById('export-sales-csv-button');
+        if (exportButton) exportButton.addEventListener('click', () => downloadSalesExport(parseInt(userId)));
     } else {
         console.error('User ID no encontrado o inválido en la URL.');
         const errorMsg = 'ID de usuario no proporcionado o inválido.';
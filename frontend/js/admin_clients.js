@@ -17,6 +17,7 @@ const adminFormNickname = document.getElementById('admin-form-nickname');
 const adminFormWhatsapp = document.getElementById('admin-form-whatsapp');
 const adminFormGender = document.getElementById('admin-form-gender');
 const adminFormClientLevel = document.getElementById('admin-form-client-level');
+const adminFormClientLevelAuto = document.getElementById('admin-form-client-level-auto');
 const adminFormProfileImageInput = document.getElementById('admin-form-profile-image');
 const adminCurrentImagePreview = document.getElementById('admin-current-profile-image-preview');
 const adminRemoveProfileImageButton = document.getElementById('admin-remove-profile-image-button');
@@ -85,6 +86,10 @@ async function openAdminEditModal(userId) {
         adminFormWhatsapp.value = user.client_profile?.whatsapp_number || '';
         adminFormGender.value = user.client_profile?.gender || '';
         adminFormClientLevel.value = user.client_profile?.client_level || 'Plata';
+        if (adminFormClientLevelAuto) {
+            adminFormClientLevelAuto.checked = !user.client_profile?.client_level_manual;
+            adminFormClientLevelAuto.dataset.loadedManual = user.client_profile?.client_level_manual ? 'true' : 'false';
+        }
 
         adminFormProfileImageInput.value = '';
 
@@ -125,7 +130,7 @@ async function fetchAndDisplayAdminClients(filters = {}) {
     params.append('limit', '100');
 
     const queryString = params.toString();
-    const apiUrl = `${API_BASE_URL}/api/admin/client-profiles/${queryString ? '?' + queryString : ''}`;
+    const apiUrl = `${API_BASE_URL}/api/admin/client-profiles/summary/${queryString ? '?' + queryString : ''}`;
 
     try {
         const response = await fetch(apiUrl, {
@@ -150,7 +155,7 @@ async function fetchAndDisplayAdminClients(filters = {}) {
             row.insertCell().textContent = user.full_name || '-';
             row.insertCell().textContent = user.email;
 
-            const profile = user.client_profile;
+            const profile = user; // Summary rows are flat: profile columns sit next to the user columns
 
             row.insertCell().textContent = profile?.nickname || '-';
 
@@ -213,6 +218,15 @@ async function handleAdminClientFormSubmit(event) {
         gender: adminFormGender.value,
         client_level: adminFormClientLevel.value
     };
+    if (adminFormClientLevelAuto) {
+        if (adminFormClientLevelAuto.checked) {
+            // Back to the automatic level: the next recomputation sets it from collected sales
+            delete profileUpdateData.client_level;
+            profileUpdateData.client_level_manual = false;
+        } else if (adminFormClientLevelAuto.dataset.loadedManual !== 'true') {
+            profileUpdateData.client_level_manual = true; // Unchecked by hand: pin the level even if it did not change
+        }
+    }
 
     try {
         // 1. Update text/select data
@@ -260,6 +274,10 @@ if (adminClientEditForm) {
     adminClientEditForm.addEventListener('submit', handleAdminClientFormSubmit);
 }
 
+if (adminFormClientLevel && adminFormClientLevelAuto) {
+    adminFormClientLevel.addEventListener('change', () => { adminFormClientLevelAuto.checked = false; }); // Choosing a level pins it
+}
+
 // Handle Remove Profile Image (Admin)
 async function handleAdminRemoveProfileImage() {
     const userId = adminFormUserId.value;
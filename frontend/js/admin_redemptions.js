@@ -71,7 +71,84 @@ function populateStatusFilterDropdown() {
     }
 }
 
+function renderRedemptionActions(actionsCell, req) {
+    actionsCell.innerHTML = '';
+    if (req.status === RedemptionRequestStatusEnum.PENDIENTE_APROBACION) {
+        actionsCell.innerHTML += `<button class="approve-request-button mdc-button mdc-button--outlined" data-request-id="${req.id}">Aprobar</button> `;
+        actionsCell.innerHTML += `<button class="reject-request-button mdc-button mdc-button--outlined" data-request-id="${req.id}">Rechazar</button>`;
+    } else if (req.status === RedemptionRequestStatusEnum.APROBADO_POR_ENTREGAR) {
+        actionsCell.innerHTML += `<button class="deliver-request-button mdc-button mdc-button--outlined" data-request-id="${req.id}">Marcar Entregado</button>`;
+    }
+}
+
+function renderRedemptionStatus(statusCell, statusKey) {
+    statusCell.innerHTML = '';
+    const statusSpan = document.createElement('span');
+    statusSpan.classList.add('status-badge');
+    statusSpan.classList.add(`status-${statusKey.toLowerCase().replace(/_/g, '-')}`);
+    statusSpan.textContent = RedemptionRequestStatusDisplay[statusKey] || statusKey;
+    statusSpan.title = `Estado: ${RedemptionRequestStatusDisplay[statusKey] || statusKey}`; // Tooltip
+    statusCell.appendChild(statusSpan);
+}
+
+// Renders one summary row (RedemptionRequestListItem shape, also used by the live 'redemption.created' event)
+function renderRedemptionRow(req, prepend = false) {
+    const row = redemptionsTableBody.insertRow(prepend ? 0 : -1);
+    row.dataset.requestId = req.id;
+
+    row.insertCell().textContent = req.id;
+    const userFullName = req.user_full_name || req.user_email || 'N/A';
+    row.insertCell().textContent = `${userFullName} (ID: ${req.user_id})`;
+    row.insertCell().textContent = req.gift_product_name || 'N/A';
+    row.insertCell().textContent = req.points_at_request;
+    row.insertCell().textContent = new Date(req.requested_at).toLocaleString('es-ES', { dateStyle: 'short', timeStyle: 'short'});
+
+    renderRedemptionStatus(row.insertCell(), req.status);
+    row.insertCell().textContent = req.admin_notes || '-';
+    renderRedemptionActions(row.insertCell(), req);
+}
+
+// --- Live updates (SSE) ---
+// New requests and status changes arrive as small deltas instead of re-fetching the whole list.
+let currentRedemptionFilters = {};
+let redemptionEventSource = null;
+
+function applyRedemptionStatusDelta(delta) {
+    const row = redemptionsTableBody?.querySelector(`tr[data-request-id="${delta.id}"]`);
+    if (!row) return;
+    if (currentRedemptionFilters.status && currentRedemptionFilters.status !== delta.status) {
+        row.remove(); // No longer matches the active status filter
+        return;
+    }
+    renderRedemptionStatus(row.cells[5], delta.status);
+    row.cells[6].textContent = delta.admin_notes || '-';
+    renderRedemptionActions(row.cells[7], delta);
+}
+
+function connectRedemptionEvents() {
+    const token = getToken();
+    if (!token || typeof EventSource === 'undefined') return;
+    redemptionEventSource = new EventSource(`${API_BASE_URL}/api/admin/events/stream?token=${encodeURIComponent(token)}`);
+
+    redemptionEventSource.addEventListener('redemption.created', (event) => {
+        const req = JSON.parse(event.data);
+        const filters = currentRedemptionFilters;
+        if (filters.status && filters.status !== req.status) return;
+        if (filters.userId && String(filters.userId) !== String(req.user_id)) return;
+        if (!redemptionsTableBody || redemptionsTableBody.querySelector(`tr[data-request-id="${req.id}"]`)) return;
+        if (noRedemptionsMessage) noRedemptionsMessage.style.display = 'none';
+        renderRedemptionRow(req, true);
+    });
+    redemptionEventSource.addEventListener('redemption.status', (event) => applyRedemptionStatusDelta(JSON.parse(event.data)));
+    redemptionEventSource.addEventListener('resync', () => loadRedemptionRequests(currentRedemptionFilters));
+    redemptionEventSource.onerror = () => {
+        // The browser reconnects on its own (with Last-Event-ID); a closed stream means auth failed.
+        if (redemptionEventSource.readyState === EventSource.CLOSED) console.warn("Live redemption updates disconnected.");
+    };
+}
+
 async function loadRedemptionRequests(filters = {}) {
+    currentRedemptionFilters = filters;
     const token = getToken();
     if (!isLoggedIn() || !token || !getCurrentUserInfo()?.is_superuser) {
         // displayAdminRedemptionMessage("Acceso denegado.", true); // Already handled by DOMContentLoaded check typically
@@ -88,7 +165,7 @@ async function loadRedemptionRequests(filters = {}) {
     params.append('limit', filters.limit || '50');
 
     const queryString = params.toString();
-    const apiUrl = `${API_BASE_URL}/api/admin/redemption-requests/${queryString ? '?' + queryString : ''}`;
+    const apiUrl = `${API_BASE_URL}/api/admin/redemption-requests/summary/${queryString ? '?' + queryString : ''}`;
 
     try {
         const response = await fetch(apiUrl, { headers: { 'Authorization': `Bearer ${token}` } });
@@ -106,37 +183,7 @@ async function loadRedemptionRequests(filters = {}) {
             if (noRedemptionsMessage) noRedemptionsMessage.style.display = 'block';
         } else {
             if (noRedemptionsMessage) noRedemptionsMessage.style.display = 'none';
-            requests.forEach(req => {
-                const row = redemptionsTableBody.insertRow();
-                row.dataset.requestId = req.id;
-
-                row.insertCell().textContent = req.id;
-                const userFullName = req.user?.client_profile?.full_name || req.user?.email || 'N/A';
-                row.insertCell().textContent = `${userFullName} (ID: ${req.user_id})`;
-                row.insertCell().textContent = req.gift_item?.product?.name || 'N/A';
-                row.insertCell().textContent = req.points_at_request;
-                row.insertCell().textContent = new Date(req.requested_at).toLocaleString('es-ES', { dateStyle: 'short', timeStyle: 'short'});
-
-                const statusCell = row.insertCell();
-                const statusSpan = document.createElement('span');
-                statusSpan.classList.add('status-badge');
-                const statusKey = req.status;
-                statusSpan.classList.add(`status-${statusKey.toLowerCase().replace(/_/g, '-')}`);
-                statusSpan.textContent = RedemptionRequestStatusDisplay[statusKey] || statusKey;
-                statusSpan.title = `Estado: ${RedemptionRequestStatusDisplay[statusKey] || statusKey}`; // Tooltip
-                statusCell.appendChild(statusSpan);
-
-                row.insertCell().textContent = req.admin_notes || '-';
-
-                const actionsCell = row.insertCell();
-                actionsCell.innerHTML = '';
-                if (req.status === RedemptionRequestStatusEnum.PENDIENTE_APROBACION) {
-                    actionsCell.innerHTML += `<button class="approve-request-button mdc-button mdc-button--outlined" data-request-id="${req.id}">Aprobar</button> `;
-                    actionsCell.innerHTML += `<button class="reject-request-button mdc-button mdc-button--outlined" data-request-id="${req.id}">Rechazar</button>`;
-                } else if (req.status === RedemptionRequestStatusEnum.APROBADO_POR_ENTREGAR) {
-                    actionsCell.innerHTML += `<button class="deliver-request-button mdc-button mdc-button--outlined" data-request-id="${req.id}">Marcar Entregado</button>`;
-                }
-            });
+            requests.forEach(req => renderRedemptionRow(req));
         }
     } catch (error) {
         console.error("Error loading redemption requests:", error);
@@ -227,7 +274,8 @@ async function handleConfirmRedemptionAction(event) {
 
         displayAdminRedemptionMessage(`Solicitud #${requestId} procesada como '${actionType}' exitosamente.`, false);
         closeActionNotesModal();
-        loadRedemptionRequests();
+        // With the live stream open the row is updated by the 'redemption.status' event.
+        if (!redemptionEventSource || redemptionEventSource.readyState !== EventSource.OPEN) loadRedemptionRequests(currentRedemptionFilters);
 
     } catch (error) {
         console.error(`Error during redemption action '${actionType}':`, error);
@@ -254,6 +302,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     populateStatusFilterDropdown();
     loadRedemptionRequests();
+    connectRedemptionEvents();
 
     if (applyRedemptionFiltersButton) {
         applyRedemptionFiltersButton.addEventListener('click', () => {
@@ -108,33 +108,81 @@ async function handleCatalogAddToCartClick(event) {
     if (typeof updateCartIndicator === 'function') { updateCartIndicator(); } // From auth.js
 }
 
+// Offline fair mode: the whole catalog is kept in localStorage (from /api/catalog/bundle) and only
+// the entries changed since its version are fetched (/api/catalog/changes). Without a connection the
+// cached copy is shown as is.
+const CATALOG_CACHE_KEY = 'catalogCache';
+
+function readCatalogCache() {
+    try {
+        const cached = JSON.parse(localStorage.getItem(CATALOG_CACHE_KEY));
+        return cached && Array.isArray(cached.entries) ? cached : null;
+    } catch (error) {
+        localStorage.removeItem(CATALOG_CACHE_KEY); // Clear corrupted data
+        return null;
+    }
+}
+
+function writeCatalogCache(version, entries) {
+    try {
+        localStorage.setItem(CATALOG_CACHE_KEY, JSON.stringify({ version, entries }));
+    } catch (error) { // Quota exceeded: the catalog still works, just without the offline copy
+        console.warn('Could not store the catalog for offline use:', error);
+    }
+}
+
+function sortCatalogEntries(entries) {
+    return entries.sort((a, b) => (a.display_order - b.display_order) || (a.id - b.id));
+}
+
+function renderCatalogEntries(entries) {
+    catalogItemsContainer.innerHTML = '';
+    if (entries.length === 0) {
+        if (noCatalogItemsMessage) noCatalogItemsMessage.style.display = 'block';
+    } else {
+        if (noCatalogItemsMessage) noCatalogItemsMessage.style.display = 'none';
+        entries.forEach(entry => renderCatalogProduct(entry));
+    }
+}
+
+async function fetchCatalogBundle() {
+    const response = await fetch(`${API_BASE_URL}/api/catalog/bundle`); // Public endpoint, gzip-encoded
+    if (!response.ok) throw new Error(response.statusText || 'No se pudo cargar el catálogo.');
+    const bundle = await response.json();
+    writeCatalogCache(bundle.version, bundle.entries);
+    return bundle;
+}
+
+async function syncCatalogChanges(cached) {
+    const response = await fetch(`${API_BASE_URL}/api/catalog/changes?since=${cached.version}`);
+    if (!response.ok) throw new Error(response.statusText || 'No se pudo sincronizar el catálogo.');
+    const changes = await response.json();
+    if (changes.full_reload) return fetchCatalogBundle();
+    if (changes.version === cached.version) return null; // Nothing changed
+    const byProductId = new Map(cached.entries.map(entry => [entry.product_id, entry]));
+    changes.removed_product_ids.forEach(productId => byProductId.delete(productId));
+    changes.entries.forEach(entry => byProductId.set(entry.product_id, entry));
+    const entries = sortCatalogEntries(Array.from(byProductId.values()));
+    writeCatalogCache(changes.version, entries);
+    return { version: changes.version, entries };
+}
+
 async function loadCatalogProducts() {
     if (!catalogItemsContainer) {
         console.log("Catalog items container not found on this page. Skipping catalog load.");
         if (noCatalogItemsMessage) noCatalogItemsMessage.style.display = 'none'; // Hide if no container
         return;
     }
+    const cached = readCatalogCache();
+    if (cached) renderCatalogEntries(cached.entries); // Shown right away, even offline
     try {
-        const response = await fetch(`${API_BASE_URL}/api/catalog/entries/?limit=50`); // Public endpoint
-        if (!response.ok) {
-            const errText = await response.text();
-            let errDetail = 'No se pudo cargar el catálogo.';
-            try {
-                const errJson = JSON.parse(errText);
-                errDetail = errJson?.detail || errDetail;
-            } catch (e) { /* Use errText or default */ errDetail = response.statusText || errDetail; }
-            throw new Error(errDetail);
-        }
-        const entries = await response.json();
-
-        catalogItemsContainer.innerHTML = '';
-        if (entries.length === 0) {
-            if (noCatalogItemsMessage) noCatalogItemsMessage.style.display = 'block';
-        } else {
-            if (noCatalogItemsMessage) noCatalogItemsMessage.style.display = 'none';
-            entries.forEach(entry => renderCatalogProduct(entry));
-        }
+        const updated = cached ? await syncCatalogChanges(cached) : await fetchCatalogBundle();
+        if (updated) renderCatalogEntries(updated.entries);
     } catch (error) {
+        if (cached) { // Offline or server unreachable: keep showing the stored catalog
+            console.warn("Catalog sync failed, showing the stored copy:", error);
+            return;
+        }
         console.error("Error loading catalog products:", error);
         if (catalogItemsContainer) catalogItemsContainer.innerHTML = `<p class="error-message" style="text-align:center; padding: 20px;">${error.message}</p>`;
         if (noCatalogItemsMessage) noCatalogItemsMessage.style.display = 'none';
@@ -121,41 +121,22 @@ async function loadUserPointsAndAvailableGifts() {
         return;
     }
 
-    // 1. Fetch User Points
-    try {
-        const profileResponse = await fetch(`${API_BASE_URL}/api/me/profile/`, {
-            headers: { 'Authorization': `Bearer ${token}` }
-        });
-        if (profileResponse.status === 401) { logout(); window.location.href = 'login.html'; return; }
-        if (!profileResponse.ok) throw new Error('No se pudieron cargar tus puntos.');
-        const userData = await profileResponse.json();
-        currentUserAvailablePoints = userData.client_profile?.available_points || 0;
-        if (userAvailablePointsSpan) userAvailablePointsSpan.textContent = currentUserAvailablePoints.toString();
-    } catch (error) {
-        console.error("Error fetching user points:", error);
-        if (userAvailablePointsSpan) userAvailablePointsSpan.textContent = 'Error';
-        // Proceed to load gifts even if points display fails, as they might still be viewable.
-    }
-
-    // 2. Fetch Active Gift Items
     if (!giftItemsContainer) {
         console.error("Gift items container not found in DOM.");
         return;
     }
+    // One round trip: the caller's points plus active, in-stock gifts (cheapest first)
     try {
-        const giftsResponse = await fetch(`${API_BASE_URL}/api/admin/gift-items/?is_active=true&limit=100`, {
-            headers: token ? { 'Authorization': `Bearer ${token}` } : {} // Admin endpoint, but GET might be open to auth users
+        const giftsResponse = await fetch(`${API_BASE_URL}/api/me/redeem/gifts/`, {
+            headers: { 'Authorization': `Bearer ${token}` }
         });
-        if (giftsResponse.status === 401 || giftsResponse.status === 403) {
-            // If GET /api/admin/gift-items/ is strictly admin, this page won't work for normal users.
-            // This implies a public endpoint for gifts might be needed if admin one is too restrictive.
-            // For now, assuming authenticated users can at least GET from this admin endpoint.
-            console.warn("Authorization error fetching gift items. This might require admin rights or a public gift endpoint.");
-            logout(); window.location.href = 'login.html'; return;
-        }
+        if (giftsResponse.status === 401 || giftsResponse.status === 403) { logout(); window.location.href = 'login.html'; return; }
         if (!giftsResponse.ok) throw new Error('No se pudieron cargar los regalos disponibles.');
 
-        const giftItems = await giftsResponse.json();
+        const giftsData = await giftsResponse.json();
+        currentUserAvailablePoints = giftsData.available_points || 0;
+        if (userAvailablePointsSpan) userAvailablePointsSpan.textContent = currentUserAvailablePoints.toString();
+        const giftItems = giftsData.gifts;
 
         giftItemsContainer.innerHTML = '';
         if (giftItems.length === 0) {
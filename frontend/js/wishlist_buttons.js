@@ -3,6 +3,30 @@
 // Assumes API_BASE_URL, getToken, logout, isLoggedIn are global from auth.js
 // Assumes FontAwesome icons are available for heart icons via CSS.
 
+// One request per page: every button awaits the same promise for the user's wishlisted product ids.
+let wishlistProductIdsPromise = null;
+
+function getWishlistProductIds() {
+    if (!wishlistProductIdsPromise) {
+        wishlistProductIdsPromise = fetch(`${API_BASE_URL}/api/me/wishlist/product-ids/`, {
+            headers: { 'Authorization': `Bearer ${getToken()}` }
+        }).then(async response => {
+            if (response.ok) {
+                const data = await response.json();
+                return new Set(data.product_ids);
+            }
+            // On 401 or other errors the buttons simply appear as 'not in wishlist'.
+            console.warn(`Could not load wishlist product ids (status: ${response.status}).`);
+            return new Set();
+        }).catch(error => {
+            console.warn('Exception loading wishlist product ids:', error);
+            wishlistProductIdsPromise = null; // Allow a retry on the next render
+            return new Set();
+        });
+    }
+    return wishlistProductIdsPromise;
+}
+
 async function renderWishlistButton(productId, containerElement) {
     if (!isLoggedIn()) {
         containerElement.innerHTML = '-';
@@ -15,27 +39,8 @@ async function renderWishlistButton(productId, containerElement) {
         return;
     }
 
-    let isInWishlist = false;
-
-    // Check initial status
-    try {
-        const checkResponse = await fetch(`${API_BASE_URL}/api/me/wishlist/check/${productId}/`, {
-            headers: { 'Authorization': `Bearer ${token}` }
-        });
-        if (checkResponse.ok) {
-            const checkData = await checkResponse.json();
-            isInWishlist = checkData.in_wishlist;
-        } else if (checkResponse.status === 401) {
-            // Potentially logout and redirect if token is invalid for this check
-            // For now, just log it and button will appear as 'not in wishlist'.
-            console.warn(`Auth error checking wishlist status for product ${productId}.`);
-            // logout(); window.location.href = 'login.html'; return; // More aggressive
-        } else {
-            console.warn(`Could not check wishlist status for product ${productId} (status: ${checkResponse.status}).`);
-        }
-    } catch (error) {
-        console.warn(`Exception checking wishlist status for product ${productId}:`, error);
-    }
+    const wishlistProductIds = await getWishlistProductIds();
+    const isInWishlist = wishlistProductIds.has(parseInt(productId));
 
     const button = document.createElement('button');
     button.classList.add('wishlist-toggle-button');
@@ -96,8 +101,11 @@ async function handleWishlistButtonClick(event) {
             throw new Error(errorData.detail || `Error al actualizar wishlist (${response.status})`);
         }
 
-        // Toggle button state
+        // Toggle button state and keep the shared id set in sync
         button.classList.toggle('in-wishlist');
+        const wishlistProductIds = await getWishlistProductIds();
+        if (button.classList.contains('in-wishlist')) wishlistProductIds.add(parseInt(productId));
+        else wishlistProductIds.delete(parseInt(productId));
 
         // Optional: update icon if using different classes for filled/empty, e.g., far vs fas for FontAwesome
         // if (button.classList.contains('in-wishlist')) {
@@ -0,0 +1,111 @@
+"""
+Daily rollups must always equal a GROUP BY over the raw sales tables.
+
+Runs against a throwaway SQLite file; needs backend/requirements.txt installed. From the project root:
+    python -m pytest tests
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+from sqlmodel import Session, SQLModel, create_engine
+
+from backend.database import (
+    User, Category, Product, Sale, SaleItem, SaleUpdate, SaleStatusEnum, SaleDailyRollup, SaleItemDailyRollup,
+)
+from backend.rollups import apply_rollup_delta, sale_contributions, verify_rollups, rebuild_rollups, NO_CONTRIBUTIONS
+
+
+@pytest.fixture
+def test_engine(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # backend.main creates its static/ folders in the working directory
+    engine = create_engine(f"sqlite:///{tmp_path / 'rollups.db'}")
+    SQLModel.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def create_sale(session: Session, user: User, lines, sale_date: datetime, status: SaleStatusEnum = SaleStatusEnum.PENDIENTE_PREPARACION) -> Sale:
+    """Writes a sale the way the sale endpoints do: rows and rollup delta in one transaction."""
+    sale = Sale(user_id=user.id, sale_date=sale_date, status=status)
+    sale.items = [SaleItem(product_id=product.id, quantity=quantity, price_at_sale=product.price_showroom, subtotal=round(product.price_showroom * quantity, 2)) for product, quantity in lines]
+    sale.total_amount = round(sum(item.subtotal for item in sale.items), 2)
+    session.add(sale); session.flush()
+    for item in sale.items: session.refresh(item)
+    apply_rollup_delta(session, NO_CONTRIBUTIONS, sale_contributions(sale))
+    session.commit(); session.refresh(sale)
+    return sale
+
+
+def rollup_rows(session: Session):
+    """Non-empty rollup rows; rows that netted out to zero are only dropped by the rebuild."""
+    sale_table, item_table = SaleDailyRollup.__table__, SaleItemDailyRollup.__table__
+    sale_rows = session.execute(select(sale_table).where(sale_table.c.sale_count != 0).order_by(*sale_table.primary_key.columns)).all()
+    item_rows = session.execute(select(item_table).where(item_table.c.line_count != 0).order_by(*item_table.primary_key.columns)).all()
+    return sale_rows, item_rows
+
+
+def test_rollups_follow_sale_writes(test_engine):
+    from backend import main # Imported late: module import touches the working directory
+
+    today = datetime.utcnow().replace(hour=12, minute=0, second=0, microsecond=0)
+    with Session(test_engine) as session:
+        admin = User(email="admin@example.com", hashed_password="x", is_superuser=True)
+        client = User(email="cliente@example.com", hashed_password="x")
+        category = Category(name="Perfumería")
+        session.add_all([admin, client, category]); session.commit()
+        perfume = Product(name="Perfume", price_showroom=100.0, stock_actual=50, category_id=category.id)
+        crema = Product(name="Crema", price_showroom=35.5, stock_actual=50)
+        session.add_all([perfume, crema]); session.commit()
+
+        first = create_sale(session, client, [(perfume, 2), (crema, 1)], today)
+        second = create_sale(session, client, [(perfume, 1)], today - timedelta(days=1))
+        third = create_sale(session, admin, [(crema, 3), (perfume, 1)], today)
+
+        main.update_sale_details(first.id, SaleUpdate(discount_amount=15.0), session=session, current_user=admin)
+        main.update_sale_details(first.id, SaleUpdate(status=SaleStatusEnum.COBRADO), session=session, current_user=admin)
+        main.update_sale_details(second.id, SaleUpdate(status=SaleStatusEnum.CANCELADO), session=session, current_user=admin)
+        main.update_sale_details(third.id, SaleUpdate(status=SaleStatusEnum.CANCELADO), session=session, current_user=admin)
+        main.update_sale_details(third.id, SaleUpdate(status=SaleStatusEnum.PENDIENTE_PREPARACION), session=session, current_user=admin)
+
+        day_from, day_to = (today - timedelta(days=2)).date(), today.date()
+        assert verify_rollups(session, day_from, day_to) == []
+        incremental = rollup_rows(session)
+        assert incremental[0] and incremental[1]
+
+    rebuild_rollups(day_from, day_to, target_engine=test_engine)
+    with Session(test_engine) as session:
+        assert rollup_rows(session) == incremental
+        assert verify_rollups(session, day_from, day_to) == []
+
+
+def test_first_rows_of_a_day_from_two_writers(test_engine):
+    """Both transactions see no rollup row for the day; the upsert makes the second one add instead of failing."""
+    today = datetime.utcnow().replace(hour=12, minute=0, second=0, microsecond=0)
+    with Session(test_engine) as session:
+        client = User(email="cliente@example.com", hashed_password="x")
+        session.add(client); session.commit()
+        product = Product(name="Jabón", price_showroom=10.0, stock_actual=50)
+        session.add(product); session.commit()
+        client_id, product_id = client.id, product.id
+
+    contributions = []
+    with Session(test_engine) as session:
+        for quantity in (1, 4):
+            sale = Sale(user_id=client_id, sale_date=today, total_amount=10.0 * quantity)
+            sale.items = [SaleItem(product_id=product_id, quantity=quantity, price_at_sale=10.0, subtotal=10.0 * quantity)]
+            session.add(sale); session.commit()
+            for item in sale.items: session.refresh(item)
+            contributions.append(sale_contributions(sale)) # Captured before any rollup row exists
+
+    for contribution in contributions:
+        with Session(test_engine) as session:
+            apply_rollup_delta(session, NO_CONTRIBUTIONS, contribution)
+            session.commit()
+
+    with Session(test_engine) as session:
+        sale_row = session.get(SaleDailyRollup, (today.date(), client_id, SaleStatusEnum.PENDIENTE_PREPARACION))
+        item_row = session.get(SaleItemDailyRollup, (today.date(), product_id, SaleStatusEnum.PENDIENTE_PREPARACION))
+        assert (sale_row.sale_count, sale_row.total_amount) == (2, 50.0)
+        assert (item_row.units, item_row.revenue, item_row.line_count) == (5, 50.0, 2)
+        assert verify_rollups(session, today.date(), today.date()) == []